@@ -0,0 +1,219 @@
+import os
+import glob
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from watermark import add_watermark, preload, BACKENDS, COLOR_MAP, COMPACT_LEVELS, POSITION_MAP
+from metrics import JsonLinesSink, Metrics
+from cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, ResultCache
+from manifest import DEFAULT_MAX_ATTEMPTS, Manifest, append_record, options_digest, start_record, sync_file
+
+SUPPORTED_EXTENSIONS = tuple(BACKENDS)
+
+def parse_color(value):
+    if value in COLOR_MAP:
+        return COLOR_MAP[value]
+    text = value.strip()
+    if text.startswith('#') and len(text) == 7:
+        return tuple(int(text[i:i + 2], 16) for i in (1, 3, 5))
+    parts = [p.strip() for p in text.split(',')]
+    if len(parts) == 3 and all(p.isdigit() and int(p) <= 255 for p in parts):
+        return tuple(int(p) for p in parts)
+    raise ValueError(f'Unknown color {value!r}: use a name ({", ".join(COLOR_MAP)}), #rrggbb or r,g,b')
+
+def collect_inputs(sources, recursive=False):
+    found = []
+    for source in sources:
+        if os.path.isdir(source):
+            pattern = os.path.join(source, '**', '*') if recursive else os.path.join(source, '*')
+            candidates = glob.glob(pattern, recursive=recursive)
+        else:
+            candidates = glob.glob(source, recursive=recursive) or [source]
+        for path in sorted(candidates):
+            if os.path.isfile(path) and os.path.splitext(path)[1].lower() in SUPPORTED_EXTENSIONS:
+                found.append(path)
+    # Keep the first occurrence when globs overlap
+    seen = set()
+    unique = []
+    for path in found:
+        key = os.path.abspath(path)
+        if key not in seen:
+            seen.add(key)
+            unique.append(path)
+    return unique
+
+def output_path_for(input_path, output_dir=None, suffix='_watermarked', keep_format=False):
+    base, ext = os.path.splitext(os.path.basename(input_path))
+    # Word documents are converted, same as in the GUI, unless they keep their format
+    if ext.lower() == '.docx' and not keep_format:
+        ext = '.pdf'
+    directory = output_dir if output_dir else os.path.dirname(input_path)
+    return os.path.join(directory, base + suffix + ext)
+
+def _process_one(input_path, output_path, watermark_text, options, metrics_path=None, journal=None):
+    # journal: (manifest path, options digest); the attempt is logged before any work starts
+    start = time.perf_counter()
+    sink = JsonLinesSink(metrics_path) if metrics_path else None
+    try:
+        if journal:
+            append_record(journal[0], start_record(input_path, output_path, journal[1]))
+        metrics = Metrics(sink, document=input_path) if sink else None
+        pages = add_watermark(input_path, watermark_text, output_path, metrics=metrics, **options)
+        if journal:
+            sync_file(output_path)
+        return input_path, output_path, True, pages or 0, time.perf_counter() - start, None
+    except Exception as e:
+        return input_path, output_path, False, 0, time.perf_counter() - start, f'{type(e).__name__}: {e}'
+    finally:
+        if sink:
+            sink.close()
+
+def run_batch(inputs, watermark_text, output_dir=None, color=(80,80,80), opacity=80, position='Center Diagonal', font_size=48, password=None, workers=None, suffix='_watermarked', streaming=False, memory_budget=None, shards=None, keep_format=False, incremental=False, metrics_path=None, result_callback=None, cache=None, manifest=None, compact=0):
+    # manifest: a manifest.Manifest; inputs it has finished are skipped and every attempt is journalled
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    options = dict(color=color, opacity=opacity, position=position, font_size=font_size, password=password, streaming=streaming, memory_budget=memory_budget, shards=shards, incremental=incremental, cache=cache, compact=compact)
+    results = []
+    skipped = []
+    quarantined = []
+    jobs = []
+    if manifest is not None:
+        manifest.load()
+    for path in inputs:
+        output_path = output_path_for(path, output_dir, suffix, keep_format)
+        journal = None
+        if manifest is not None:
+            options_key = options_digest(watermark_text, output_path, options)
+            plan = manifest.plan(path, output_path, options_key)
+            if plan == 'skip':
+                skipped.append(path)
+                continue
+            if plan == 'quarantined':
+                quarantined.append(path)
+                continue
+            journal = (manifest.path, options_key)
+        jobs.append((path, output_path, journal))
+
+    def finish(result, job):
+        journal = job[2]
+        if journal:
+            input_path, output_path, ok, pages, seconds, error = result
+            record = dict(input=input_path, output=output_path, options=journal[1], seconds=seconds, time=time.time())
+            manifest.record(dict(record, status='done', pages=pages) if ok else dict(record, status='failed', error=error))
+        results.append(result)
+        if result_callback:
+            result_callback(*result)
+
+    def run_pool(pool_jobs, max_workers):
+        # Runs jobs in a process pool and returns those lost when a worker was killed
+        lost = []
+        # Workers import the backends this batch needs before their first document arrives
+        formats = tuple(sorted({os.path.splitext(path)[1].lower() for path, _, _ in pool_jobs}))
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=preload, initargs=formats) as pool:
+            futures = {
+                pool.submit(_process_one, path, output_path, watermark_text, options, metrics_path, journal): (path, output_path, journal)
+                for path, output_path, journal in pool_jobs
+            }
+            for future in as_completed(futures):
+                try:
+                    finish(future.result(), futures[future])
+                except BrokenProcessPool:
+                    lost.append(futures[future])
+        return lost
+
+    def died(job):
+        path, output_path, journal = job
+        finish((path, output_path, False, 0, 0.0, 'Worker process died (out of memory?)'), job)
+
+    start = time.perf_counter()
+    if shards:
+        # Each document already uses every core, so documents go one at a time
+        for job in jobs:
+            path, output_path, journal = job
+            finish(_process_one(path, output_path, watermark_text, options, metrics_path, journal), job)
+    elif jobs:
+        lost = run_pool(jobs, workers)
+        # A killed worker (out of memory, say) takes the whole pool down. With a journal the
+        # files that were in flight are known: they run again one at a time, so only the one
+        # that kills its worker fails, and files that had not started go to a fresh pool.
+        while lost and manifest is not None:
+            manifest.load()
+            in_flight = [job for job in lost if manifest.states.get(os.path.abspath(job[0]), {}).get('status') == 'started']
+            if not in_flight:
+                break
+            queued = [job for job in lost if job not in in_flight]
+            for job in in_flight:
+                if run_pool([job], 1):
+                    died(job)
+            lost = run_pool(queued, workers) if queued else []
+        for job in lost:
+            died(job)
+    elapsed = time.perf_counter() - start
+    pages = sum(r[3] for r in results)
+    failed = sum(1 for r in results if not r[2])
+    return {
+        'files': len(results),
+        'failed': failed,
+        'skipped': skipped,
+        'quarantined': quarantined,
+        'pages': pages,
+        'seconds': elapsed,
+        'files_per_sec': len(results) / elapsed if elapsed > 0 else 0.0,
+        'pages_per_sec': pages / elapsed if elapsed > 0 else 0.0,
+        'results': results,
+    }
+
+def add_arguments(parser):
+    parser.add_argument('inputs', nargs='+', help='Files, directories or glob patterns to watermark')
+    parser.add_argument('-t', '--text', required=True, help='Watermark text')
+    parser.add_argument('-o', '--output-dir', help='Directory for the watermarked files (default: next to each input)')
+    parser.add_argument('--suffix', default='_watermarked', help='Suffix added to output file names')
+    parser.add_argument('--color', default='Light Gray', help='Color name, #rrggbb or r,g,b')
+    parser.add_argument('--opacity', type=int, default=80, help='Opacity in percent (10-100)')
+    parser.add_argument('--position', default='Center Diagonal', choices=POSITION_MAP)
+    parser.add_argument('--font-size', type=int, default=48)
+    parser.add_argument('--password', help='Password protect the output PDFs')
+    parser.add_argument('-r', '--recursive', action='store_true', help='Descend into subdirectories')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='Worker processes (default: number of CPUs)')
+    parser.add_argument('--streaming', action='store_true', help='Write PDFs in bounded-memory page windows')
+    parser.add_argument('--memory-budget', type=int, default=None, metavar='MB', help='Peak memory per worker in streaming mode')
+    parser.add_argument('--incremental', action='store_true', help='Append the watermark to an unchanged copy of each PDF (no password)')
+    parser.add_argument('--keep-format', action='store_true', help='Write Word documents as .docx with a vector watermark instead of converting them to PDF')
+    parser.add_argument('--metrics', metavar='FILE', help='Append per-stage timing events for every document to FILE as JSON lines')
+    parser.add_argument('--cache', nargs='?', const=DEFAULT_CACHE_DIR, metavar='DIR', help=f'Reuse results of identical earlier jobs from DIR (default: {DEFAULT_CACHE_DIR})')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024), metavar='MB', help='Evict least recently used cache entries beyond this size')
+    parser.add_argument('--compact', type=int, default=0, choices=sorted(COMPACT_LEVELS), metavar='LEVEL',
+                        help='Shrink output PDFs: ' + ', '.join(f'{level} {name}' for level, name in COMPACT_LEVELS.items()) + ' (each level includes the ones before it)')
+    parser.add_argument('--shards', type=int, default=None, help='Split each PDF into this many page ranges processed in parallel')
+    parser.add_argument('--manifest', metavar='FILE', help='Journal every file to FILE; running the same batch again skips finished files and retries failed ones')
+    parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS, metavar='N', help='With --manifest, quarantine files that failed this many times')
+
+def main(args):
+    try:
+        color = parse_color(args.color)
+    except ValueError as e:
+        print(e)
+        return 2
+    inputs = collect_inputs(args.inputs, recursive=args.recursive)
+    if not inputs:
+        print('No PDF, Word (.docx) or PowerPoint (.pptx) files found.')
+        return 1
+    cache = ResultCache(args.cache, args.cache_size * 1024 * 1024) if args.cache else None
+    manifest = Manifest(args.manifest, max_attempts=args.max_attempts) if args.manifest else None
+
+    def report(input_path, output_path, ok, pages, seconds, error):
+        if ok:
+            print(f'OK    {input_path} -> {output_path} ({pages} pages, {seconds:.2f}s)', flush=True)
+        else:
+            print(f'FAIL  {input_path}: {error}', flush=True)
+
+    summary = run_batch(inputs, args.text, output_dir=args.output_dir, color=color, opacity=args.opacity, position=args.position, font_size=args.font_size, password=args.password, workers=args.workers, suffix=args.suffix, streaming=args.streaming or bool(args.memory_budget), memory_budget=args.memory_budget * 1024 * 1024 if args.memory_budget else None, shards=args.shards, keep_format=args.keep_format, incremental=args.incremental, metrics_path=args.metrics, result_callback=report, cache=cache, manifest=manifest, compact=args.compact)
+    print(f"\n{summary['files']} files, {summary['pages']} pages in {summary['seconds']:.2f}s "
+          f"({summary['files_per_sec']:.2f} files/s, {summary['pages_per_sec']:.1f} pages/s), "
+          f"{summary['failed']} failed")
+    if summary['skipped']:
+        print(f"{len(summary['skipped'])} files already done according to {args.manifest}, skipped")
+    for path in summary['quarantined']:
+        print(f'QUARANTINED  {path}: failed {args.max_attempts} times, not retried')
+    return 1 if summary['failed'] or summary['quarantined'] else 0
@@ -0,0 +1,214 @@
+"""Benchmark suite for the watermark pipeline on synthetic documents.
+
+Generates PDFs (1 to 50,000 pages, uniform or mixed page sizes, text-only or
+image-heavy) and Word documents with many sections, then times every
+position/encryption combination. Each case runs in a fresh process so peak
+RSS is its own. Results are written as JSON and can be compared against a
+stored baseline:
+
+    python benchmarks/bench.py --json bench.json
+    python benchmarks/bench.py --pages 1 1000 50000 --baseline bench.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import subprocess
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+PAGE_SIZES = [(612, 792), (595, 842), (842, 595), (420, 595), (1224, 792)]
+PASSWORD = 'benchmark'
+
+def synthetic_pdf(path, pages, mixed=False, images=False, seed=0):
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.utils import ImageReader
+    from PIL import Image
+    rng = random.Random(seed)
+    can = canvas.Canvas(path)
+    for i in range(pages):
+        width, height = PAGE_SIZES[i % len(PAGE_SIZES)] if mixed else PAGE_SIZES[0]
+        can.setPageSize((width, height))
+        can.setFont('Helvetica', 11)
+        for line in range(40):
+            can.drawString(54, height - 60 - line * 14, f'Page {i + 1} line {line + 1} ' + 'lorem ipsum ' * 6)
+        if images:
+            # A distinct noisy JPEG per page, so nothing is shared or deduplicated
+            noise = Image.frombytes('RGB', (160, 120), bytes(rng.getrandbits(8) for _ in range(160 * 120 * 3)))
+            buffer = BytesIO()
+            noise.save(buffer, 'JPEG', quality=85)
+            buffer.seek(0)
+            can.drawImage(ImageReader(buffer), 54, 54, width=width - 108, height=(width - 108) * 0.75)
+        can.showPage()
+    can.save()
+    return path
+
+def synthetic_docx(path, sections, paragraphs=8, seed=0):
+    from docx import Document
+    from docx.enum.section import WD_SECTION, WD_ORIENT
+    rng = random.Random(seed)
+    doc = Document()
+    for i in range(sections):
+        section = doc.sections[0] if i == 0 else doc.add_section(WD_SECTION.NEW_PAGE)
+        if i % 3 == 2:
+            # Every third section is landscape with its own header; the rest are linked
+            section.orientation = WD_ORIENT.LANDSCAPE
+            section.page_width, section.page_height = section.page_height, section.page_width
+            section.header.is_linked_to_previous = False
+            section.header.paragraphs[0].text = f'Section {i + 1}'
+        for _ in range(paragraphs):
+            doc.add_paragraph(' '.join(rng.choice(('alpha', 'beta', 'gamma', 'delta')) for _ in range(60)))
+    doc.save(path)
+    return path
+
+def fixtures(cache_dir, page_counts, sections):
+    # Generated once per parameter set and reused by later runs
+    os.makedirs(cache_dir, exist_ok=True)
+    documents = []
+    for pages in page_counts:
+        for mixed, images in ((False, False), (True, False), (True, True)):
+            if images and pages > 5000:
+                continue  # image-heavy inputs beyond this size only measure disk speed
+            name = f"pdf-{pages}{'-mixed' if mixed else ''}{'-images' if images else ''}"
+            path = os.path.join(cache_dir, name + '.pdf')
+            if not os.path.exists(path):
+                synthetic_pdf(path + '.tmp', pages, mixed=mixed, images=images)
+                os.replace(path + '.tmp', path)
+            documents.append({'name': name, 'path': path, 'format': 'pdf', 'pages': pages})
+    for count in sections:
+        name = f'docx-{count}-sections'
+        path = os.path.join(cache_dir, name + '.docx')
+        if not os.path.exists(path):
+            synthetic_docx(path + '.tmp.docx', count)
+            os.replace(path + '.tmp.docx', path)
+        documents.append({'name': name, 'path': path, 'format': 'docx', 'pages': count})
+    return documents
+
+def cases(documents, positions, quick):
+    for document in documents:
+        if document['format'] == 'pdf':
+            for position in positions:
+                for encrypted in (False, True):
+                    yield dict(document, target='add_watermark_pdf', position=position, encrypted=encrypted)
+            # The standalone re-pass the GUI used before encryption moved into the watermark pass
+            yield dict(document, target='encrypt_pdf', position=None, encrypted=True)
+            if not quick:
+                yield dict(document, target='add_watermark_pdf_streaming', position='Center Diagonal', encrypted=False)
+        else:
+            for position in positions:
+                yield dict(document, target='add_watermark_docx', position=position, encrypted=False)
+                yield dict(document, target='add_watermark_docx_vector', position=position, encrypted=False)
+    for position in positions:
+        yield dict(name='image', path=None, format='png', pages=1, target='generate_watermark_image', position=position, encrypted=False)
+
+def run_case(case, output_dir):
+    # Runs in a fresh process; the imports are part of what is measured only for peak RSS
+    import watermark
+    from pdfstream import peak_rss
+    options = dict(color=(200, 200, 200), opacity=40, position=case['position'] or 'Center Diagonal', font_size=48)
+    output = os.path.join(output_dir, f"{case['name']}.{case['target']}.out")
+    start = time.perf_counter()
+    if case['target'] == 'add_watermark_pdf':
+        watermark.add_watermark_pdf(case['path'], 'CONFIDENTIAL', output, password=PASSWORD if case['encrypted'] else None, **options)
+    elif case['target'] == 'add_watermark_pdf_streaming':
+        from pdfstream import add_watermark_pdf_streaming
+        add_watermark_pdf_streaming(case['path'], 'CONFIDENTIAL', output, **options)
+    elif case['target'] == 'encrypt_pdf':
+        watermark.encrypt_pdf(case['path'], output, PASSWORD)
+    elif case['target'] == 'add_watermark_docx':
+        watermark.add_watermark_docx(case['path'], 'CONFIDENTIAL', output, **options)
+    elif case['target'] == 'add_watermark_docx_vector':
+        watermark.add_watermark_docx_vector(case['path'], 'CONFIDENTIAL', output, **options)
+    elif case['target'] == 'generate_watermark_image':
+        os.replace(watermark.generate_watermark_image('CONFIDENTIAL', width=816, height=1056, **options), output)
+    seconds = time.perf_counter() - start
+    input_bytes = os.path.getsize(case['path']) if case['path'] else 0
+    output_bytes = os.path.getsize(output)
+    os.remove(output)
+    return {
+        'seconds': seconds,
+        'pages_per_sec': case['pages'] / seconds if seconds > 0 else 0.0,
+        'peak_rss': peak_rss(),
+        'input_bytes': input_bytes,
+        'output_bytes': output_bytes,
+        'size_growth': output_bytes - input_bytes if input_bytes else None,
+    }
+
+def case_id(case):
+    return '/'.join(str(part) for part in (case['target'], case['name'], case['position'], 'encrypted' if case['encrypted'] else 'plain'))
+
+def compare(results, baseline, tolerance):
+    # A case regresses when it is slower or uses more memory than the baseline by more than tolerance
+    previous = {r['id']: r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get(result['id'])
+        if before is None:
+            continue
+        for metric in ('seconds', 'peak_rss', 'output_bytes'):
+            if before[metric] and result[metric] > before[metric] * (1 + tolerance):
+                regressions.append((result['id'], metric, before[metric], result[metric]))
+    return regressions
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the watermark pipeline on synthetic documents')
+    parser.add_argument('--pages', type=int, nargs='+', default=[1, 100, 1000], help='PDF sizes to generate (up to 50000)')
+    parser.add_argument('--sections', type=int, nargs='+', default=[1, 50, 500], help='Section counts for the Word documents')
+    parser.add_argument('--positions', nargs='+', default=None, help='Stamp positions (default: all)')
+    parser.add_argument('--quick', action='store_true', help='Skip the streaming variant')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per case; the fastest is kept')
+    parser.add_argument('--cache-dir', default=os.path.join(REPO_ROOT, 'benchmarks', '.cache'), help='Where generated documents are kept')
+    parser.add_argument('--json', help='Write the results to this file')
+    parser.add_argument('--baseline', help='Compare against the JSON of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed slowdown/growth against the baseline (0.10 = 10%%)')
+    args = parser.parse_args()
+    from watermark import POSITION_MAP
+    documents = fixtures(args.cache_dir, args.pages, args.sections)
+    output_dir = os.path.join(args.cache_dir, 'out')
+    os.makedirs(output_dir, exist_ok=True)
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for case in cases(documents, args.positions or POSITION_MAP, args.quick):
+        runs = []
+        for _ in range(args.repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                runs.append(pool.submit(run_case, case, output_dir).result())
+        result = dict(min(runs, key=lambda r: r['seconds']), id=case_id(case), target=case['target'], document=case['name'],
+                      pages=case['pages'], position=case['position'], encrypted=case['encrypted'])
+        results.append(result)
+        print(f"{result['id']:<72} {result['seconds']:8.3f}s {result['pages_per_sec']:10.1f} p/s "
+              f"{(result['peak_rss'] or 0) / 1048576:7.1f} MB  {result['output_bytes']:>11} B", flush=True)
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+        'results': results,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for case, metric, before, after in regressions:
+            print(f'REGRESSION {case}: {metric} {before:.4g} -> {after:.4g}')
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""Compaction benchmark: output bytes saved against write time spent, per level.
+
+Watermarks three kinds of PDF at every ``compact`` level (see compact.py):
+- reportlab output with compressed streams and images;
+- the same pages without stream compression;
+- one document appended to itself several times, so fonts and images repeat.
+
+For each level it reports time, output size, bytes saved against level 0 and
+the extra seconds that saving cost. The choice of level per workload comes
+down to that last ratio.
+
+    python benchmarks/compaction.py --json compaction.json
+    python benchmarks/compaction.py --pages 1000 --copies 10 --password
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from bench import PASSWORD, git_revision, synthetic_pdf
+
+def uncompressed_pdf(path, pages):
+    from reportlab.pdfgen import canvas
+    can = canvas.Canvas(path, pageCompression=0)
+    for i in range(pages):
+        for line in range(40):
+            can.drawString(54, 732 - line * 14, f'Page {i + 1} line {line + 1} ' + 'lorem ipsum ' * 6)
+        can.showPage()
+    can.save()
+    return path
+
+def merged_pdf(path, part, copies):
+    from PyPDF2 import PdfWriter
+    writer = PdfWriter()
+    for _ in range(copies):
+        writer.append(part)
+    with open(path, 'wb') as f:
+        writer.write(f)
+    return path
+
+def fixtures(cache_dir, pages, copies):
+    os.makedirs(cache_dir, exist_ok=True)
+    part_pages = max(1, pages // copies)
+    part = os.path.join(cache_dir, f'pdf-{part_pages}-mixed-images.pdf')
+    makers = [
+        (f'pdf-{pages}-mixed-images', lambda path: synthetic_pdf(path, pages, mixed=True, images=True)),
+        (f'pdf-{pages}-uncompressed', lambda path: uncompressed_pdf(path, pages)),
+        (f'pdf-{part_pages}x{copies}-merged', lambda path: merged_pdf(path, part, copies)),
+    ]
+    if not os.path.exists(part):
+        synthetic_pdf(part + '.tmp', part_pages, mixed=True, images=True)
+        os.replace(part + '.tmp', part)
+    documents = []
+    for name, make in makers:
+        path = os.path.join(cache_dir, name + '.pdf')
+        if not os.path.exists(path):
+            make(path + '.tmp')
+            os.replace(path + '.tmp', path)
+        documents.append({'name': name, 'path': path})
+    return documents
+
+def run_case(path, output, level, password):
+    from watermark import add_watermark_pdf
+    start = time.perf_counter()
+    add_watermark_pdf(path, 'CONFIDENTIAL', output, color=(200, 200, 200), opacity=40, password=password, compact=level)
+    seconds = time.perf_counter() - start
+    output_bytes = os.path.getsize(output)
+    os.remove(output)
+    return seconds, output_bytes
+
+def main():
+    from watermark import COMPACT_LEVELS
+    parser = argparse.ArgumentParser(description='Measure bytes saved against time spent for each compaction level')
+    parser.add_argument('--pages', type=int, default=200, help='Pages per generated document')
+    parser.add_argument('--copies', type=int, default=5, help='How often the merged document repeats its part')
+    parser.add_argument('--levels', type=int, nargs='+', default=sorted(COMPACT_LEVELS), choices=sorted(COMPACT_LEVELS))
+    parser.add_argument('--password', action='store_true', help='Also measure encrypted output')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per case; the fastest is kept')
+    parser.add_argument('--cache-dir', default=os.path.join(REPO_ROOT, 'benchmarks', '.cache'), help='Where generated documents are kept')
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+    levels = sorted(set(args.levels) | {0})
+    documents = fixtures(args.cache_dir, args.pages, args.copies)
+    output = os.path.join(args.cache_dir, 'out', 'compaction.pdf')
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    results = []
+    print(f"{'case':<44} {'seconds':>8} {'bytes':>11} {'saved':>11} {'saved %':>8} {'extra s':>8} {'KB saved/s':>11}")
+    for document in documents:
+        for password in ((None, PASSWORD) if args.password else (None,)):
+            baseline = None
+            for level in levels:
+                runs = [run_case(document['path'], output, level, password) for _ in range(args.repeat)]
+                seconds, output_bytes = min(runs)
+                if baseline is None:
+                    baseline = (seconds, output_bytes)
+                saved = baseline[1] - output_bytes
+                extra = seconds - baseline[0]
+                result = {
+                    'id': '/'.join((document['name'], 'encrypted' if password else 'plain', f'level-{level}')),
+                    'document': document['name'],
+                    'encrypted': bool(password),
+                    'level': level,
+                    'level_name': COMPACT_LEVELS[level],
+                    'seconds': seconds,
+                    'input_bytes': os.path.getsize(document['path']),
+                    'output_bytes': output_bytes,
+                    'saved_bytes': saved,
+                    'saved_ratio': saved / baseline[1] if baseline[1] else 0.0,
+                    'extra_seconds': extra,
+                    # Saving per second of extra write time; None when it cost nothing measurable
+                    'saved_per_second': saved / extra if extra > 0 else None,
+                }
+                results.append(result)
+                rate = f"{result['saved_per_second'] / 1024:11.0f}" if result['saved_per_second'] is not None else f"{'-':>11}"
+                print(f"{result['id']:<44} {seconds:8.3f} {output_bytes:>11} {saved:>11} {result['saved_ratio']:8.1%} {extra:8.3f} {rate}", flush=True)
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+        'results': results,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""Load test for the local watermark service (python -m watermark serve).
+
+Submits a synthetic PDF at several concurrency levels and reports p50/p99
+end-to-end latency (submit, poll, download) and throughput per level.
+
+    python benchmarks/loadtest.py --spawn --concurrency 1 4 16 --requests 64
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import subprocess
+from io import BytesIO
+from urllib.parse import urlencode
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def synthetic_pdf(pages):
+    from reportlab.pdfgen import canvas
+    buffer = BytesIO()
+    can = canvas.Canvas(buffer)
+    for i in range(pages):
+        can.drawString(72, 720, f'Load test page {i + 1}')
+        can.showPage()
+    can.save()
+    return buffer.getvalue()
+
+async def request(host, port, method, path, body=b''):
+    reader, writer = await asyncio.open_connection(host, port)
+    head = f'{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n'
+    writer.write(head.encode('latin-1') + body)
+    await writer.drain()
+    status_line = await reader.readline()
+    status = int(status_line.split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    payload = await reader.readexactly(length) if length else b''
+    writer.close()
+    return status, payload
+
+async def run_job(host, port, document, query, poll_interval):
+    start = time.perf_counter()
+    rejected = 0
+    while True:
+        status, payload = await request(host, port, 'POST', '/jobs?' + query, document)
+        if status != 429:
+            break
+        rejected += 1
+        await asyncio.sleep(poll_interval * 4)
+    if status != 202:
+        raise RuntimeError(f'submit failed with {status}: {payload[:200]!r}')
+    job_id = json.loads(payload)['id']
+    while True:
+        status, payload = await request(host, port, 'GET', f'/jobs/{job_id}')
+        state = json.loads(payload)['status']
+        if state == 'done':
+            break
+        if state == 'failed':
+            raise RuntimeError(json.loads(payload).get('error'))
+        await asyncio.sleep(poll_interval)
+    status, result = await request(host, port, 'GET', f'/jobs/{job_id}/result')
+    await request(host, port, 'DELETE', f'/jobs/{job_id}')
+    return time.perf_counter() - start, rejected, len(result)
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+async def run_level(host, port, document, query, concurrency, total, poll_interval):
+    latencies = []
+    rejected = 0
+    remaining = iter(range(total))
+
+    async def client():
+        nonlocal rejected
+        for _ in remaining:
+            latency, rejects, _ = await run_job(host, port, document, query, poll_interval)
+            latencies.append(latency)
+            rejected += rejects
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'throughput_rps': len(latencies) / elapsed,
+        'rejected_429': rejected,
+    }
+
+async def wait_for_service(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            status, _ = await request(host, port, 'GET', '/health')
+            if status == 200:
+                return
+        except OSError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError('Service did not come up')
+
+async def main_async(args):
+    document = synthetic_pdf(args.pages)
+    query = urlencode({'text': 'LOAD TEST', 'opacity': 40})
+    await wait_for_service(args.host, args.port)
+    results = []
+    for concurrency in args.concurrency:
+        result = await run_level(args.host, args.port, document, query, concurrency, args.requests, args.poll_interval)
+        results.append(result)
+        print(f"c={result['concurrency']:<4} n={result['requests']:<5} p50={result['p50_ms']:8.1f} ms  "
+              f"p99={result['p99_ms']:8.1f} ms  {result['throughput_rps']:7.2f} req/s  429s={result['rejected_429']}", flush=True)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the local watermark service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--spawn', action='store_true', help='Start python -m watermark serve for the run')
+    parser.add_argument('--workers', type=int, default=None, help='Workers for the spawned service')
+    parser.add_argument('--queue-size', type=int, default=64, help='Queue size for the spawned service')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--requests', type=int, default=32, help='Jobs per concurrency level')
+    parser.add_argument('--pages', type=int, default=10, help='Pages in the synthetic PDF')
+    parser.add_argument('--poll-interval', type=float, default=0.02)
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+    server = None
+    if args.spawn:
+        cmd = [sys.executable, '-m', 'watermark', 'serve', '--host', args.host, '--port', str(args.port), '--queue-size', str(args.queue_size)]
+        if args.workers:
+            cmd += ['--workers', str(args.workers)]
+        server = subprocess.Popen(cmd, cwd=REPO_ROOT)
+    try:
+        results = asyncio.run(main_async(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+                server.wait()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'pages': args.pages, 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Startup-time benchmark: how long a fresh interpreter takes to become useful.
+
+Times, in a new process each, importing the entry modules, preloading each
+format backend and running a first one-page job per format. This is what the
+GUI pays before its window appears and what every spawned worker pays before
+its first document.
+
+    python benchmarks/startup.py --json startup.json
+    python benchmarks/startup.py --baseline startup.json --tolerance 0.2
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import platform
+import subprocess
+import importlib.util
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from bench import git_revision
+
+# Each snippet runs in a fresh interpreter and times itself from its first import
+SETUP = f'import sys, time\nsys.path.insert(0, {REPO_ROOT!r})\n'
+
+FORMATS = ('pdf', 'docx', 'pptx')
+
+def fixtures(directory):
+    # One-page inputs, made here so the measured processes import nothing for them
+    from reportlab.pdfgen import canvas
+    from docx import Document
+    from pptx import Presentation
+    paths = {name: os.path.join(directory, f'startup.{name}') for name in FORMATS}
+    can = canvas.Canvas(paths['pdf'])
+    can.drawString(72, 720, 'Startup benchmark')
+    can.showPage()
+    can.save()
+    Document().save(paths['docx'])
+    Presentation().save(paths['pptx'])
+    return paths
+
+def cases(formats, paths):
+    yield 'import/watermark', 'import watermark\n'
+    yield 'import/batch', 'import batch\n'
+    if importlib.util.find_spec('PyQt6') is not None:
+        yield 'import/gui', 'import gui\n'
+    for file_format in formats:
+        yield f'preload/{file_format}', f'import watermark\nwatermark.preload({file_format!r})\n'
+    for file_format in formats:
+        # Word stays Word here; converting to PDF needs Microsoft Word
+        output_format = 'docx' if file_format == 'docx' else None
+        yield f'first-job/{file_format}', (f'import watermark\ndata = open({paths[file_format]!r}, "rb").read()\n'
+                                           f'watermark.add_watermark_bytes(data, "DRAFT", file_format={file_format!r}, output_format={output_format!r})\n')
+
+def run_case(code):
+    script = SETUP + 'start = time.perf_counter()\n' + code + 'print(time.perf_counter() - start)\n'
+    result = subprocess.run([sys.executable, '-c', script], cwd=REPO_ROOT, capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return float(result.stdout.strip().splitlines()[-1])
+
+def compare(results, baseline, tolerance):
+    previous = {r['id']: r for r in baseline['results']}
+    return [(r['id'], previous[r['id']]['seconds'], r['seconds']) for r in results
+            if r['id'] in previous and r['seconds'] > previous[r['id']]['seconds'] * (1 + tolerance)]
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure import and first-job time in fresh interpreters')
+    parser.add_argument('--formats', nargs='+', default=list(FORMATS), choices=FORMATS)
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per case; the fastest is kept')
+    parser.add_argument('--json', help='Write the results to this file')
+    parser.add_argument('--baseline', help='Compare against the JSON of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.20, help='Allowed slowdown against the baseline (0.20 = 20%%)')
+    args = parser.parse_args()
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        paths = fixtures(directory)
+        for case, code in cases(args.formats, paths):
+            seconds = min(run_case(code) for _ in range(args.repeat))
+            results.append({'id': case, 'seconds': seconds})
+            print(f'{case:<24} {seconds * 1000:8.1f} ms', flush=True)
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+        'results': results,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for case, before, after in regressions:
+            print(f'REGRESSION {case}: {before * 1000:.1f} ms -> {after * 1000:.1f} ms')
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,159 @@
+import os
+import json
+import shutil
+import hashlib
+
+from metrics import NULL_METRICS
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'document-watermarker')
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+# Bump when the stamping engine changes what it writes, so old entries stop matching
+CACHE_VERSION = 1
+HASH_CHUNK = 1024 * 1024
+
+class ResultCache:
+    """Content-addressed store of watermarked outputs with a size-bounded LRU.
+
+    Entries are keyed by a hash of the input bytes and every option that changes
+    the output. Password-protected jobs share entries with unprotected ones: the
+    cache holds the output before encryption and every protected job, hit or
+    miss, encrypts it in a separate parse and write pass. Passwords are never
+    stored or hashed, but the cache does keep a plaintext copy of each
+    protected document.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, source, watermark_text, file_format, output_format, **options):
+        digest = hashlib.sha256()
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            digest.update(source)
+        else:
+            with open(source, 'rb') as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+                    digest.update(chunk)
+        settings = dict(options, text=watermark_text, file_format=file_format, output_format=output_format, version=CACHE_VERSION)
+        digest.update(json.dumps(settings, sort_keys=True, default=list).encode())
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.out')
+
+    def lookup(self, key):
+        # Returns the entry's metadata, or None; a hit counts as a use for the LRU
+        path = self.path(key)
+        try:
+            with open(os.path.join(self.directory, key + '.json')) as f:
+                meta = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return meta
+
+    def store(self, key, produce):
+        # produce(path) writes the output to path and returns its page count.
+        # Everything lands under a temporary name first and is renamed into place.
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        path = self.path(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            pages = produce(tmp_path)
+            meta_tmp = f'{tmp_path}.json'
+            with open(meta_tmp, 'w') as f:
+                json.dump({'pages': pages}, f)
+            os.replace(meta_tmp, os.path.join(self.directory, key + '.json'))
+            os.replace(tmp_path, path)
+        finally:
+            for leftover in (tmp_path, f'{tmp_path}.json'):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        self.evict(keep=key)
+        return {'pages': pages}
+
+    def entries(self):
+        found = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return found
+        for name in names:
+            if name.endswith('.out'):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_mtime, stat.st_size, name[:-4]))
+        return found
+
+    def evict(self, keep=None):
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            self.remove(key)
+            total -= size
+
+    def remove(self, key):
+        for path in (self.path(key), os.path.join(self.directory, key + '.json')):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        for _, _, key in self.entries():
+            self.remove(key)
+
+def _copy_entry(path, destination):
+    from watermark import is_path
+    if is_path(destination):
+        # copyfile uses the kernel's zero-copy paths where it can
+        tmp_path = os.fspath(destination) + '.tmp'
+        try:
+            shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, destination)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    else:
+        with open(path, 'rb') as f:
+            shutil.copyfileobj(f, destination, HASH_CHUNK)
+
+def watermark_cached(cache, source, watermark_text, destination, file_format='pdf', output_format=None, password=None, progress_callback=None, metrics=None, cancel_token=None, **options):
+    from watermark import add_watermark_stream, encrypt_pdf, is_path, open_source
+    metrics = metrics or NULL_METRICS
+    file_format = file_format.lower().lstrip('.')
+    output_format = 'pptx' if file_format == 'pptx' else (output_format or 'pdf').lower().lstrip('.')
+    if password and output_format != 'pdf':
+        raise ValueError('Password protection is only available for PDF output.')
+    if password and options.get('incremental'):
+        raise ValueError('Incremental updates cannot add a password; the original bytes stay unencrypted.')
+    if not is_path(source) and not isinstance(source, (bytes, bytearray, memoryview)):
+        with open_source(source) as f:
+            source = f.read()
+    # Only the options that change the output are part of the key
+    keyed = {name: options[name] for name in ('color', 'opacity', 'position', 'font_size', 'incremental') if name in options}
+    if options.get('compact'):
+        # Keys of uncompacted results stay as they were before compaction existed
+        keyed['compact'] = options['compact']
+    with metrics.stage('cache'):
+        key = cache.key(source, watermark_text, file_format, output_format, **keyed)
+        meta = cache.lookup(key)
+    metrics.event('cache', hit=meta is not None)
+    if meta is None:
+        meta = cache.store(key, lambda path: add_watermark_stream(source, watermark_text, path, file_format=file_format, output_format=output_format, progress_callback=progress_callback, metrics=metrics, cancel_token=cancel_token, **options))
+    elif progress_callback and meta['pages']:
+        progress_callback(meta['pages'], meta['pages'])
+    if password:
+        encrypt_pdf(cache.path(key), destination, password, metrics=metrics, cancel_token=cancel_token, compact=options.get('compact', 0))
+    else:
+        with metrics.stage('copy') as stage:
+            _copy_entry(cache.path(key), destination)
+            stage.bytes = os.path.getsize(cache.path(key))
+    return meta['pages']
@@ -0,0 +1,213 @@
+import zlib
+import hashlib
+from io import BytesIO
+
+from PyPDF2.generic import ArrayObject, DictionaryObject, EncodedStreamObject, IndirectObject, NameObject, NumberObject, StreamObject
+
+from metrics import NULL_METRICS
+from pdfstream import StreamingPdfWriter
+
+# Levels, each including the ones before it
+COMPACT_OFF = 0
+COMPACT_STREAMS = 1  # Flate-compress streams stored without a filter
+COMPACT_DEDUP = 2  # merge identical objects, drop unreachable ones, renumber
+COMPACT_OBJECT_STREAMS = 3  # pack non-stream objects into object streams behind a cross-reference stream
+
+OBJECT_STREAM_SIZE = 200
+DEDUP_ROUNDS = 8
+# Objects that stay distinct even when their contents match: pages, annotations
+# (each belongs to one page), tree nodes and optional content groups
+UNIQUE_TYPES = {'/Page', '/Pages', '/Catalog', '/Annot', '/Outlines', '/StructTreeRoot', '/StructElem', '/OCG', '/OCMD', '/Sig'}
+UNIQUE_KEYS = ('/Rect', '/Parent', '/P', '/Kids', '/First', '/Last', '/Prev', '/Next')
+
+def _references(obj):
+    if isinstance(obj, IndirectObject):
+        yield obj.idnum
+    elif isinstance(obj, DictionaryObject):
+        for value in obj.values():
+            yield from _references(value)
+    elif isinstance(obj, ArrayObject):
+        for value in obj:
+            yield from _references(value)
+
+def _remap(obj, mapping, pdf):
+    # Rewrites references in place; IndirectObjects can be shared, so they are replaced, never changed
+    if isinstance(obj, DictionaryObject):
+        for key, value in obj.items():
+            if isinstance(value, IndirectObject):
+                if value.idnum in mapping:
+                    obj[key] = IndirectObject(mapping[value.idnum], 0, pdf)
+            else:
+                _remap(value, mapping, pdf)
+    elif isinstance(obj, ArrayObject):
+        for i, value in enumerate(obj):
+            if isinstance(value, IndirectObject):
+                if value.idnum in mapping:
+                    obj[i] = IndirectObject(mapping[value.idnum], 0, pdf)
+            else:
+                _remap(value, mapping, pdf)
+
+def _mergeable(obj):
+    if not isinstance(obj, DictionaryObject):
+        return True
+    return obj.get('/Type') not in UNIQUE_TYPES and not any(key in obj for key in UNIQUE_KEYS)
+
+def compress_streams(objects):
+    compressed = 0
+    for idnum, obj in objects.items():
+        if isinstance(obj, StreamObject) and '/Filter' not in obj:
+            data = zlib.compress(obj._data)
+            # Tiny streams (the stamp's q / Q wrappers) would only grow
+            if len(data) + 20 < len(obj._data):
+                packed = EncodedStreamObject()
+                for key, value in obj.items():
+                    if key != '/Length':
+                        packed[NameObject(key)] = value
+                packed[NameObject('/Filter')] = NameObject('/FlateDecode')
+                packed._data = data
+                objects[idnum] = packed
+                compressed += 1
+    return compressed
+
+def deduplicate(objects, protected, pdf):
+    # Merging children can make their parents identical (two copies of a font
+    # whose font files were just merged), so this runs until nothing changes
+    merged = 0
+    for _ in range(DEDUP_ROUNDS):
+        canonical = {}
+        mapping = {}
+        for idnum, obj in objects.items():
+            if idnum in protected or not _mergeable(obj):
+                continue
+            buffer = BytesIO()
+            obj.write_to_stream(buffer, None)
+            digest = hashlib.sha256(buffer.getvalue()).digest()
+            if digest in canonical:
+                mapping[idnum] = canonical[digest]
+            else:
+                canonical[digest] = idnum
+        if not mapping:
+            break
+        for idnum in mapping:
+            del objects[idnum]
+        for obj in objects.values():
+            _remap(obj, mapping, pdf)
+        merged += len(mapping)
+    return merged
+
+def reachable(objects, roots):
+    found = set()
+    stack = list(roots)
+    while stack:
+        idnum = stack.pop()
+        if idnum in found or idnum not in objects:
+            continue
+        found.add(idnum)
+        stack.extend(_references(objects[idnum]))
+    return found
+
+def _write_object_streams(out, objects, root, info):
+    # Streams stay top-level objects; everything else goes into object streams,
+    # whose objects are not encrypted on their own: the object stream is
+    compressed = {}
+    loose = []
+    for idnum, obj in objects:
+        if isinstance(obj, StreamObject):
+            out.write_object(IndirectObject(idnum, 0, out), obj)
+        else:
+            loose.append((idnum, obj))
+    next_id = max([idnum for idnum, _ in objects] + list(out.offsets)) + 1
+    for start in range(0, len(loose), OBJECT_STREAM_SIZE):
+        chunk = loose[start:start + OBJECT_STREAM_SIZE]
+        offsets = []
+        body = BytesIO()
+        for index, (idnum, obj) in enumerate(chunk):
+            offsets.append(b'%d %d' % (idnum, body.tell()))
+            obj.write_to_stream(body, None)
+            body.write(b'\n')
+            compressed[idnum] = (next_id, index)
+        head = b' '.join(offsets) + b'\n'
+        stream = EncodedStreamObject()
+        stream[NameObject('/Type')] = NameObject('/ObjStm')
+        stream[NameObject('/N')] = NumberObject(len(chunk))
+        stream[NameObject('/First')] = NumberObject(len(head))
+        stream[NameObject('/Filter')] = NameObject('/FlateDecode')
+        stream._data = zlib.compress(head + body.getvalue())
+        out.write_object(IndirectObject(next_id, 0, out), stream)
+        next_id += 1
+    xref_id = next_id
+    xref_offset = out.stream.tell()
+    out.offsets[xref_id] = xref_offset
+    width = max(1, (xref_offset.bit_length() + 7) // 8)
+    rows = [b'\x00' + bytes(width) + b'\xff\xff']
+    for idnum in range(1, xref_id + 1):
+        if idnum in compressed:
+            number, index = compressed[idnum]
+            rows.append(b'\x02' + number.to_bytes(width, 'big') + index.to_bytes(2, 'big'))
+        elif idnum in out.offsets:
+            rows.append(b'\x01' + out.offsets[idnum].to_bytes(width, 'big') + b'\x00\x00')
+        else:
+            rows.append(b'\x00' + bytes(width) + b'\x00\x00')
+    xref = EncodedStreamObject()
+    xref[NameObject('/Type')] = NameObject('/XRef')
+    xref[NameObject('/Size')] = NumberObject(xref_id + 1)
+    xref[NameObject('/W')] = ArrayObject([NumberObject(1), NumberObject(width), NumberObject(2)])
+    xref[NameObject('/Root')] = root
+    if info is not None:
+        xref[NameObject('/Info')] = info
+    if out._encrypt_ref is not None:
+        xref[NameObject('/Encrypt')] = out._encrypt_ref
+        xref[NameObject('/ID')] = out._id
+    xref[NameObject('/Filter')] = NameObject('/FlateDecode')
+    xref._data = zlib.compress(b''.join(rows))
+    # The cross-reference stream itself is never encrypted
+    out.stream.write(b'%d 0 obj\n' % xref_id)
+    xref.write_to_stream(out.stream, None)
+    out.stream.write(b'\nendobj\nstartxref\n%d\n%%%%EOF\n' % xref_offset)
+    out.stream.flush()
+
+def write_compact(writer, stream, level=COMPACT_OBJECT_STREAMS, metrics=None):
+    """Writes a PyPDF2 PdfWriter's document to ``stream`` at a compaction level.
+
+    Replaces ``writer.write(stream)``; the writer is consumed. Returns counts of
+    what was done, which are also reported as a 'compact' metrics event.
+    """
+    metrics = metrics or NULL_METRICS
+    with metrics.stage('compact'):
+        if not writer._root:
+            writer._root = writer._add_object(writer._root_object)
+        writer._sweep_indirect_references(writer._root)
+        objects = {i + 1: obj for i, obj in enumerate(writer._objects) if obj is not None}
+        encrypt = writer._encrypt.idnum if hasattr(writer, '_encrypt') else None
+        encrypt_dict = objects.pop(encrypt) if encrypt is not None else None
+        roots = [writer._root.idnum] + ([writer._info.idnum] if writer._info is not None else [])
+        stats = {'level': level, 'objects': len(objects), 'streams_compressed': compress_streams(objects), 'objects_merged': 0, 'objects_dropped': 0}
+        if level >= COMPACT_DEDUP:
+            stats['objects_merged'] = deduplicate(objects, set(roots), writer)
+            keep = reachable(objects, roots)
+            stats['objects_dropped'] = len(objects) - len(keep)
+            # Dense numbering keeps the cross-reference section small; 1 is the /Encrypt dictionary
+            first = 2 if encrypt_dict is not None else 1
+            mapping = {idnum: first + i for i, idnum in enumerate(sorted(keep))}
+            objects = {mapping[idnum]: objects[idnum] for idnum in sorted(keep)}
+            for obj in objects.values():
+                _remap(obj, mapping, writer)
+            roots = [mapping[idnum] for idnum in roots]
+            encrypt = 1
+    header = writer.pdf_header
+    if level >= COMPACT_OBJECT_STREAMS and header < b'%PDF-1.5':
+        header = b'%PDF-1.5'
+    encryption = (writer._encrypt_key, encrypt_dict, writer._ID) if encrypt_dict is not None else None
+    # The /Encrypt dictionary is written first, under the number it has by now
+    out = StreamingPdfWriter(stream, header=header, encryption=encryption, first_id=encrypt or 1)
+    root = IndirectObject(roots[0], 0, out)
+    info = IndirectObject(roots[1], 0, out) if len(roots) > 1 else None
+    ordered = sorted(objects.items())
+    if level >= COMPACT_OBJECT_STREAMS:
+        _write_object_streams(out, ordered, root, info)
+    else:
+        for idnum, obj in ordered:
+            out.write_object(IndirectObject(idnum, 0, out), obj)
+        out.close(root, info)
+    metrics.event('compact', **stats)
+    return stats
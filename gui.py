@@ -1,36 +1,26 @@
 from PyQt6.QtWidgets import (
-    QApplication, QWidget, QVBoxLayout, QLabel, QPushButton, QLineEdit, QFileDialog, QMessageBox, QHBoxLayout, QDialog, QProgressBar, QComboBox, QSlider, QFrame, QCheckBox
+    QApplication, QWidget, QVBoxLayout, QLabel, QPushButton, QLineEdit, QFileDialog, QMessageBox, QHBoxLayout, QDialog, QProgressBar, QComboBox, QSlider, QFrame, QCheckBox,
+    QTableWidget, QTableWidgetItem, QHeaderView, QAbstractItemView, QSpinBox
 )
-from PyQt6.QtCore import Qt, QThread, pyqtSignal
-from PyQt6.QtGui import QFont, QPalette, QColor
+from PyQt6.QtCore import Qt, QThread, QTimer, pyqtSignal
+from PyQt6.QtGui import QFont, QPalette, QColor, QPixmap
 import sys
-from watermark import add_watermark
+import time
+from watermark import add_watermark, COLOR_MAP, POSITION_MAP
+from metrics import Metrics
+from cache import ResultCache
+from progress import CancelToken, ThrottledProgress
+from batch import collect_inputs, output_path_for
+from jobqueue import JobQueue
+from preview import PreviewRenderer
 import os
 
-COLOR_MAP = {
-    'Black': (0, 0, 0),
-    'White': (255, 255, 255),
-    'Gray': (128, 128, 128),
-    'Light Gray': (200, 200, 200),
-    'Red': (220, 38, 38),
-    'Blue': (37, 99, 235),
-    'Green': (16, 185, 129),
-}
-
-POSITION_MAP = [
-    'Center Diagonal',
-    'Center',
-    'Top-left',
-    'Top-right',
-    'Bottom-left',
-    'Bottom-right',
-]
-
 class WatermarkWorker(QThread):
     finished = pyqtSignal(bool, str)
     progress = pyqtSignal(int, int)  # current, total
+    rate = pyqtSignal(float, float)  # pages per second, seconds left
 
-    def __init__(self, input_path, watermark_text, save_path, color, opacity, position, font_size, password=None):
+    def __init__(self, input_path, watermark_text, save_path, color, opacity, position, font_size, password=None, cache=None):
         super().__init__()
         self.input_path = input_path
         self.watermark_text = watermark_text
@@ -40,22 +30,44 @@ class WatermarkWorker(QThread):
         self.position = position
         self.font_size = font_size
         self.password = password
+        self.cache = cache
+        self.cancel_token = CancelToken()
+
+    def cancel(self):
+        self.cancel_token.cancel()
 
     def run(self):
         try:
+            # Rates are measured from the start of the stamp stage, so parsing
+            # and conversion time do not drag the pages/sec figure down
+            stamp_started = [None]
+
+            def on_metric(event):
+                if event.get('stage') == 'stamp' and event['event'] == 'start':
+                    stamp_started[0] = event['time']
+
+            # At most ten updates a second, so long documents do not flood the event loop
+            @ThrottledProgress
             def progress_callback(current, total):
                 self.progress.emit(current, total)
-            add_watermark(self.input_path, self.watermark_text, self.save_path, color=self.color, opacity=self.opacity, position=self.position, font_size=self.font_size, password=self.password, progress_callback=progress_callback)
+                if stamp_started[0] is not None:
+                    elapsed = time.time() - stamp_started[0]
+                    if elapsed > 0:
+                        pages_per_sec = current / elapsed
+                        self.rate.emit(pages_per_sec, (total - current) / pages_per_sec)
+            add_watermark(self.input_path, self.watermark_text, self.save_path, color=self.color, opacity=self.opacity, position=self.position, font_size=self.font_size, password=self.password, progress_callback=progress_callback, metrics=Metrics(on_metric), cache=self.cache, cancel_token=self.cancel_token)
             self.finished.emit(True, self.save_path)
         except Exception as e:
             self.finished.emit(False, str(e))
 
 class ProgressDialog(QDialog):
+    cancel_requested = pyqtSignal()
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setWindowTitle('Processing...')
         self.setModal(True)
-        self.setFixedSize(350, 120)
+        self.setFixedSize(350, 195)
         layout = QVBoxLayout()
         self.label = QLabel('Adding watermark, please wait...')
         self.label.setAlignment(Qt.AlignmentFlag.AlignCenter)
@@ -69,6 +81,13 @@ class ProgressDialog(QDialog):
         self.page_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self.page_label.setStyleSheet('color: #1976d2; font-weight: bold; font-size: 14px;')
         layout.addWidget(self.page_label)
+        self.rate_label = QLabel('')
+        self.rate_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.rate_label.setStyleSheet('color: #1976d2; font-size: 13px;')
+        layout.addWidget(self.rate_label)
+        self.cancel_btn = QPushButton('Cancel')
+        self.cancel_btn.clicked.connect(self.reject)
+        layout.addWidget(self.cancel_btn)
         self.setLayout(layout)
         self.setStyleSheet('QDialog { color: #1976d2; font-size: 15px; }')
 
@@ -81,16 +100,206 @@ class ProgressDialog(QDialog):
             self.progress.setValue(0)
             self.page_label.setText('')
 
+    def set_rate(self, pages_per_sec, seconds_left):
+        self.rate_label.setText(f'{pages_per_sec:.0f} pages/sec, about {int(seconds_left + 0.5)}s left')
+
+    def reject(self):
+        # Cancel, Escape and the close button all end up here. The dialog stays
+        # open until the worker stops at its next page and finishes.
+        self.label.setText('Cancelling...')
+        self.cancel_btn.setEnabled(False)
+        self.cancel_requested.emit()
+
+class QueuePanel(QFrame):
+    # Several files at once: they run in worker processes and the window stays usable
+    POLL_MS = 100
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.queue = JobQueue()
+        self.rows = {}
+        self.pages = {}
+        self.started = None
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.poll)
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.table = QTableWidget(0, 4)
+        self.table.setHorizontalHeaderLabels(['File', 'Progress', 'Status', ''])
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        self.table.horizontalHeader().setSectionResizeMode(2, QHeaderView.ResizeMode.Stretch)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.setObjectName('queueTable')
+        layout.addWidget(self.table)
+        self.summary_label = QLabel('')
+        self.summary_label.setObjectName('settingLabel')
+        layout.addWidget(self.summary_label)
+        self.setLayout(layout)
+        self.setVisible(False)
+
+    def add_jobs(self, inputs, watermark_text, options):
+        for path in inputs:
+            output_path = output_path_for(path)
+            job_id = self.queue.submit(path, output_path, watermark_text, options)
+            row = self.table.rowCount()
+            self.table.insertRow(row)
+            item = QTableWidgetItem(os.path.basename(path))
+            item.setToolTip(f'{path}\n-> {output_path}')
+            self.table.setItem(row, 0, item)
+            bar = QProgressBar()
+            bar.setRange(0, 100)
+            self.table.setCellWidget(row, 1, bar)
+            self.table.setItem(row, 2, QTableWidgetItem('Queued'))
+            cancel_btn = QPushButton('Cancel')
+            cancel_btn.setObjectName('cancelBtn')
+            cancel_btn.clicked.connect(lambda _, job_id=job_id: self.cancel(job_id))
+            self.table.setCellWidget(row, 3, cancel_btn)
+            self.rows[job_id] = row
+        self.setVisible(True)
+        if not self.timer.isActive():
+            self.started = time.perf_counter()
+            self.pages = {}
+            self.timer.start(self.POLL_MS)
+
+    def cancel(self, job_id):
+        if self.queue.cancel(job_id) and self.queue.jobs[job_id].status == 'cancelling':
+            self.set_status(job_id, 'Cancelling...')
+            self.table.cellWidget(self.rows[job_id], 3).setEnabled(False)
+
+    def set_status(self, job_id, text, finished=False):
+        row = self.rows[job_id]
+        self.table.item(row, 2).setText(text)
+        self.table.item(row, 2).setToolTip(text)
+        if finished:
+            self.table.cellWidget(row, 3).setEnabled(False)
+
+    def poll(self):
+        for job_id, kind, payload in self.queue.poll():
+            bar = self.table.cellWidget(self.rows[job_id], 1)
+            if kind == 'started':
+                self.set_status(job_id, 'Running')
+            elif kind == 'progress':
+                current, total = payload
+                bar.setValue(int(current / total * 100))
+                self.pages[job_id] = current
+                if self.queue.jobs[job_id].status == 'running':
+                    self.set_status(job_id, f'Page {current} of {total}')
+            elif kind == 'done':
+                pages, seconds = payload
+                bar.setValue(100)
+                self.pages[job_id] = pages
+                self.set_status(job_id, f'Done: {pages} pages in {seconds:.1f}s', finished=True)
+            elif kind == 'failed':
+                self.set_status(job_id, f'Failed: {payload}', finished=True)
+            elif kind == 'cancelled':
+                self.pages.pop(job_id, None)
+                self.set_status(job_id, 'Cancelled', finished=True)
+        self.update_summary()
+        if not self.queue.active():
+            self.timer.stop()
+
+    def update_summary(self):
+        statuses = [job.status for job in self.queue.jobs.values()]
+        finished = sum(1 for status in statuses if status in ('done', 'failed', 'cancelled'))
+        pages = sum(self.pages.values())
+        elapsed = time.perf_counter() - self.started
+        rate = pages / elapsed if elapsed > 0 else 0.0
+        self.summary_label.setText(f'{finished} of {len(statuses)} files finished, {pages} pages at {rate:.0f} pages/sec, {statuses.count("failed")} failed')
+
+    def shutdown(self):
+        self.timer.stop()
+        self.queue.shutdown()
+
+class PreviewPane(QFrame):
+    # Live preview of one page; setting changes are debounced and only re-render the stamp
+    DEBOUNCE_MS = 40
+    MAX_WIDTH = 420
+    MAX_HEIGHT = 260
+
+    def __init__(self, settings, parent=None):
+        super().__init__(parent)
+        self.settings = settings
+        self.renderer = PreviewRenderer()
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(self.DEBOUNCE_MS)
+        self.timer.timeout.connect(self.refresh)
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.image_label = QLabel()
+        self.image_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.image_label.setMinimumHeight(self.MAX_HEIGHT)
+        self.image_label.setObjectName('previewImage')
+        layout.addWidget(self.image_label)
+        page_row = QHBoxLayout()
+        page_row.addStretch(1)
+        page_label = QLabel('Preview page:')
+        page_label.setObjectName('settingLabel')
+        page_row.addWidget(page_label)
+        self.page_spin = QSpinBox()
+        self.page_spin.setMinimum(1)
+        self.page_spin.valueChanged.connect(self.schedule)
+        page_row.addWidget(self.page_spin)
+        self.page_count_label = QLabel('')
+        self.page_count_label.setObjectName('settingLabel')
+        page_row.addWidget(self.page_count_label)
+        page_row.addStretch(1)
+        layout.addLayout(page_row)
+        self.setLayout(layout)
+        self.setVisible(False)
+
+    def set_file(self, path):
+        # Opening is cheap: nothing is rendered until the first refresh
+        if path is None:
+            self.renderer.close()
+            self.setVisible(False)
+            return
+        try:
+            self.renderer.open(path)
+        except Exception as e:
+            self.renderer.close()
+            self.image_label.setPixmap(QPixmap())
+            self.image_label.setText(f'No preview: {e}')
+            self.page_spin.setMaximum(1)
+            self.page_count_label.setText('')
+            self.setVisible(True)
+            return
+        self.page_spin.blockSignals(True)
+        self.page_spin.setMaximum(self.renderer.page_count())
+        self.page_spin.setValue(1)
+        self.page_spin.blockSignals(False)
+        self.page_count_label.setText(f'of {self.renderer.page_count()}')
+        self.setVisible(True)
+        self.refresh()
+
+    def schedule(self):
+        if self.renderer.path is not None:
+            self.timer.start()
+
+    def refresh(self):
+        if self.renderer.path is None:
+            return
+        watermark_text, style = self.settings()
+        try:
+            image = self.renderer.render(self.page_spin.value() - 1, self.MAX_WIDTH, self.MAX_HEIGHT, watermark_text, **style)
+        except Exception as e:
+            self.image_label.setText(f'No preview: {e}')
+            return
+        self.image_label.setPixmap(QPixmap.fromImage(image))
+
 class WatermarkApp(QWidget):
     def __init__(self):
         super().__init__()
         self.setWindowTitle('Document Watermarker')
         self.setGeometry(100, 100, 540, 600)
         self.file_path = None
+        self.file_paths = []
         self.worker = None
         self.progress_dialog = None
         self.init_ui()
         self.setStyleSheet(self.stylesheet())
+        self.setAcceptDrops(True)
 
     def init_ui(self):
         # Card-like container
@@ -107,7 +316,7 @@ class WatermarkApp(QWidget):
         header.setObjectName('headerLabel')
         card_layout.addWidget(header)
 
-        desc = QLabel('Upload a PDF or Word file and add your custom watermark!')
+        desc = QLabel('Upload or drop PDF, Word or PowerPoint files and add your custom watermark!')
         desc.setFont(QFont('Segoe UI', 13))
         desc.setAlignment(Qt.AlignmentFlag.AlignCenter)
         desc.setObjectName('descLabel')
@@ -187,6 +396,15 @@ class WatermarkApp(QWidget):
         self.font_slider.valueChanged.connect(self.update_font_label)
         card_layout.addLayout(font_row)
 
+        # Live preview of the selected file
+        self.preview_pane = PreviewPane(self.preview_settings)
+        card_layout.addWidget(self.preview_pane)
+        self.watermark_input.textChanged.connect(self.preview_pane.schedule)
+        self.color_combo.currentTextChanged.connect(self.preview_pane.schedule)
+        self.opacity_slider.valueChanged.connect(self.preview_pane.schedule)
+        self.position_combo.currentTextChanged.connect(self.preview_pane.schedule)
+        self.font_slider.valueChanged.connect(self.preview_pane.schedule)
+
         # Password protection
         self.pw_checkbox = QCheckBox('Password protect PDF')
         self.pw_checkbox.setObjectName('settingLabel')
@@ -200,12 +418,21 @@ class WatermarkApp(QWidget):
         self.pw_input.setVisible(False)
         card_layout.addWidget(self.pw_input)
 
+        # Result cache: watermarking the same file with the same settings again is a file copy
+        self.cache_checkbox = QCheckBox('Reuse results of identical earlier jobs')
+        self.cache_checkbox.setObjectName('settingLabel')
+        card_layout.addWidget(self.cache_checkbox)
+
         # Add Watermark button
         self.add_btn = QPushButton('Add Watermark')
         self.add_btn.setObjectName('addBtn')
         self.add_btn.clicked.connect(self.add_watermark)
         card_layout.addWidget(self.add_btn)
 
+        # Multi-file queue, shown once several files have been submitted
+        self.queue_panel = QueuePanel()
+        card_layout.addWidget(self.queue_panel)
+
         card.setLayout(card_layout)
 
         # Main layout
@@ -215,6 +442,10 @@ class WatermarkApp(QWidget):
         main_layout.addStretch(1)
         self.setLayout(main_layout)
 
+    def preview_settings(self):
+        style = dict(color=COLOR_MAP[self.color_combo.currentText()], opacity=self.opacity_slider.value(), position=self.position_combo.currentText(), font_size=self.font_slider.value())
+        return self.watermark_input.text().strip(), style
+
     def update_opacity_label(self):
         self.opacity_value_label.setText(f'{self.opacity_slider.value()}%')
 
@@ -314,31 +545,67 @@ class WatermarkApp(QWidget):
         #file_label {
             color: #1976d2;
         }
+        QPushButton#cancelBtn {
+            padding: 2px 10px;
+            font-size: 12px;
+            border-radius: 6px;
+        }
+        QTableWidget#queueTable {
+            background: #fff;
+            color: #222;
+            border: 1px solid #e3f2fd;
+        }
         """
 
     def upload_file(self):
         file_dialog = QFileDialog()
-        file_path, _ = file_dialog.getOpenFileName(self, 'Open file', '',
-            'Documents (*.pdf *.docx)')
-        if file_path:
-            self.file_path = file_path
-            self.file_label.setText(f'Selected: {os.path.basename(file_path)}')
+        file_paths, _ = file_dialog.getOpenFileNames(self, 'Open files', '',
+            'Documents (*.pdf *.docx *.pptx)')
+        self.select_files(file_paths)
+
+    def select_files(self, file_paths):
+        self.file_paths = file_paths
+        self.file_path = file_paths[0] if len(file_paths) == 1 else None
+        if len(file_paths) == 1:
+            self.file_label.setText(f'Selected: {os.path.basename(file_paths[0])}')
+        elif file_paths:
+            self.file_label.setText(f'Selected: {len(file_paths)} files')
         else:
             self.file_label.setText('No file selected')
+        self.preview_pane.set_file(self.file_path)
+
+    def dragEnterEvent(self, event):
+        if event.mimeData().hasUrls():
+            event.acceptProposedAction()
+
+    def dropEvent(self, event):
+        # Dropped folders contribute the documents directly inside them
+        paths = [url.toLocalFile() for url in event.mimeData().urls() if url.isLocalFile()]
+        inputs = collect_inputs(paths)
+        if inputs:
+            self.select_files(inputs)
+            event.acceptProposedAction()
+
+    def closeEvent(self, event):
+        self.queue_panel.shutdown()
+        super().closeEvent(event)
 
     def add_watermark(self):
-        if not self.file_path:
+        if not self.file_paths:
             QMessageBox.warning(self, 'No File', 'Please upload a file first.')
             return
         watermark_text = self.watermark_input.text().strip()
         if not watermark_text:
             QMessageBox.warning(self, 'No Watermark', 'Please enter watermark text.')
             return
+        if len(self.file_paths) > 1:
+            self.add_to_queue(watermark_text)
+            return
         ext = os.path.splitext(self.file_path)[1].lower()
-        # Force PDF output for Word
+        # Word documents are converted to PDF by default, or kept as .docx with a vector watermark
         if ext == '.docx':
             default_save = os.path.splitext(self.file_path)[0] + '_watermarked.pdf'
-            save_filter = 'PDF Files (*.pdf)'
+            save_filter = 'PDF Files (*.pdf);;Word Documents (*.docx)'
         else:
             default_save = os.path.splitext(self.file_path)[0] + '_watermarked' + ext
             save_filter = f'Documents (*{ext})'
@@ -347,7 +614,7 @@ class WatermarkApp(QWidget):
         if not save_path:
             return
         # Ensure .pdf extension for converted files
-        if ext == '.docx' and not save_path.lower().endswith('.pdf'):
+        if ext == '.docx' and not save_path.lower().endswith(('.pdf', '.docx')):
             save_path += '.pdf'
         color_name = self.color_combo.currentText()
         color = COLOR_MAP[color_name]
@@ -360,15 +627,42 @@ class WatermarkApp(QWidget):
             if not password:
                 QMessageBox.warning(self, 'No Password', 'Please enter a password for PDF protection.')
                 return
+            if save_path.lower().endswith(('.docx', '.pptx')):
+                QMessageBox.warning(self, 'Word Output', 'Password protection is only available for PDF output.')
+                return
         self.progress_dialog = ProgressDialog(self)
-        self.worker = WatermarkWorker(self.file_path, watermark_text, save_path, color, opacity, position, font_size, password)
+        cache = ResultCache() if self.cache_checkbox.isChecked() else None
+        self.worker = WatermarkWorker(self.file_path, watermark_text, save_path, color, opacity, position, font_size, password, cache)
         self.worker.progress.connect(self.progress_dialog.set_progress)
+        self.worker.rate.connect(self.progress_dialog.set_rate)
         self.worker.finished.connect(self.on_watermark_finished)
+        self.progress_dialog.cancel_requested.connect(self.worker.cancel)
         self.worker.start()
         self.progress_dialog.exec()
 
+    def add_to_queue(self, watermark_text):
+        # Outputs go next to their inputs, named the same way as in batch mode
+        password = None
+        if self.pw_checkbox.isChecked():
+            password = self.pw_input.text()
+            if not password:
+                QMessageBox.warning(self, 'No Password', 'Please enter a password for PDF protection.')
+                return
+        options = dict(
+            color=COLOR_MAP[self.color_combo.currentText()],
+            opacity=self.opacity_slider.value(),
+            position=self.position_combo.currentText(),
+            font_size=self.font_slider.value(),
+            password=password,
+            cache=ResultCache() if self.cache_checkbox.isChecked() else None,
+        )
+        self.queue_panel.add_jobs(self.file_paths, watermark_text, options)
+        self.select_files([])
+
     def on_watermark_finished(self, success, message):
-        self.progress_dialog.close()
+        self.progress_dialog.accept()
+        if self.worker.cancel_token.cancelled and not success:
+            return
         # Custom QMessageBox with dark blue text
         msg = QMessageBox(self)
         if success:
@@ -0,0 +1,157 @@
+import mmap
+import shutil
+import struct
+import zlib
+import functools
+
+from PyPDF2 import PdfReader
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject, StreamObject
+
+from metrics import NULL_METRICS, position_of, size_of, timed
+from watermark import XObjectStamper, first_stamp_number, is_path, open_destination, page_geometry, pdf_source, render_watermark_pdf
+from pdfstream import next_object_number, stamped_page
+
+# An incremental update leaves the original bytes as they are and appends the
+# changed objects plus an xref section whose /Prev points at the old one, the
+# same way a PDF editor saves a signed document without invalidating it.
+
+# startxref sits in the last few hundred bytes of a well-formed file
+TAIL = 2048
+
+def original_startxref(tail):
+    index = tail.rfind(b'startxref')
+    if index < 0:
+        raise ValueError('Not a PDF: startxref not found.')
+    return int(tail[index + len(b'startxref'):].split()[0])
+
+def uses_xref_stream(reader, startxref):
+    reader.stream.seek(startxref)
+    return reader.stream.read(4) != b'xref'
+
+class AppendWriter:
+    """Appends objects after the original bytes and records their offsets."""
+
+    def __init__(self, stream, first_id):
+        self.stream = stream
+        self.offsets = {}
+        self._next_id = first_id
+
+    def add_object(self, obj):
+        ref = IndirectObject(self._next_id, 0, self)
+        self._next_id += 1
+        self.write_object(ref.idnum, ref.generation, obj)
+        return ref
+
+    def write_object(self, idnum, generation, obj):
+        self.offsets[(idnum, generation)] = self.stream.tell()
+        self.stream.write(b'%d %d obj\n' % (idnum, generation))
+        obj.write_to_stream(self.stream, None)
+        self.stream.write(b'\nendobj\n')
+
+    def _subsections(self, entries):
+        # Consecutive object numbers share one subsection
+        runs = []
+        for idnum, generation, offset in sorted(entries):
+            if runs and runs[-1][-1][0] == idnum - 1:
+                runs[-1].append((idnum, generation, offset))
+            else:
+                runs.append([(idnum, generation, offset)])
+        return runs
+
+    def close(self, trailer, prev, xref_stream=False):
+        trailer = DictionaryObject({NameObject(k): v for k, v in trailer.items() if k in ('/Root', '/Info', '/ID')})
+        trailer[NameObject('/Prev')] = NumberObject(prev)
+        if xref_stream:
+            self._close_with_stream(trailer)
+        else:
+            self._close_with_table(trailer)
+        self.stream.flush()
+
+    def _close_with_table(self, trailer):
+        entries = [(idnum, generation, offset) for (idnum, generation), offset in self.offsets.items()]
+        xref = self.stream.tell()
+        self.stream.write(b'xref\n')
+        for run in self._subsections(entries):
+            self.stream.write(b'%d %d\n' % (run[0][0], len(run)))
+            for _, generation, offset in run:
+                self.stream.write(b'%010d %05d n \n' % (offset, generation))
+        trailer[NameObject('/Size')] = NumberObject(self._next_id)
+        self.stream.write(b'trailer\n')
+        trailer.write_to_stream(self.stream, None)
+        self.stream.write(b'\nstartxref\n%d\n%%%%EOF\n' % xref)
+
+    def _close_with_stream(self, trailer):
+        # The xref stream lists itself, so its number and offset are known first
+        idnum = self._next_id
+        self._next_id += 1
+        xref = self.stream.tell()
+        entries = [(i, generation, offset) for (i, generation), offset in self.offsets.items()]
+        entries.append((idnum, 0, xref))
+        index = ArrayObject()
+        rows = []
+        for run in self._subsections(entries):
+            index.extend([NumberObject(run[0][0]), NumberObject(len(run))])
+            rows.extend(struct.pack('>BIH', 1, offset, generation) for _, generation, offset in run)
+        stream = StreamObject()
+        stream._data = zlib.compress(b''.join(rows))
+        stream.update(trailer)
+        stream.update({
+            NameObject('/Type'): NameObject('/XRef'),
+            NameObject('/Size'): NumberObject(self._next_id),
+            NameObject('/Index'): index,
+            NameObject('/W'): ArrayObject([NumberObject(1), NumberObject(4), NumberObject(2)]),
+            NameObject('/Filter'): NameObject('/FlateDecode'),
+        })
+        self.stream.write(b'%d 0 obj\n' % idnum)
+        stream.write_to_stream(self.stream, None)
+        self.stream.write(b'\nendobj\nstartxref\n%d\n%%%%EOF\n' % xref)
+
+def _copy_original(source, out):
+    # Copies the input unchanged and returns its last bytes, which hold startxref.
+    # Memory-mapped files go to write() directly, without a copy in Python.
+    if is_path(source):
+        with open(source, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            out.write(data)
+            return data[-TAIL:]
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        data = memoryview(source)
+        out.write(data)
+        return bytes(data[-TAIL:])
+    source.seek(0)
+    shutil.copyfileobj(source, out)
+    source.seek(max(0, source.tell() - TAIL))
+    return source.read()
+
+def add_watermark_pdf_incremental(input_path, watermark_text, output_path, color=(80,80,80), opacity=80, position='Center Diagonal', font_size=48, password=None, progress_callback=None, metrics=None, cancel_token=None):
+    if password:
+        raise ValueError('Incremental updates cannot add a password; the original bytes stay unencrypted.')
+    metrics = metrics or NULL_METRICS
+    with metrics.stage('parse', bytes=size_of(input_path)) as stage:
+        reader = PdfReader(pdf_source(input_path))
+        if reader.is_encrypted:
+            raise ValueError('Encrypted PDFs cannot be updated incrementally.')
+        total_pages = stage.pages = len(reader.pages)
+    with open_destination(output_path) as out:
+        with metrics.stage('copy') as stage:
+            tail = _copy_original(input_path, out)
+            if tail[-1:] not in (b'\n', b'\r'):
+                out.write(b'\n')
+            stage.bytes = position_of(out)
+        writer = AppendWriter(out, next_object_number(reader))
+        render = functools.partial(render_watermark_pdf, watermark_text, color=color, opacity=opacity, position=position, font_size=font_size)
+        stamper = XObjectStamper(writer.add_object, timed(metrics, 'render', render), first_stamp_number(reader.pages))
+        with metrics.stage('stamp', pages=total_pages):
+            for i, page in enumerate(reader.pages):
+                if cancel_token:
+                    cancel_token.check()
+                ref = page.indirect_reference
+                stamp = stamper.stamp_for(page_geometry(page))
+                # The page keeps its number and parent; only its dictionary is appended again
+                writer.write_object(ref.idnum, ref.generation, stamped_page(page, stamp, page.raw_get('/Parent')))
+                if progress_callback:
+                    progress_callback(i + 1, total_pages)
+        with metrics.stage('write') as stage:
+            prev = original_startxref(tail)
+            writer.close(reader.trailer, prev, xref_stream=uses_xref_stream(reader, prev))
+            stage.bytes = position_of(out)
+    return total_pages
@@ -0,0 +1,158 @@
+import os
+import time
+import itertools
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import wait
+
+from watermark import add_watermark
+from progress import Cancelled, CancelToken, ThrottledProgress
+
+# Events returned by JobQueue.poll() are (job_id, kind, payload) tuples:
+#   ('started', None), ('progress', (current, total)), ('done', (pages, seconds)),
+#   ('failed', message), ('cancelled', None)
+
+def _worker_main(conn, cancel_event):
+    # Long-lived worker process: receives one task at a time over its pipe and reports back
+    cancel_token = CancelToken(cancel_event)
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        job_id, input_path, output_path, watermark_text, options = task
+        start = time.perf_counter()
+        progress_callback = ThrottledProgress(lambda current, total: conn.send((job_id, 'progress', (current, total))))
+        try:
+            pages = add_watermark(input_path, watermark_text, output_path, progress_callback=progress_callback, cancel_token=cancel_token, **options)
+            conn.send((job_id, 'done', (pages or 0, time.perf_counter() - start)))
+        except Cancelled:
+            conn.send((job_id, 'cancelled', None))
+        except Exception as e:
+            conn.send((job_id, 'failed', f'{type(e).__name__}: {e}'))
+
+class Job:
+    def __init__(self, job_id, input_path, output_path, watermark_text, options):
+        self.id = job_id
+        self.input_path = input_path
+        self.output_path = output_path
+        self.watermark_text = watermark_text
+        self.options = options
+        self.status = 'queued'
+
+    def task(self):
+        return self.id, self.input_path, self.output_path, self.watermark_text, self.options
+
+class _Worker:
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.cancel_event = context.Event()
+        self.process = context.Process(target=_worker_main, args=(child_conn, self.cancel_event), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.job = None
+
+    def stop(self, terminate=False):
+        if terminate:
+            self.process.terminate()
+        else:
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+        self.process.join()
+        self.conn.close()
+
+class JobQueue:
+    """Runs watermark jobs in at most ``workers`` long-lived worker processes.
+
+    Nothing runs in the background of the calling process: ``poll()`` hands
+    queued jobs to idle workers and collects their events without blocking, so
+    a GUI can call it from a timer. Queued jobs are cancelled by dropping them;
+    running ones stop at their next page and their worker takes the next job.
+    """
+
+    def __init__(self, workers=None, context=None):
+        self.workers = workers or os.cpu_count() or 1
+        # Forking a process that runs a GUI event loop is unsafe, so workers are spawned
+        self.context = context or multiprocessing.get_context('spawn')
+        self.jobs = {}
+        self._pending = deque()
+        self._idle = []
+        self._busy = {}
+        self._events = []
+        self._ids = itertools.count(1)
+
+    def submit(self, input_path, output_path, watermark_text, options=None):
+        job = Job(next(self._ids), input_path, output_path, watermark_text, dict(options or {}))
+        self.jobs[job.id] = job
+        self._pending.append(job)
+        return job.id
+
+    def active(self):
+        return bool(self._pending or self._busy or self._events)
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None or job.status not in ('queued', 'running'):
+            return False
+        if job.status == 'queued':
+            self._pending.remove(job)
+            job.status = 'cancelled'
+            self._events.append((job_id, 'cancelled', None))
+        else:
+            # The worker reports 'cancelled' once it has stopped and cleaned up
+            job.status = 'cancelling'
+            self._busy[job_id].cancel_event.set()
+        return True
+
+    def poll(self):
+        events, self._events = self._events, []
+        workers = {worker.conn: worker for worker in self._busy.values()}
+        for conn in wait(list(workers), timeout=0):
+            worker = workers[conn]
+            while worker.job is not None and conn.poll():
+                try:
+                    event = conn.recv()
+                except (EOFError, OSError):
+                    event = (worker.job.id, 'failed', 'Worker process exited unexpectedly')
+                    worker.stop(terminate=True)
+                    worker = None
+                events.append(event)
+                if event[1] in ('done', 'failed', 'cancelled'):
+                    self._finish(event, worker)
+                if worker is None:
+                    break
+        self._dispatch(events)
+        return events
+
+    def _finish(self, event, worker):
+        job_id, kind, _ = event
+        self.jobs[job_id].status = kind
+        del self._busy[job_id]
+        if worker is not None:
+            worker.job = None
+            self._idle.append(worker)
+
+    def _dispatch(self, events):
+        while self._pending and (self._idle or len(self._busy) < self.workers):
+            worker = self._idle.pop() if self._idle else _Worker(self.context)
+            job = self._pending.popleft()
+            job.status = 'running'
+            worker.job = job
+            worker.cancel_event.clear()
+            worker.conn.send(job.task())
+            self._busy[job.id] = worker
+            events.append((job.id, 'started', None))
+
+    def shutdown(self):
+        self._pending.clear()
+        # Closing down does not wait for running jobs; their workers cannot clean up after themselves
+        for worker in self._busy.values():
+            worker.stop(terminate=True)
+            tmp_path = worker.job.output_path + '.tmp'
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._busy = {}
+        for worker in self._idle:
+            worker.stop()
+        self._idle = []
@@ -0,0 +1,263 @@
+import os
+import re
+import csv
+import time
+import string
+import tempfile
+import functools
+import itertools
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from PyPDF2 import PdfReader
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject
+
+from metrics import NULL_METRICS, position_of, size_of, timed
+from watermark import POSITION_MAP, STAMP_PREFIX, _stamp_placement, build_stamp_xobject, content_stream, first_stamp_number, is_path, open_destination, open_source, page_geometry, render_watermark_pdf
+from pdfstream import StreamingPdfWriter, catalog_for, next_object_number, page_tree_nodes, stamped_page
+
+# Every output keeps the input's object numbers and reserves the same numbers for
+# its page tree, catalog and stamps, so pages, their resources and everything else
+# from the input are byte-identical across recipients. Unencrypted outputs copy
+# them from a fragment written once; only the stamp forms are rendered per recipient.
+# Encrypted outputs need their own keys, so they write the shared objects again
+# from the already parsed input.
+
+# Recipient keys that are settings rather than placeholder values
+RESERVED_FIELDS = ('password', 'output')
+UNSAFE_PATH_CHARS = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+
+def recipient_fields(recipient, index):
+    # A recipient is a name or a dict of placeholder values, optionally with a
+    # 'password' and an explicit 'output' path
+    fields = {'name': recipient} if isinstance(recipient, str) else dict(recipient)
+    for name in RESERVED_FIELDS:
+        fields.pop(name, None)
+    fields.setdefault('index', index)
+    return fields
+
+def placeholders(template):
+    return {name for _, name, _, _ in string.Formatter().parse(template) if name}
+
+def format_text(template, fields, index):
+    try:
+        return template.format_map(fields)
+    except KeyError as e:
+        raise ValueError(f'Recipient {index} has no value for {{{e.args[0]}}}.') from None
+
+def output_for(pattern, fields, index):
+    # Values are made safe for file names so a recipient cannot redirect its output
+    safe = {name: UNSAFE_PATH_CHARS.sub('_', str(value)) for name, value in fields.items()}
+    return format_text(pattern, safe, index)
+
+class Layout:
+    # Object numbers shared by every output, plus the page and stamp geometry
+    # needed to render one recipient's stamps without the input
+
+    def __init__(self, reader, per_page):
+        self.per_page = per_page
+        first_id = next_object_number(reader)
+        ids = itertools.count(first_id)
+        self.header = reader.pdf_header.encode()
+        self.total_pages = len(reader.pages)
+        self.pages_id = next(ids)
+        self.root_id = next(ids)
+        self.opening_id = next(ids)
+        # Stamp key -> (name, form id, closing stream id, geometry); one stamp per
+        # page geometry, or per page when the text contains {page}
+        self.stamps = {}
+        self.keys = []
+        first_number = first_stamp_number(reader.pages)
+        for i, page in enumerate(reader.pages):
+            geometry = page_geometry(page)
+            key = i if per_page else geometry
+            if key not in self.stamps:
+                self.stamps[key] = (f'{STAMP_PREFIX}{first_number + len(self.stamps)}', next(ids), next(ids), geometry)
+            self.keys.append(key)
+        self.next_id = next(ids)
+        info = reader.trailer.get('/Info')
+        self.info_id = info.idnum if isinstance(info, IndirectObject) else None
+
+    def texts(self, template, fields, index):
+        # Stamp key -> watermark text for one recipient
+        if self.per_page:
+            return {key: format_text(template, dict(fields, page=key + 1, pages=self.total_pages), index) for key in self.stamps}
+        text = format_text(template, dict(fields, pages=self.total_pages), index)
+        return dict.fromkeys(self.stamps, text)
+
+def _write_shared(writer, reader, layout, cancel_token=None):
+    # Pages and everything they or the catalog reference; identical for every recipient
+    ref = lambda idnum: IndirectObject(idnum, 0, writer)
+    pages_ref = ref(layout.pages_id)
+    for page in reader.pages:
+        writer.map_reference(page.indirect_reference, target=ref(page.indirect_reference.idnum))
+    for idnum in page_tree_nodes(reader):
+        writer.map_reference(IndirectObject(idnum, 0, reader), target=pages_ref)
+    opening = ref(layout.opening_id)
+    writer.write_object(opening, content_stream(b'q\n'))
+    for name, _, closing_id, _ in layout.stamps.values():
+        writer.write_object(ref(closing_id), content_stream(f'\nQ\nq {name} Do Q\n'.encode()))
+    for page, key in zip(reader.pages, layout.keys):
+        if cancel_token:
+            cancel_token.check()
+        name, form_id, closing_id, _ = layout.stamps[key]
+        writer.copy_object(stamped_page(page, (name, ref(form_id), opening, ref(closing_id)), pages_ref), ref(page.indirect_reference.idnum))
+    writer.write_object(pages_ref, DictionaryObject({
+        NameObject('/Type'): NameObject('/Pages'),
+        NameObject('/Kids'): ArrayObject(ref(page.indirect_reference.idnum) for page in reader.pages),
+        NameObject('/Count'): NumberObject(layout.total_pages),
+    }))
+    writer.copy_object(catalog_for(reader, pages_ref), ref(layout.root_id))
+    if layout.info_id is not None:
+        writer.map_reference(reader.trailer.get('/Info'))
+        writer.drain()
+
+def _write_recipient(destination, layout, texts, render, password=None, reader=None, fragment=None, cancel_token=None):
+    with open_destination(destination) as out:
+        writer = StreamingPdfWriter(out, header=layout.header, password=password, source=reader, first_id=layout.next_id)
+        if password:
+            _write_shared(writer, reader, layout, cancel_token)
+        else:
+            fragment_path, offsets = fragment
+            with open(fragment_path, 'rb') as f:
+                writer.copy_fragment(f, offsets)
+        for key, (_, form_id, _, geometry) in layout.stamps.items():
+            upright_size, matrix = _stamp_placement(geometry)
+            writer.write_object(IndirectObject(form_id, 0, writer), build_stamp_xobject(render(texts[key], page_size=upright_size), matrix=matrix))
+        writer.close(IndirectObject(layout.root_id, 0, writer), IndirectObject(layout.info_id, 0, writer) if layout.info_id is not None else None)
+        return position_of(out)
+
+# Worker processes parse the input at most once, and only for encrypted outputs
+_worker_readers = {}
+
+def _worker_reader(input_path):
+    if input_path not in _worker_readers:
+        _worker_readers[input_path] = PdfReader(open(input_path, 'rb'))
+    return _worker_readers[input_path]
+
+def _merge_one(input_path, destination, layout, texts, style, password, fragment):
+    render = functools.partial(render_watermark_pdf, **style)
+    reader = _worker_reader(input_path) if password else None
+    return _write_recipient(destination, layout, texts, render, password=password, reader=reader, fragment=fragment)
+
+def add_watermark_pdf_mailmerge(input_path, watermark_text, recipients, output_pattern, color=(80,80,80), opacity=80, position='Center Diagonal', font_size=48, workers=None, progress_callback=None, metrics=None, cancel_token=None):
+    """Writes one watermarked copy of a PDF per recipient from a single parse.
+
+    ``watermark_text`` and ``output_pattern`` are format strings over the
+    recipient's fields ({name}, {index} and any other keys of a dict recipient);
+    the text may also use {page} and {pages}. A recipient's 'password' encrypts
+    its copy and 'output' overrides the pattern. With ``workers`` > 1 copies are
+    written in parallel processes, which needs a file path as input.
+    ``progress_callback(current, total)`` counts finished copies. Returns the
+    output paths in recipient order; copies finished before a cancel are kept.
+    """
+    metrics = metrics or NULL_METRICS
+    parallel = workers is not None and workers > 1
+    if parallel and not is_path(input_path):
+        raise ValueError('Parallel mail merge needs a file path as input.')
+    jobs = []
+    for index, recipient in enumerate(recipients, 1):
+        fields = recipient_fields(recipient, index)
+        settings = {} if isinstance(recipient, str) else recipient
+        jobs.append((fields, settings.get('output') or output_for(output_pattern, fields, index), settings.get('password')))
+    # Every placeholder and output name is checked before anything is written
+    destinations = [os.path.abspath(destination) if is_path(destination) else id(destination) for _, destination, _ in jobs]
+    if len(set(destinations)) != len(destinations):
+        raise ValueError('Two recipients would be written to the same output.')
+    per_page = 'page' in placeholders(watermark_text)
+    probe = dict.fromkeys(('page', 'pages'), 1)
+    for index, (fields, _, _) in enumerate(jobs, 1):
+        format_text(watermark_text, dict(probe, **fields), index)
+    style = dict(color=tuple(color), opacity=opacity, position=position, font_size=font_size)
+    render = timed(metrics, 'render', functools.partial(render_watermark_pdf, **style))
+    total = len(jobs)
+    with open_source(input_path) as source, tempfile.TemporaryDirectory() as tmp:
+        with metrics.stage('parse', bytes=size_of(input_path)) as stage:
+            reader = PdfReader(source)
+            stage.pages = len(reader.pages)
+        layout = Layout(reader, per_page)
+        fragment = None
+        if any(not password for _, _, password in jobs):
+            fragment_path = os.path.join(tmp, 'shared.part')
+            with metrics.stage('stamp', pages=layout.total_pages) as stage, open(fragment_path, 'wb') as f:
+                writer = StreamingPdfWriter(f, header=None, source=reader, first_id=layout.next_id)
+                _write_shared(writer, reader, layout, cancel_token)
+                stage.bytes = position_of(f)
+            fragment = (fragment_path, writer.offsets)
+        with metrics.stage('write', pages=layout.total_pages * total) as stage:
+            written = 0
+            if not parallel:
+                for done, (fields, destination, password) in enumerate(jobs, 1):
+                    if cancel_token:
+                        cancel_token.check()
+                    texts = layout.texts(watermark_text, fields, done)
+                    written += _write_recipient(destination, layout, texts, render, password=password, reader=reader, fragment=fragment, cancel_token=cancel_token)
+                    if progress_callback:
+                        progress_callback(done, total)
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    pending = {
+                        pool.submit(_merge_one, os.fspath(input_path), destination, layout, layout.texts(watermark_text, fields, index), style, password, fragment)
+                        for index, (fields, destination, password) in enumerate(jobs, 1)
+                    }
+                    done = 0
+                    try:
+                        while pending:
+                            finished, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                            for future in finished:
+                                written += future.result()
+                                done += 1
+                                if progress_callback:
+                                    progress_callback(done, total)
+                            if cancel_token:
+                                cancel_token.check()
+                    except BaseException:
+                        # Copies already being written finish; queued ones are dropped
+                        for future in pending:
+                            future.cancel()
+                        raise
+            stage.bytes = written
+    return [destination for _, destination, _ in jobs]
+
+def load_recipients(path):
+    # A CSV file with a header row (a 'name' column plus any other placeholders,
+    # optionally 'password' and 'output'), or a text file with one name per line
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if os.path.splitext(path)[1].lower() == '.csv':
+            return [{key: value for key, value in row.items() if value} for row in csv.DictReader(f)]
+        return [line.strip() for line in f if line.strip()]
+
+def add_arguments(parser):
+    parser.add_argument('input', help='PDF to watermark')
+    parser.add_argument('recipients', help='CSV file with a header row (name, password, ...) or a text file with one name per line')
+    parser.add_argument('-t', '--text', required=True, help='Watermark text; may use {name}, {page}, {pages} and any CSV column')
+    parser.add_argument('-o', '--output', default=None, help='Output path pattern (default: <input>_{name}.pdf next to the input)')
+    parser.add_argument('--color', default='Light Gray', help='Color name, #rrggbb or r,g,b')
+    parser.add_argument('--opacity', type=int, default=80, help='Opacity in percent (10-100)')
+    parser.add_argument('--position', default='Center Diagonal', choices=POSITION_MAP)
+    parser.add_argument('--font-size', type=int, default=48)
+    parser.add_argument('-j', '--workers', type=int, default=None, help='Worker processes (default: write copies one after another)')
+
+def main(args):
+    from batch import parse_color
+    try:
+        color = parse_color(args.color)
+    except ValueError as e:
+        print(e)
+        return 2
+    if os.path.splitext(args.input)[1].lower() != '.pdf':
+        print('Mail merge only supports PDF input.')
+        return 2
+    recipients = load_recipients(args.recipients)
+    if not recipients:
+        print('No recipients found.')
+        return 1
+    pattern = args.output or os.path.splitext(args.input)[0].replace('{', '{{').replace('}', '}}') + '_{name}.pdf'
+
+    start = time.perf_counter()
+    try:
+        outputs = add_watermark_pdf_mailmerge(args.input, args.text, recipients, pattern, color=color, opacity=args.opacity, position=args.position, font_size=args.font_size, workers=args.workers)
+    except ValueError as e:
+        print(e)
+        return 2
+    print(f'Wrote {len(outputs)} copies of {args.input} in {time.perf_counter() - start:.2f}s')
+    return 0
@@ -1,8 +1,11 @@
 from gui import WatermarkApp
 from PyQt6.QtWidgets import QApplication
 import sys
+import multiprocessing
  
 if __name__ == '__main__':
+    # Queue workers are spawned processes; frozen builds need this to start them
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     window = WatermarkApp()
     window.show()
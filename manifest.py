@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import hashlib
+
+from cache import HASH_CHUNK
+
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Journal lines are JSON objects, appended and fsynced one at a time:
+#   {'status': 'started', 'input': ..., 'output': ..., 'options': ..., 'size': ..., 'mtime': ..., 'sha256': ..., 'pid': ...}
+#   {'status': 'done', ..., 'pages': ..., 'seconds': ...}
+#   {'status': 'failed', ..., 'error': ...}
+#   {'status': 'quarantined', ..., 'attempts': ...}
+# 'started' is written by the worker itself, so a process killed mid-document
+# (out of memory, a reboot) still leaves a counted attempt behind.
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def options_digest(watermark_text, output_path, options):
+    # Settings that change the output; passwords only count as set or not and are never written
+    settings = {name: options.get(name) for name in ('color', 'opacity', 'position', 'font_size', 'incremental')}
+    if options.get('compact'):
+        # Absent when off, so journals written before compaction existed still match
+        settings['compact'] = options['compact']
+    settings.update(text=watermark_text, output=os.path.abspath(output_path), protected=bool(options.get('password')))
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=list).encode()).hexdigest()
+
+def append_record(path, record):
+    # One write() per line on an O_APPEND descriptor, so workers and the parent can share the file
+    line = (json.dumps(record, sort_keys=True) + '\n').encode()
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def sync_file(path):
+    # A journal entry saying 'done' must not outlive the output it points at.
+    # Read-write: on Windows fsync is FlushFileBuffers, which fails on read-only handles
+    fd = os.open(path, os.O_RDWR)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class Manifest:
+    """Crash-safe journal of a batch run, used to resume it.
+
+    Replaying the journal gives each input's latest state. Re-running the same
+    batch skips inputs that are done (same content, settings and output, and
+    the output still exists), retries failed or interrupted ones, and
+    quarantines inputs that have used up ``max_attempts``.
+    """
+
+    def __init__(self, path, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.states = {}
+        self.load()
+
+    def load(self):
+        self.states = {}
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        if not data.endswith(b'\n'):
+            # A crash mid-write tore the last line; cut it off so the next record starts on a line of its own
+            data = data[:data.rfind(b'\n') + 1]
+            with open(self.path, 'r+b') as f:
+                f.truncate(len(data))
+        for line in data.decode('utf-8').splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            self._apply(record)
+
+    def _apply(self, record):
+        key = os.path.abspath(record['input'])
+        state = self.states.get(key)
+        if record['status'] == 'started':
+            # Attempts count per input content and settings; changing either starts afresh
+            if state is None or (state.get('sha256'), state.get('options')) != (record.get('sha256'), record.get('options')):
+                state = self.states[key] = {'attempts': 0}
+            state.update(record)
+            state['attempts'] += 1
+        elif state is not None:
+            state.update(record)
+            if record['status'] == 'done':
+                state['attempts'] = 0
+
+    def record(self, record):
+        append_record(self.path, record)
+        self._apply(record)
+
+    def same_input(self, input_path, state):
+        try:
+            stat = os.stat(input_path)
+        except FileNotFoundError:
+            return False
+        if (state.get('size'), state.get('mtime')) == (stat.st_size, stat.st_mtime_ns):
+            return True
+        # Touched but maybe not changed: only then is the file hashed again
+        return state.get('size') == stat.st_size and state.get('sha256') == file_digest(input_path)
+
+    def plan(self, input_path, output_path, options_key):
+        # 'run', 'skip' (already done) or 'quarantined'
+        state = self.states.get(os.path.abspath(input_path))
+        if state is None or state.get('options') != options_key or not self.same_input(input_path, state):
+            return 'run'
+        if state['status'] == 'done':
+            return 'skip' if os.path.exists(output_path) else 'run'
+        if state['status'] == 'quarantined' or state['attempts'] >= self.max_attempts:
+            if state['status'] != 'quarantined':
+                self.record(dict(input=input_path, output=output_path, options=options_key, status='quarantined', attempts=state['attempts'], time=time.time()))
+            return 'quarantined'
+        return 'run'
+
+    def quarantined(self):
+        return sorted(state['input'] for state in self.states.values() if state['status'] == 'quarantined')
+
+def start_record(input_path, output_path, options_key):
+    stat = os.stat(input_path)
+    return dict(status='started', input=input_path, output=output_path, options=options_key, size=stat.st_size, mtime=stat.st_mtime_ns,
+                sha256=file_digest(input_path), pid=os.getpid(), time=time.time())
@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import threading
+
+# Stage events are plain dicts:
+#   {'event': 'start', 'stage': 'parse', 'time': ...}
+#   {'event': 'end', 'stage': 'parse', 'time': ..., 'seconds': ..., 'pages': ..., 'bytes': ...}
+# plus whatever context the Metrics object was created with. Stages may nest
+# (render runs inside stamp), so durations of nested stages overlap.
+
+class Stage:
+    __slots__ = ('name', 'pages', 'bytes', 'started')
+
+    def __init__(self, name, pages=None, bytes=None):
+        self.name = name
+        self.pages = pages
+        self.bytes = bytes
+        self.started = None
+
+class _NullStage:
+    # Shared by every no-op stage; attribute writes are dropped
+    __slots__ = ()
+    name = pages = bytes = started = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+NULL_STAGE = _NullStage()
+
+class NullMetrics:
+    """Default recorder: every call is a no-op that allocates nothing."""
+    enabled = False
+
+    def stage(self, name, pages=None, bytes=None):
+        return NULL_STAGE
+
+    def event(self, name, **fields):
+        pass
+
+NULL_METRICS = NullMetrics()
+
+class _StageContext:
+    __slots__ = ('metrics', 'stage')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        stage = self.stage
+        self.metrics.emit({'event': 'start', 'stage': stage.name, 'time': time.time()})
+        stage.started = time.perf_counter()
+        return stage
+
+    def __exit__(self, exc_type, exc, tb):
+        stage = self.stage
+        event = {'event': 'end', 'stage': stage.name, 'time': time.time(), 'seconds': time.perf_counter() - stage.started}
+        if stage.pages is not None:
+            event['pages'] = stage.pages
+        if stage.bytes is not None:
+            event['bytes'] = stage.bytes
+        if exc_type is not None:
+            event['error'] = f'{exc_type.__name__}: {exc}'
+        self.metrics.emit(event)
+        return False
+
+class Metrics:
+    """Reports pipeline stages to ``sink``, a callable taking one event dict.
+
+    Extra keyword arguments (a document name, a job id) are added to every event.
+    """
+    enabled = True
+
+    def __init__(self, sink, **context):
+        self.sink = sink
+        self.context = context
+
+    def emit(self, event):
+        if self.context:
+            event.update(self.context)
+        self.sink(event)
+
+    def stage(self, name, pages=None, bytes=None):
+        return _StageContext(self, Stage(name, pages, bytes))
+
+    def event(self, name, **fields):
+        self.emit(dict(fields, event=name, time=time.time()))
+
+class JsonLinesSink:
+    """Appends one JSON object per event to a file or text stream.
+
+    Files are opened in append mode and every event is a single write, so
+    several worker processes can share one log.
+    """
+
+    def __init__(self, destination):
+        self._own = isinstance(destination, (str, os.PathLike))
+        self.stream = open(destination, 'a', encoding='utf-8') if self._own else destination
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        line = json.dumps(event, default=str) + '\n'
+        with self._lock:
+            self.stream.write(line)
+            self.stream.flush()
+
+    def close(self):
+        if self._own:
+            self.stream.close()
+
+def timed(metrics, name, func):
+    # Wraps func in a stage only when metrics are enabled, so the default path stays a plain call
+    if not metrics.enabled:
+        return func
+
+    def wrapper(*args, **kwargs):
+        with metrics.stage(name):
+            return func(*args, **kwargs)
+    return wrapper
+
+def size_of(source):
+    # Input size in bytes for paths and bytes-like objects, None for streams
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return memoryview(source).nbytes
+    if isinstance(source, (str, os.PathLike)):
+        try:
+            return os.path.getsize(source)
+        except OSError:
+            return None
+    return None
+
+def position_of(stream):
+    try:
+        return stream.tell()
+    except (AttributeError, OSError, ValueError):
+        return None
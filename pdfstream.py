@@ -0,0 +1,304 @@
+import gc
+import os
+import sys
+import shutil
+import struct
+import warnings
+import functools
+from collections import deque
+from hashlib import md5
+
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import (
+    ArrayObject, DecodedStreamObject, DictionaryObject, EncodedStreamObject, IndirectObject, NameObject,
+    NullObject, NumberObject, StreamObject,
+)
+
+from metrics import NULL_METRICS, position_of, size_of, timed
+from watermark import XObjectStamper, apply_stamp, first_stamp_number, open_destination, open_source, page_geometry, render_watermark_pdf
+
+DEFAULT_WINDOW = 64
+COPY_CHUNK = 1024 * 1024
+
+def current_rss():
+    # Resident set size in bytes, or None where it cannot be measured cheaply
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return peak_rss()
+
+def peak_rss():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def standard_encryption(password):
+    # Let PyPDF2 derive the standard security handler values; the writers below
+    # only need the file key, the /Encrypt dictionary and the file /ID
+    helper = PdfWriter()
+    helper.encrypt(password)
+    return helper._encrypt_key, helper._encrypt.get_object(), helper._ID
+
+class StreamingPdfWriter:
+    """Writes PDF objects to the output as soon as they are complete.
+
+    Objects copied from a reader are renumbered on the fly and written once;
+    only the object-number map and the xref offsets stay in memory. With
+    ``source`` set, objects of that reader keep their original numbers, which
+    lets several writers produce fragments of one file independently.
+    """
+
+    def __init__(self, stream, header=b'%PDF-1.7', password=None, encryption=None, source=None, first_id=1):
+        self.stream = stream
+        self.source = source
+        self.offsets = {}
+        self._next_id = first_id
+        self._map = {}
+        self._pending = deque()
+        self._encrypt_ref = None
+        self._encrypt_key = None
+        self._id = None
+        if header is not None:
+            stream.write(header + b'\n%\xE2\xE3\xCF\xD3\n')
+        if password:
+            encryption = standard_encryption(password)
+        if encryption:
+            self._encrypt_key, encrypt_dict, self._id = encryption
+            if encrypt_dict is not None:
+                self._encrypt_ref = self.reserve()
+                self.write_object(self._encrypt_ref, encrypt_dict)
+
+    def reserve(self):
+        idnum = self._next_id
+        self._next_id += 1
+        return IndirectObject(idnum, 0, self)
+
+    def add_object(self, obj, ref=None):
+        ref = ref or self.reserve()
+        self.write_object(ref, obj)
+        return ref
+
+    def map_reference(self, ref, target=None):
+        key = (id(ref.pdf), ref.idnum, ref.generation)
+        if key not in self._map:
+            if target is None and ref.pdf is self.source:
+                target = IndirectObject(ref.idnum, 0, self)
+                if ref.idnum not in self.offsets:
+                    self._pending.append(ref)
+                self._map[key] = target
+            else:
+                self._map[key] = target or self.reserve()
+                if target is None:
+                    self._pending.append(ref)
+        return self._map[key]
+
+    def translate(self, obj):
+        if isinstance(obj, IndirectObject):
+            return obj if obj.pdf is self else self.map_reference(obj)
+        if isinstance(obj, StreamObject):
+            copy = EncodedStreamObject() if '/Filter' in obj else DecodedStreamObject()
+            copy._data = obj._data
+            for key, value in obj.items():
+                if key != '/Length':
+                    copy[NameObject(key)] = self.translate(value)
+            return copy
+        if isinstance(obj, DictionaryObject):
+            copy = DictionaryObject()
+            for key, value in obj.items():
+                copy[NameObject(key)] = self.translate(value)
+            return copy
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self.translate(value) for value in obj)
+        return obj
+
+    def write_object(self, ref, obj):
+        self.offsets[ref.idnum] = self.stream.tell()
+        self.stream.write(b'%d 0 obj\n' % ref.idnum)
+        key = None
+        if self._encrypt_key is not None and ref != self._encrypt_ref:
+            key = self._encrypt_key + struct.pack('<i', ref.idnum)[:3] + struct.pack('<i', 0)[:2]
+            key = md5(key).digest()[:min(16, len(self._encrypt_key) + 5)]
+        obj.write_to_stream(self.stream, key)
+        self.stream.write(b'\nendobj\n')
+
+    def copy_object(self, obj, ref):
+        self.write_object(ref, self.translate(obj))
+        self.drain()
+
+    def copy_fragment(self, fragment, offsets):
+        # Appends objects another writer produced with header=None, skipping
+        # numbers that are already present
+        if self.offsets.keys().isdisjoint(offsets):
+            # Nothing to skip: one block copy
+            base = self.stream.tell()
+            fragment.seek(0)
+            shutil.copyfileobj(fragment, self.stream, COPY_CHUNK)
+            self.offsets.update((idnum, base + offset) for idnum, offset in offsets.items())
+            return
+        ordered = sorted(offsets.items(), key=lambda item: item[1])
+        fragment.seek(0, os.SEEK_END)
+        ends = [offset for _, offset in ordered[1:]] + [fragment.tell()]
+        for (idnum, offset), end in zip(ordered, ends):
+            if idnum in self.offsets:
+                continue
+            fragment.seek(offset)
+            self.offsets[idnum] = self.stream.tell()
+            self.stream.write(fragment.read(end - offset))
+
+    def drain(self):
+        while self._pending:
+            source = self._pending.popleft()
+            target = self._map[(id(source.pdf), source.idnum, source.generation)]
+            if target.idnum in self.offsets:
+                continue
+            obj = source.get_object()
+            self.write_object(target, self.translate(obj if obj is not None else NullObject()))
+
+    def close(self, root, info=None):
+        self.drain()
+        xref = self.stream.tell()
+        size = max(self._next_id, max(self.offsets, default=0) + 1)
+        self.stream.write(b'xref\n0 %d\n0000000000 65535 f \n' % size)
+        for idnum in range(1, size):
+            offset = self.offsets.get(idnum)
+            if offset is None:
+                self.stream.write(b'0000000000 00000 f \n')
+            else:
+                self.stream.write(b'%010d 00000 n \n' % offset)
+        trailer = DictionaryObject({NameObject('/Size'): NumberObject(size), NameObject('/Root'): root})
+        if info is not None:
+            trailer[NameObject('/Info')] = info
+        if self._encrypt_ref is not None:
+            trailer[NameObject('/Encrypt')] = self._encrypt_ref
+            trailer[NameObject('/ID')] = self._id
+        self.stream.write(b'trailer\n')
+        trailer.write_to_stream(self.stream, None)
+        self.stream.write(b'\nstartxref\n%d\n%%%%EOF\n' % xref)
+        self.stream.flush()
+
+def next_object_number(reader):
+    # PyPDF2 drops /Size from trailers that come from xref streams
+    if '/Size' in reader.trailer:
+        return int(reader.trailer['/Size'])
+    used = [idnum for table in reader.xref.values() for idnum in table] + list(reader.xref_objStm)
+    return max(used, default=0) + 1
+
+def page_tree_nodes(reader):
+    nodes = set()
+    for page in reader.pages:
+        parent = page.get('/Parent')
+        while isinstance(parent, IndirectObject) and parent.idnum not in nodes:
+            nodes.add(parent.idnum)
+            parent = parent.get_object().get('/Parent')
+    return nodes
+
+def stamped_page(page, stamp, pages_ref):
+    # Shallow copies keep shared resource dictionaries in the input untouched
+    work = DictionaryObject(page)
+    resources = page.get('/Resources')
+    if resources is not None:
+        resources = DictionaryObject(resources.get_object())
+        if '/XObject' in resources:
+            resources[NameObject('/XObject')] = DictionaryObject(resources['/XObject'].get_object())
+        work[NameObject('/Resources')] = resources
+    apply_stamp(work, *stamp)
+    work[NameObject('/Parent')] = pages_ref
+    return work
+
+def catalog_for(reader, pages_ref):
+    catalog = DictionaryObject()
+    for key, value in reader.trailer['/Root'].get_object().items():
+        if key != '/Pages':
+            catalog[NameObject(key)] = value
+    catalog[NameObject('/Type')] = NameObject('/Catalog')
+    catalog[NameObject('/Pages')] = pages_ref
+    return catalog
+
+def _release(reader, collect=True):
+    # Drop the reader's object cache so finished pages and their images can be freed
+    reader.resolved_objects.clear()
+    if collect:
+        gc.collect()
+
+def add_watermark_pdf_streaming(input_path, watermark_text, output_path, color=(80,80,80), opacity=80, position='Center Diagonal', font_size=48, password=None, window=DEFAULT_WINDOW, memory_budget=None, progress_callback=None, memory_callback=None, metrics=None, cancel_token=None):
+    metrics = metrics or NULL_METRICS
+    with open_source(input_path) as source, open_destination(output_path) as out:
+        # A file object keeps PdfReader from loading the whole input into memory
+        with metrics.stage('parse', bytes=size_of(input_path)) as stage:
+            reader = PdfReader(source)
+            stage.pages = len(reader.pages)
+        writer = StreamingPdfWriter(out, header=reader.pdf_header.encode(), password=password)
+        render = functools.partial(render_watermark_pdf, watermark_text, color=color, opacity=opacity, position=position, font_size=font_size)
+        stamper = XObjectStamper(writer.add_object, timed(metrics, 'render', render), first_stamp_number(reader.pages))
+        pages_ref = writer.reserve()
+        total_pages = len(reader.pages)
+        kids = ArrayObject()
+        # Links and annotations pointing at pages resolve to the new page objects,
+        # and anything pointing at the old page tree lands on the new flat one
+        for page in reader.pages:
+            kids.append(writer.map_reference(page.indirect_reference, target=writer.reserve()))
+        for idnum in page_tree_nodes(reader):
+            writer.map_reference(IndirectObject(idnum, 0, reader), target=pages_ref)
+        peak = 0
+        max_window = window = max(1, int(window))
+        uncollected = 0
+        warned = False
+        done = 0
+        # Stamping includes writing: pages leave for the output as they are done
+        with metrics.stage('stamp', pages=total_pages):
+            while done < total_pages:
+                end = min(done + window, total_pages)
+                for i in range(done, end):
+                    if cancel_token:
+                        cancel_token.check()
+                    page = reader.pages[i]
+                    stamp = stamper.stamp_for(page_geometry(page))
+                    writer.copy_object(stamped_page(page, stamp, pages_ref), kids[i])
+                    if progress_callback:
+                        progress_callback(i + 1, total_pages)
+                uncollected += end - done
+                done = end
+                out.flush()
+                # A full collection per page would dominate small windows, so collect
+                # every DEFAULT_WINDOW pages or when the budget is exceeded
+                collect = uncollected >= DEFAULT_WINDOW
+                _release(reader, collect=collect)
+                rss = current_rss()
+                if memory_budget and rss is not None and rss > memory_budget and not collect:
+                    gc.collect()
+                    collect = True
+                    rss = current_rss()
+                if collect:
+                    uncollected = 0
+                if rss is not None:
+                    peak = max(peak, rss)
+                    if memory_budget and rss > memory_budget:
+                        if window > 1:
+                            window = max(1, window // 2)
+                        elif not warned:
+                            warned = True
+                            warnings.warn(f'Memory budget of {memory_budget // (1024 * 1024)} MB cannot be met: '
+                                          f'{rss // (1024 * 1024)} MB in use with one page per window', RuntimeWarning)
+                    elif memory_budget and window < max_window:
+                        window = min(max_window, window * 2)
+                if memory_callback:
+                    memory_callback(peak_rss() or peak)
+        with metrics.stage('write') as stage:
+            pages = DictionaryObject({
+                NameObject('/Type'): NameObject('/Pages'),
+                NameObject('/Kids'): kids,
+                NameObject('/Count'): NumberObject(total_pages),
+            })
+            writer.write_object(pages_ref, pages)
+            catalog = catalog_for(reader, pages_ref)
+            root = writer.reserve()
+            writer.copy_object(catalog, root)
+            info = reader.trailer.get('/Info')
+            writer.close(root, writer.translate(info) if isinstance(info, IndirectObject) else None)
+            stage.bytes = position_of(out)
+    return total_pages
@@ -0,0 +1,112 @@
+import os
+from collections import OrderedDict
+
+from PyQt6.QtCore import QBuffer, QByteArray, QIODevice, QSize
+from PyQt6.QtGui import QColor, QImage, QPainter
+from PyQt6.QtPdf import QPdfDocument
+
+from watermark import render_watermark_pdf
+
+BACKGROUND_CACHE_SIZE = 8
+
+def render_pdf_page(document, page, size):
+    image = document.render(page, size)
+    if image.isNull():
+        raise ValueError(f'Page {page + 1} could not be rendered.')
+    return image
+
+class PreviewRenderer:
+    """Renders one page of a document with the watermark on top, for the GUI preview.
+
+    The stamp is the same PDF stamp ``add_watermark_pdf`` places on the page,
+    rasterised at preview size, so position, rotation, font and opacity match
+    the output. Page backgrounds are rendered once per page and size and kept in
+    a small LRU; a settings change only renders the stamp again. Word and
+    PowerPoint pages are shown blank at their page or slide size.
+    """
+
+    def __init__(self):
+        self.path = None
+        self._document = None
+        self._sizes = []
+        self._backgrounds = OrderedDict()
+
+    def open(self, path):
+        if path == self.path:
+            return
+        self.close()
+        ext = os.path.splitext(path)[1].lower()
+        if ext == '.pdf':
+            document = QPdfDocument(None)
+            document.load(path)
+            if document.status() != QPdfDocument.Status.Ready:
+                raise ValueError(f'{os.path.basename(path)} could not be opened for preview.')
+            self._document = document
+            self._sizes = [(document.pagePointSize(i).width(), document.pagePointSize(i).height()) for i in range(document.pageCount())]
+        elif ext == '.docx':
+            from docx import Document
+            # Only the first section's page size; the stamp geometry does not depend on content
+            section = Document(path).sections[0]
+            self._sizes = [(section.page_width.pt, section.page_height.pt)]
+        elif ext == '.pptx':
+            from pptx import Presentation
+            prs = Presentation(path)
+            self._sizes = [(prs.slide_width.pt, prs.slide_height.pt)]
+        else:
+            raise ValueError('Only PDF, Word (.docx) and PowerPoint (.pptx) files can be previewed.')
+        self.path = path
+
+    def close(self):
+        if self._document is not None:
+            self._document.close()
+        self.path = None
+        self._document = None
+        self._sizes = []
+        self._backgrounds.clear()
+
+    def page_count(self):
+        return len(self._sizes)
+
+    def pixel_size(self, page, max_width, max_height):
+        width, height = self._sizes[page]
+        scale = min(max_width / width, max_height / height)
+        return QSize(max(1, round(width * scale)), max(1, round(height * scale)))
+
+    def background(self, page, size):
+        key = (page, size.width(), size.height())
+        image = self._backgrounds.get(key)
+        if image is None:
+            # PDF pages render onto transparency, so they get the white paper viewers show
+            image = QImage(size, QImage.Format.Format_ARGB32_Premultiplied)
+            image.fill(QColor('white'))
+            if self._document is not None:
+                painter = QPainter(image)
+                painter.drawImage(0, 0, render_pdf_page(self._document, page, size))
+                painter.end()
+            self._backgrounds[key] = image
+            if len(self._backgrounds) > BACKGROUND_CACHE_SIZE:
+                self._backgrounds.popitem(last=False)
+        else:
+            self._backgrounds.move_to_end(key)
+        return image
+
+    def stamp(self, page, size, watermark_text, color=(80,80,80), opacity=80, position='Center Diagonal', font_size=48):
+        stamp_pdf = render_watermark_pdf(watermark_text, color=color, opacity=opacity, position=position, font_size=font_size, page_size=self._sizes[page])
+        buffer = QBuffer()
+        buffer.setData(QByteArray(stamp_pdf))
+        buffer.open(QIODevice.OpenModeFlag.ReadOnly)
+        document = QPdfDocument(None)
+        document.load(buffer)
+        try:
+            return render_pdf_page(document, 0, size)
+        finally:
+            document.close()
+
+    def render(self, page, max_width, max_height, watermark_text, **style):
+        size = self.pixel_size(page, max_width, max_height)
+        image = self.background(page, size).copy()
+        if watermark_text:
+            painter = QPainter(image)
+            painter.drawImage(0, 0, self.stamp(page, size, watermark_text, **style))
+            painter.end()
+        return image
@@ -0,0 +1,49 @@
+import time
+import threading
+
+class Cancelled(Exception):
+    """Raised between pages once the job's CancelToken has been cancelled."""
+
+class CancelToken:
+    """Cooperative cancellation flag that the watermarking loops check between pages.
+
+    Backed by a threading.Event by default; pass a multiprocessing Event to
+    cancel work running in another process.
+    """
+
+    def __init__(self, event=None):
+        self.event = event if event is not None else threading.Event()
+
+    def cancel(self):
+        self.event.set()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def check(self):
+        if self.event.is_set():
+            raise Cancelled('Watermarking was cancelled.')
+
+class ThrottledProgress:
+    """Wraps a progress_callback(current, total) so it fires at a bounded rate.
+
+    A call goes through only when at least ``interval`` seconds have passed and
+    progress has advanced by ``step`` percent since the last one, so a 50,000-page
+    job produces about 100 / step updates. The final page always goes through.
+    """
+
+    def __init__(self, callback, interval=0.1, step=1):
+        self.callback = callback
+        self.interval = interval
+        self.step = step
+        self._percent = -step
+        self._time = None
+
+    def __call__(self, current, total):
+        percent = current * 100 // total if total else 100
+        now = time.monotonic()
+        if current >= total or (percent >= self._percent + self.step and (self._time is None or now - self._time >= self.interval)):
+            self._percent = percent
+            self._time = now
+            self.callback(current, total)
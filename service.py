@@ -0,0 +1,300 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import signal
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+from watermark import add_watermark_bytes, preload, POSITION_MAP
+from batch import parse_color
+from progress import ThrottledProgress
+
+MAX_BODY = 512 * 1024 * 1024
+MAX_FINISHED = 1000
+# Finished results stay in memory until their job is deleted; past this many
+# bytes the oldest are dropped and their jobs report 'expired'
+MAX_RESULT_BYTES = 1024 * 1024 * 1024
+# Input format -> output formats it can produce, the default first
+OUTPUT_FORMATS = {
+    'pdf': ('pdf',),
+    'docx': ('pdf', 'docx'),
+    'pptx': ('pptx',),
+}
+# Output format -> content type of the result
+CONTENT_TYPES = {
+    'pdf': 'application/pdf',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+}
+REASONS = {
+    200: 'OK', 202: 'Accepted', 204: 'No Content', 400: 'Bad Request', 404: 'Not Found',
+    405: 'Method Not Allowed', 409: 'Conflict', 410: 'Gone', 413: 'Payload Too Large', 429: 'Too Many Requests',
+    500: 'Internal Server Error',
+}
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def _run_job(job_id, data, file_format, watermark_text, options, progress):
+    # Runs in a worker process; progress is a Manager dict shared with the server,
+    # so every update is a round trip and they are throttled
+    def report(current, total):
+        progress[job_id] = (current, total)
+
+    return add_watermark_bytes(data, watermark_text, file_format=file_format, progress_callback=ThrottledProgress(report), **options)
+
+class Job:
+    def __init__(self, job_id, data, file_format, watermark_text, options):
+        self.id = job_id
+        self.data = data
+        self.file_format = file_format
+        self.watermark_text = watermark_text
+        self.options = options
+        self.status = 'queued'
+        self.error = None
+        self.result = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def describe(self, progress):
+        current, total = progress.get(self.id, (0, 0))
+        if self.status == 'done':
+            current = total = max(total, current)
+        info = {
+            'id': self.id,
+            'status': self.status,
+            'progress': {'current': current, 'total': total},
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+        }
+        if self.error:
+            info['error'] = self.error
+        return info
+
+class WatermarkService:
+    def __init__(self, workers=None, queue_size=64, max_result_bytes=MAX_RESULT_BYTES):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.max_result_bytes = max_result_bytes
+        self.jobs = OrderedDict()
+        self.queue = None
+        self.pool = None
+        self.manager = None
+        self.progress = None
+        self._dispatchers = []
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.manager = multiprocessing.Manager()
+        self.progress = self.manager.dict()
+        # Uploads can be any format, so workers warm up every backend at start.
+        # Forked workers would inherit open client sockets and hold connections
+        # open after the response, so they are spawned.
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'), initializer=preload)
+        self._dispatchers = [asyncio.create_task(self._dispatch()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._dispatchers:
+            task.cancel()
+        await asyncio.gather(*self._dispatchers, return_exceptions=True)
+        self.pool.shutdown(cancel_futures=True)
+        self.manager.shutdown()
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            if job.status == 'cancelled':
+                self.queue.task_done()
+                continue
+            job.status = 'running'
+            job.started = time.time()
+            try:
+                job.result = await loop.run_in_executor(self.pool, _run_job, job.id, job.data, job.file_format, job.watermark_text, job.options, self.progress)
+                job.status = 'done'
+            except Exception as e:
+                job.status = 'failed'
+                job.error = f'{type(e).__name__}: {e}'
+            finally:
+                job.data = None
+                job.finished = time.time()
+                self.queue.task_done()
+                self._evict(keep=job)
+
+    def _evict(self, keep=None):
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in ('done', 'failed', 'expired')]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED)]:
+            self._forget(job_id)
+        # Results are what takes the memory; the oldest go first, the job that just finished stays
+        held = [job for job in self.jobs.values() if job.result is not None]
+        total = sum(len(job.result) for job in held)
+        for job in held:
+            if total <= self.max_result_bytes:
+                break
+            if job is not keep:
+                total -= len(job.result)
+                job.result = None
+                job.status = 'expired'
+
+    def _forget(self, job_id):
+        self.jobs.pop(job_id, None)
+        self.progress.pop(job_id, None)
+
+    def submit(self, data, query, headers):
+        text = query.get('text', '').strip()
+        if not text:
+            raise HttpError(400, 'Missing watermark text (?text=...)')
+        file_format = query.get('format', 'pdf').lower().lstrip('.')
+        if file_format not in OUTPUT_FORMATS:
+            raise HttpError(400, f'Unsupported format {file_format!r}')
+        # Word documents are converted to PDF unless ?output=docx asks for a .docx back
+        output_format = query.get('output', OUTPUT_FORMATS[file_format][0]).lower().lstrip('.')
+        if output_format not in OUTPUT_FORMATS[file_format]:
+            raise HttpError(400, f'Unsupported output format {output_format!r}')
+        position = query.get('position', 'Center Diagonal')
+        if position not in POSITION_MAP:
+            raise HttpError(400, f'Unknown position {position!r}')
+        try:
+            options = dict(
+                color=parse_color(query.get('color', 'Light Gray')),
+                opacity=int(query.get('opacity', 80)),
+                position=position,
+                font_size=int(query.get('font_size', 48)),
+                # Prefer the header so passwords stay out of URLs and access logs
+                password=headers.get('x-watermark-password') or query.get('password') or None,
+                output_format=output_format,
+            )
+        except ValueError as e:
+            raise HttpError(400, str(e))
+        if options['password'] and output_format != 'pdf':
+            raise HttpError(400, 'Password protection is only available for PDF output')
+        job = Job(uuid.uuid4().hex, data, file_format, text, options)
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise HttpError(429, 'Job queue is full, retry later')
+        self.jobs[job.id] = job
+        return job
+
+    async def handle(self, method, path, query, headers, body):
+        parts = [p for p in path.split('/') if p]
+        if parts == ['health']:
+            return 200, {'status': 'ok', 'queued': self.queue.qsize(), 'queue_size': self.queue_size, 'workers': self.workers}
+        if parts == ['jobs']:
+            if method != 'POST':
+                raise HttpError(405, 'Use POST to submit a job')
+            job = self.submit(body, query, headers)
+            return 202, job.describe(self.progress)
+        if len(parts) in (2, 3) and parts[0] == 'jobs':
+            job = self.jobs.get(parts[1])
+            if job is None:
+                raise HttpError(404, 'Unknown job')
+            if len(parts) == 2:
+                if method == 'DELETE':
+                    # Queued jobs stay in the asyncio queue; the dispatcher skips them
+                    if job.status == 'queued':
+                        job.status = 'cancelled'
+                        job.data = None
+                    self._forget(job.id)
+                    return 204, None
+                return 200, job.describe(self.progress)
+            if parts[2] == 'result':
+                if job.status == 'failed':
+                    raise HttpError(409, job.error)
+                if job.status == 'expired':
+                    raise HttpError(410, 'Result was dropped to free memory; submit the job again')
+                if job.status != 'done':
+                    raise HttpError(409, f'Job is {job.status}')
+                return 200, (CONTENT_TYPES[job.options['output_format']], job.result)
+        raise HttpError(404, 'Not found')
+
+    async def serve_client(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            if not request_line:
+                writer.close()
+                return
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get('content-length', 0))
+            if length > MAX_BODY:
+                raise HttpError(413, 'Upload too large')
+            body = await reader.readexactly(length) if length else b''
+            url = urlsplit(target)
+            query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            status, payload = await self.handle(method.upper(), url.path, query, headers, body)
+        except HttpError as e:
+            status, payload = e.status, {'error': str(e)}
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            status, payload = 400, {'error': f'Malformed request: {e}'}
+        except Exception as e:
+            status, payload = 500, {'error': f'{type(e).__name__}: {e}'}
+        await self._respond(writer, status, payload)
+
+    async def _respond(self, writer, status, payload):
+        headers = {'Connection': 'close'}
+        if payload is None:
+            body = b''
+        elif isinstance(payload, tuple):
+            headers['Content-Type'], body = payload
+        else:
+            headers['Content-Type'] = 'application/json'
+            body = json.dumps(payload).encode()
+        if status == 429:
+            headers['Retry-After'] = '1'
+        headers['Content-Length'] = str(len(body))
+        head = f'HTTP/1.1 {status} {REASONS.get(status, "")}\r\n' + ''.join(f'{k}: {v}\r\n' for k, v in headers.items()) + '\r\n'
+        try:
+            writer.write(head.encode('latin-1'))
+            writer.write(body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+async def serve(host='127.0.0.1', port=8765, workers=None, queue_size=64, max_result_bytes=MAX_RESULT_BYTES):
+    service = WatermarkService(workers=workers, queue_size=queue_size, max_result_bytes=max_result_bytes)
+    await service.start()
+    server = await asyncio.start_server(service.serve_client, host, port)
+    print(f'Watermark service on http://{host}:{port} ({service.workers} workers, queue of {queue_size})', flush=True)
+    # Shut the worker pool and manager down on SIGTERM too, not only on Ctrl+C
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, server.close)
+    except (NotImplementedError, AttributeError):
+        pass
+    try:
+        async with server:
+            await server.serve_forever()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await service.stop()
+
+def add_arguments(parser):
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('-j', '--workers', type=int, default=None, help='Worker processes (default: number of CPUs)')
+    parser.add_argument('--queue-size', type=int, default=64, help='Jobs that may wait before new uploads get 429')
+    parser.add_argument('--max-results', type=int, default=MAX_RESULT_BYTES // (1024 * 1024), metavar='MB', help='Memory for finished results not yet deleted; the oldest expire beyond it')
+
+def main(args):
+    try:
+        asyncio.run(serve(args.host, args.port, workers=args.workers, queue_size=args.queue_size, max_result_bytes=args.max_results * 1024 * 1024))
+    except KeyboardInterrupt:
+        pass
+    return 0
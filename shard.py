@@ -0,0 +1,120 @@
+import os
+import functools
+import tempfile
+import multiprocessing
+from queue import Empty
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_EXCEPTION
+
+from PyPDF2 import PdfReader
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject
+
+from metrics import NULL_METRICS, position_of, size_of, timed
+from progress import CancelToken
+from watermark import XObjectStamper, first_stamp_number, open_destination, page_geometry, render_watermark_pdf
+from pdfstream import StreamingPdfWriter, catalog_for, next_object_number, page_tree_nodes, stamped_page, standard_encryption
+
+REPORT_EVERY = 16
+
+# Shards keep the input's object numbers, so every fragment can be written
+# independently and stitching is a byte copy. Outlines, named destinations
+# and page labels still point at the right pages without any rewriting.
+
+def _watermark_shard(input_path, fragment_path, start, end, stamps, pages_id, tree_nodes, encrypt_key, progress_queue, cancel_event=None):
+    with open(input_path, 'rb') as source, open(fragment_path, 'wb') as out:
+        reader = PdfReader(source)
+        writer = StreamingPdfWriter(out, header=None, encryption=(encrypt_key, None, None) if encrypt_key else None, source=reader, first_id=pages_id)
+        pages_ref = IndirectObject(pages_id, 0, writer)
+        # Pages outside this shard are written by their own shard
+        for page in reader.pages:
+            ref = page.indirect_reference
+            writer.map_reference(ref, target=IndirectObject(ref.idnum, 0, writer))
+        for idnum in tree_nodes:
+            writer.map_reference(IndirectObject(idnum, 0, reader), target=pages_ref)
+        stamp_refs = {
+            geometry: (name, *(IndirectObject(idnum, 0, writer) for idnum in ids))
+            for geometry, (name, *ids) in stamps.items()
+        }
+        cancel_token = CancelToken(cancel_event) if cancel_event is not None else None
+        unreported = 0
+        for i in range(start, end):
+            if cancel_token:
+                cancel_token.check()
+            page = reader.pages[i]
+            stamp = stamp_refs[page_geometry(page)]
+            writer.copy_object(stamped_page(page, stamp, pages_ref), IndirectObject(page.indirect_reference.idnum, 0, writer))
+            unreported += 1
+            if progress_queue is not None and unreported >= REPORT_EVERY:
+                progress_queue.put(unreported)
+                unreported = 0
+        if progress_queue is not None and unreported:
+            progress_queue.put(unreported)
+        return writer.offsets
+
+def add_watermark_pdf_sharded(input_path, watermark_text, output_path, color=(80,80,80), opacity=80, position='Center Diagonal', font_size=48, password=None, shards=None, workers=None, progress_callback=None, metrics=None, cancel_token=None):
+    workers = workers or os.cpu_count() or 1
+    metrics = metrics or NULL_METRICS
+    with open(input_path, 'rb') as source, open_destination(output_path) as out, tempfile.TemporaryDirectory() as tmp:
+        with metrics.stage('parse', bytes=size_of(input_path)) as stage:
+            reader = PdfReader(source)
+            total_pages = stage.pages = len(reader.pages)
+        shards = max(1, min(shards or workers, total_pages))
+        encryption = standard_encryption(password) if password else None
+        writer = StreamingPdfWriter(out, header=reader.pdf_header.encode(), encryption=encryption, source=reader, first_id=next_object_number(reader))
+        pages_ref = writer.reserve()
+        # Stamps are written once here; shards only reference their object numbers
+        render = functools.partial(render_watermark_pdf, watermark_text, color=color, opacity=opacity, position=position, font_size=font_size)
+        stamper = XObjectStamper(writer.add_object, timed(metrics, 'render', render), first_stamp_number(reader.pages))
+        stamps = {}
+        kids = ArrayObject()
+        for page in reader.pages:
+            geometry = page_geometry(page)
+            if geometry not in stamps:
+                name, *refs = stamper.stamp_for(geometry)
+                stamps[geometry] = (name, *(ref.idnum for ref in refs))
+            kids.append(IndirectObject(page.indirect_reference.idnum, 0, writer))
+        tree_nodes = page_tree_nodes(reader)
+        for idnum in tree_nodes:
+            writer.map_reference(IndirectObject(idnum, 0, reader), target=pages_ref)
+        bounds = [total_pages * k // shards for k in range(shards + 1)]
+        fragments = [os.path.join(tmp, f'shard{k}.part') for k in range(shards)]
+        encrypt_key = encryption[0] if encryption else None
+        # Shards stamp and write their page ranges in parallel
+        with metrics.stage('stamp', pages=total_pages):
+            with multiprocessing.Manager() as manager, ProcessPoolExecutor(max_workers=min(workers, shards)) as pool:
+                progress_queue = manager.Queue() if progress_callback else None
+                # The caller's token may not be shareable, so shards watch a manager event that mirrors it
+                cancel_event = manager.Event() if cancel_token else None
+                futures = [
+                    pool.submit(_watermark_shard, input_path, fragments[k], bounds[k], bounds[k + 1], stamps, pages_ref.idnum, tree_nodes, encrypt_key, progress_queue, cancel_event)
+                    for k in range(shards)
+                ]
+                done_pages = 0
+                pending = set(futures)
+                while pending:
+                    finished, pending = wait(pending, timeout=0.1, return_when=FIRST_EXCEPTION)
+                    if cancel_token and cancel_token.cancelled:
+                        cancel_event.set()
+                    for future in finished:
+                        future.result()
+                    while progress_queue is not None:
+                        try:
+                            done_pages += progress_queue.get_nowait()
+                        except Empty:
+                            break
+                        progress_callback(done_pages, total_pages)
+                offsets = [future.result() for future in futures]
+        with metrics.stage('write') as stage:
+            for fragment_path, fragment_offsets in zip(fragments, offsets):
+                with open(fragment_path, 'rb') as fragment:
+                    writer.copy_fragment(fragment, fragment_offsets)
+            writer.write_object(pages_ref, DictionaryObject({
+                NameObject('/Type'): NameObject('/Pages'),
+                NameObject('/Kids'): kids,
+                NameObject('/Count'): NumberObject(total_pages),
+            }))
+            root = writer.reserve()
+            writer.copy_object(catalog_for(reader, pages_ref), root)
+            info = reader.trailer.get('/Info')
+            writer.close(root, writer.translate(info) if isinstance(info, IndirectObject) else None)
+            stage.bytes = position_of(out)
+    return total_pages
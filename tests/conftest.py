@@ -0,0 +1,84 @@
+import os
+import sys
+from io import BytesIO
+
+import pytest
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import ArrayObject, DictionaryObject, NameObject, NumberObject
+from reportlab.pdfgen import canvas
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from watermark import write_pdf
+
+PAGE_SIZES = [(612, 792), (842, 595), (612, 792), (420, 595)]
+
+def make_pdf(path, pages=12, password=None, compact=0):
+    # Mixed page sizes, a shared font, an outline, named destinations and page labels.
+    # compact=3 writes object streams and a cross-reference stream (no /Size in PyPDF2's trailer)
+    buffer = BytesIO()
+    can = canvas.Canvas(buffer)
+    for i in range(pages):
+        can.setPageSize(PAGE_SIZES[i % len(PAGE_SIZES)])
+        can.drawString(72, 72, f'Page {i + 1}')
+        can.showPage()
+    can.save()
+    writer = PdfWriter()
+    writer.append_pages_from_reader(PdfReader(buffer))
+    chapter = writer.add_outline_item('Chapter 1', 0)
+    writer.add_outline_item('Section 1.1', pages // 2, parent=chapter)
+    writer.add_outline_item('Appendix', pages - 1)
+    writer.add_named_destination('middle', pages // 2)
+    writer.add_named_destination('last', pages - 1)
+    writer._root_object[NameObject('/PageLabels')] = DictionaryObject({
+        NameObject('/Nums'): ArrayObject([
+            NumberObject(0), DictionaryObject({NameObject('/S'): NameObject('/r')}),
+            NumberObject(2), DictionaryObject({NameObject('/S'): NameObject('/D')}),
+        ]),
+    })
+    if password:
+        writer.encrypt(password)
+    with open(path, 'wb') as f:
+        write_pdf(writer, f, compact)
+    return path
+
+@pytest.fixture
+def sample_pdf(tmp_path):
+    return make_pdf(str(tmp_path / 'sample.pdf'))
+
+def outline_pages(reader):
+    found = []
+
+    def walk(items):
+        for item in items:
+            if isinstance(item, list):
+                walk(item)
+            else:
+                found.append((item.title, reader.get_destination_page_number(item)))
+    walk(reader.outline)
+    return found
+
+def destination_pages(reader):
+    return {name.lstrip('/'): reader.get_destination_page_number(dest) for name, dest in reader.named_destinations.items()}
+
+def page_labels(reader):
+    labels = reader.trailer['/Root'].get_object().get('/PageLabels')
+    if labels is None:
+        return None
+    nums = labels.get_object()['/Nums']
+    return [(int(nums[i]), dict(nums[i + 1].get_object())) for i in range(0, len(nums), 2)]
+
+def assert_same_targets(original_path, output_path, password=None):
+    original = PdfReader(original_path)
+    output = PdfReader(output_path)
+    if password:
+        assert output.is_encrypted
+        assert output.decrypt(password)
+    assert len(output.pages) == len(original.pages)
+    assert outline_pages(output) == outline_pages(original)
+    assert destination_pages(output) == destination_pages(original)
+    assert page_labels(output) == page_labels(original)
+    for before, after in zip(original.pages, output.pages):
+        assert after.mediabox == before.mediabox
+        assert 'Page' in after.extract_text()
+    return output
@@ -0,0 +1,32 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+from watermark import BACKENDS, add_watermark, backend_for
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ('PyPDF2', 'docx', 'pptx', 'PIL', 'docx2pdf', 'reportlab')
+
+def loaded_after(code):
+    # Top-level packages from HEAVY that a fresh interpreter has imported after running code
+    script = f'import sys\nsys.path.insert(0, {REPO_ROOT!r})\n{code}\nprint(sorted({{m.split(".")[0] for m in sys.modules}} & set({HEAVY!r})))'
+    return eval(subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True).stdout)
+
+def test_entry_modules_import_no_backend():
+    assert loaded_after('import watermark, batch, cache, jobqueue') == []
+
+def test_preload_imports_only_what_a_format_needs():
+    pdf = loaded_after('import watermark; watermark.preload("pdf")')
+    assert 'PyPDF2' in pdf and 'docx' not in pdf and 'pptx' not in pdf
+    pptx = loaded_after('import watermark; watermark.preload(".pptx")')
+    assert 'pptx' in pptx and 'PyPDF2' not in pptx
+
+def test_unknown_formats_are_rejected(tmp_path):
+    assert sorted(BACKENDS) == ['.docx', '.pdf', '.pptx']
+    assert backend_for('PDF') is backend_for('.pdf')
+    with pytest.raises(ValueError):
+        backend_for('txt')
+    with pytest.raises(ValueError):
+        add_watermark(str(tmp_path / 'notes.txt'), 'DRAFT', str(tmp_path / 'out.txt'))
@@ -0,0 +1,80 @@
+import os
+
+import pytest
+from PyPDF2 import PdfReader
+
+from cache import ResultCache
+from metrics import Metrics
+from watermark import add_watermark, add_watermark_bytes
+from conftest import make_pdf
+
+def cache_hits(events):
+    return [e['hit'] for e in events if e['event'] == 'cache']
+
+def test_hit_returns_the_stored_output(sample_pdf, tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    events = []
+    first, second = str(tmp_path / 'first.pdf'), str(tmp_path / 'second.pdf')
+    assert add_watermark(sample_pdf, 'DRAFT', first, cache=cache, metrics=Metrics(events.append)) == 12
+    assert add_watermark(sample_pdf, 'DRAFT', second, cache=cache, metrics=Metrics(events.append)) == 12
+    assert cache_hits(events) == [False, True]
+    assert open(first, 'rb').read() == open(second, 'rb').read()
+    assert not any(name.endswith('.tmp') for name in os.listdir(tmp_path / 'cache'))
+
+def test_every_option_is_part_of_the_key(sample_pdf, tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    output = str(tmp_path / 'out.pdf')
+    variants = [{}, {'color': (255, 0, 0)}, {'opacity': 30}, {'position': 'Top-left'}, {'font_size': 20}, {'incremental': True}]
+    for options in variants:
+        add_watermark(sample_pdf, 'DRAFT', output, cache=cache, **options)
+    add_watermark(sample_pdf, 'FINAL', output, cache=cache)
+    assert len(cache.entries()) == len(variants) + 1
+    # Streaming changes how the output is produced, not what it contains
+    add_watermark(sample_pdf, 'DRAFT', output, cache=cache, streaming=True)
+    assert len(cache.entries()) == len(variants) + 1
+
+def test_passwords_are_applied_on_the_way_out(sample_pdf, tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    add_watermark(sample_pdf, 'DRAFT', str(tmp_path / 'plain.pdf'), cache=cache)
+    for password in ('first', 'second'):
+        output = str(tmp_path / f'{password}.pdf')
+        add_watermark(sample_pdf, 'DRAFT', output, password=password, cache=cache)
+        reader = PdfReader(output)
+        assert reader.is_encrypted and reader.decrypt(password)
+    assert len(cache.entries()) == 1
+    for name in os.listdir(tmp_path / 'cache'):
+        assert b'first' not in open(tmp_path / 'cache' / name, 'rb').read()
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    output = str(tmp_path / 'out.pdf')
+    inputs = [make_pdf(str(tmp_path / f'in{i}.pdf'), pages=2 + i) for i in range(3)]
+    keys = []
+    for i, path in enumerate(inputs):
+        add_watermark(path, 'DRAFT', output, cache=cache)
+        keys.append(next(key for _, _, key in cache.entries() if key not in keys))
+        os.utime(cache.path(keys[-1]), (1000 + i, 1000 + i))
+    # A hit makes the oldest entry the most recently used one
+    add_watermark(inputs[0], 'DRAFT', output, cache=cache)
+    sizes = {key: size for _, size, key in cache.entries()}
+    cache.max_bytes = sizes[keys[0]] + sizes[keys[2]]
+    cache.evict()
+    assert sorted(key for _, _, key in cache.entries()) == sorted([keys[0], keys[2]])
+
+def test_bytes_and_streams(sample_pdf, tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    data = open(sample_pdf, 'rb').read()
+    first = add_watermark_bytes(data, 'DRAFT', cache=cache)
+    with open(sample_pdf, 'rb') as f:
+        assert add_watermark_bytes(f, 'DRAFT', cache=cache) == first
+    assert first == add_watermark_bytes(data, 'DRAFT')
+    assert len(cache.entries()) == 1
+
+def test_rejected_jobs_leave_no_entry(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    with pytest.raises(Exception):
+        add_watermark_bytes(b'%PDF-1.7\nbroken', 'DRAFT', cache=cache)
+    plain = make_pdf(str(tmp_path / 'plain.pdf'), pages=2)
+    with pytest.raises(ValueError):
+        add_watermark(plain, 'DRAFT', str(tmp_path / 'out.pdf'), password='secret', incremental=True, cache=cache)
+    assert os.listdir(tmp_path / 'cache') == []
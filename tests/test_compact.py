@@ -0,0 +1,98 @@
+import os
+from io import BytesIO
+
+import pytest
+from PyPDF2 import PdfReader, PdfWriter
+from reportlab.pdfgen import canvas
+
+from watermark import add_watermark, add_watermark_bytes, add_watermark_pdf
+from cache import ResultCache
+from metrics import Metrics
+from conftest import make_pdf
+
+def uncompressed_pdf(path, pages=6):
+    can = canvas.Canvas(path, pageCompression=0)
+    for i in range(pages):
+        for line in range(30):
+            can.drawString(72, 720 - line * 20, f'Page {i + 1} line {line + 1}')
+        can.showPage()
+    can.save()
+    return path
+
+def assert_same_pages(original_path, output_path, password=None):
+    original = PdfReader(original_path)
+    output = PdfReader(output_path)
+    if password:
+        assert output.decrypt(password)
+    assert len(output.pages) == len(original.pages)
+    for before, after in zip(original.pages, output.pages):
+        assert after.mediabox == before.mediabox
+        assert before.extract_text() in after.extract_text()
+    return output
+
+def font_objects(reader):
+    return {page['/Resources']['/Font'].raw_get(name).idnum for page in reader.pages for name in page['/Resources']['/Font']}
+
+@pytest.mark.parametrize('password', [None, 'hunter2'])
+@pytest.mark.parametrize('level', [0, 1, 2, 3])
+def test_levels_keep_document(sample_pdf, tmp_path, level, password):
+    output = str(tmp_path / 'out.pdf')
+    assert add_watermark_pdf(sample_pdf, 'DRAFT', output, password=password, compact=level) == 12
+    reader = assert_same_pages(sample_pdf, output, password=password)
+    for page in reader.pages:
+        assert any(name.startswith('/WatermarkStamp') for name in page['/Resources']['/XObject'])
+    if password:
+        assert not PdfReader(output).decrypt('wrong')
+
+def test_each_level_shrinks_uncompressed_input(tmp_path):
+    source = uncompressed_pdf(str(tmp_path / 'raw.pdf'))
+    sizes = []
+    for level in range(4):
+        output = str(tmp_path / f'out-{level}.pdf')
+        add_watermark_pdf(source, 'DRAFT', output, compact=level)
+        sizes.append(os.path.getsize(output))
+        assert 'line 30' in PdfReader(output).pages[5].extract_text()
+    assert sizes[1] < sizes[0] / 2
+    assert sizes[3] < sizes[2] <= sizes[1]
+
+def test_duplicates_are_merged(tmp_path):
+    # Appending a document twice copies its font; deduplication makes it one object again
+    part = make_pdf(str(tmp_path / 'part.pdf'), pages=4)
+    writer = PdfWriter()
+    writer.append(part)
+    writer.append(part)
+    source = str(tmp_path / 'merged.pdf')
+    with open(source, 'wb') as f:
+        writer.write(f)
+    assert len(font_objects(PdfReader(source))) == 2
+    events = []
+    output = str(tmp_path / 'out.pdf')
+    add_watermark_pdf(source, 'DRAFT', output, compact=2, metrics=Metrics(events.append))
+    reader = PdfReader(output)
+    assert len(reader.pages) == 8
+    assert len(font_objects(reader)) == 1
+    event = next(e for e in events if e['event'] == 'compact')
+    assert event['objects_merged'] > 0
+    assert os.path.getsize(output) < os.path.getsize(source)
+
+def test_object_streams(sample_pdf):
+    data = add_watermark_bytes(open(sample_pdf, 'rb').read(), 'DRAFT', compact=3)
+    assert data.startswith(b'%PDF-1.5')
+    assert b'/ObjStm' in data and b'/XRef' in data
+    assert b'\ntrailer\n' not in data
+    reader = PdfReader(BytesIO(data))
+    assert reader.trailer['/Root']['/Type'] == '/Catalog'
+    assert 'Page 12' in reader.pages[11].extract_text()
+
+def test_cached_result_encrypted_on_copy(sample_pdf, tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    plain, secret = str(tmp_path / 'plain.pdf'), str(tmp_path / 'secret.pdf')
+    add_watermark(sample_pdf, 'DRAFT', plain, cache=cache, compact=3)
+    add_watermark(sample_pdf, 'DRAFT', secret, cache=cache, compact=3, password='hunter2')
+    assert_same_pages(sample_pdf, secret, password='hunter2')
+    assert b'/ObjStm' in open(secret, 'rb').read()
+
+@pytest.mark.parametrize('mode', [dict(streaming=True), dict(incremental=True), dict(shards=2)])
+def test_rejected_with_other_writers(sample_pdf, tmp_path, mode):
+    with pytest.raises(ValueError):
+        add_watermark(sample_pdf, 'DRAFT', str(tmp_path / 'out.pdf'), compact=2, **mode)
@@ -0,0 +1,86 @@
+import zipfile
+from io import BytesIO
+
+import pytest
+from docx import Document
+from docx.enum.section import WD_SECTION
+
+from watermark import VML_SHAPE_PREFIX, add_watermark, add_watermark_bytes, add_watermark_docx, watermark_image_png
+
+def make_docx(path):
+    # Three sections: the second is linked to the first, the third is landscape with its own header
+    doc = Document()
+    doc.add_paragraph('Section one')
+    doc.add_section(WD_SECTION.NEW_PAGE)
+    doc.add_paragraph('Section two')
+    third = doc.add_section(WD_SECTION.NEW_PAGE)
+    third.page_width, third.page_height = third.page_height, third.page_width
+    third.header.is_linked_to_previous = False
+    doc.add_paragraph('Section three')
+    doc.save(path)
+    return path
+
+def header_parts(data):
+    with zipfile.ZipFile(BytesIO(data)) as z:
+        return {name: z.read(name) for name in z.namelist() if name.startswith('word/header')}
+
+def test_linked_sections_share_one_header(tmp_path):
+    source = make_docx(str(tmp_path / 'in.docx'))
+    output = str(tmp_path / 'out.docx')
+    reported = []
+    add_watermark(source, 'CONFIDENTIAL', output, progress_callback=lambda current, total: reported.append((current, total)))
+    headers = header_parts(open(output, 'rb').read())
+    assert len(headers) == 2
+    for xml in headers.values():
+        assert xml.count(VML_SHAPE_PREFIX.encode()) == 1
+        assert b'string="CONFIDENTIAL"' in xml
+    assert reported[-1] == (3, 3)
+    doc = Document(output)
+    assert doc.sections[1].header.is_linked_to_previous
+    assert [p.text for p in doc.paragraphs if p.text] == ['Section one', 'Section two', 'Section three']
+
+def test_rewatermarking_replaces_the_shape(tmp_path):
+    source = make_docx(str(tmp_path / 'in.docx'))
+    first = add_watermark_bytes(open(source, 'rb').read(), 'DRAFT', file_format='docx', output_format='docx')
+    second = add_watermark_bytes(first, 'FINAL', file_format='docx', output_format='docx')
+    for xml in header_parts(second).values():
+        assert xml.count(VML_SHAPE_PREFIX.encode()) == 1
+        assert b'FINAL' in xml and b'DRAFT' not in xml
+
+def test_text_is_escaped(tmp_path):
+    source = make_docx(str(tmp_path / 'in.docx'))
+    data = add_watermark_bytes(open(source, 'rb').read(), 'R&D <"internal">', file_format='docx', output_format='docx')
+    Document(BytesIO(data))
+    assert b'string="R&amp;D &lt;&quot;internal&quot;&gt;"' in b''.join(header_parts(data).values())
+
+def test_password_needs_pdf_output(tmp_path):
+    source = make_docx(str(tmp_path / 'in.docx'))
+    with pytest.raises(ValueError):
+        add_watermark(source, 'DRAFT', str(tmp_path / 'out.docx'), password='secret')
+    assert not (tmp_path / 'out.docx').exists()
+
+def test_raster_sections_share_image_parts(tmp_path):
+    # Six sections with their own headers in two page sizes: one rendered PNG and one image part per size
+    doc = Document()
+    for i in range(6):
+        section = doc.sections[0] if i == 0 else doc.add_section(WD_SECTION.NEW_PAGE)
+        section.header.is_linked_to_previous = False
+        if i % 2:
+            section.page_width, section.page_height = section.page_height, section.page_width
+        doc.add_paragraph(f'Section {i + 1}')
+    source, output = str(tmp_path / 'in.docx'), str(tmp_path / 'out.docx')
+    doc.save(source)
+    add_watermark_docx(source, 'CONFIDENTIAL', output)
+    with zipfile.ZipFile(output) as z:
+        assert len([name for name in z.namelist() if name.startswith('word/media/')]) == 2
+    assert all(xml.count(b'<w:drawing>') == 1 for xml in header_parts(open(output, 'rb').read()).values())
+    assert watermark_image_png('CONFIDENTIAL', 816, 158) is watermark_image_png('CONFIDENTIAL', 816, 158, color=[80, 80, 80])
+
+def test_raster_skips_linked_headers(tmp_path):
+    source = make_docx(str(tmp_path / 'in.docx'))
+    output = str(tmp_path / 'out.docx')
+    add_watermark_docx(source, 'CONFIDENTIAL', output)
+    headers = header_parts(open(output, 'rb').read())
+    assert len(headers) == 2
+    assert all(xml.count(b'<w:drawing>') == 1 for xml in headers.values())
+    assert Document(output).sections[1].header.is_linked_to_previous
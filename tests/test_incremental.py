@@ -0,0 +1,55 @@
+import os
+from io import BytesIO
+
+import pytest
+
+from incremental import add_watermark_pdf_incremental
+from watermark import add_watermark, add_watermark_bytes
+from conftest import assert_same_targets, make_pdf
+
+def stamped(reader):
+    return all(any(name.startswith('/WatermarkStamp') for name in page['/Resources']['/XObject']) for page in reader.pages)
+
+def test_original_bytes_are_kept(sample_pdf, tmp_path):
+    output = str(tmp_path / 'out.pdf')
+    assert add_watermark(sample_pdf, 'DRAFT', output, incremental=True) == 12
+    original = open(sample_pdf, 'rb').read()
+    data = open(output, 'rb').read()
+    assert data.startswith(original)
+    assert b'/Prev' in data[len(original):]
+    assert stamped(assert_same_targets(sample_pdf, output))
+
+def test_xref_stream_input(tmp_path):
+    compact = make_pdf(str(tmp_path / 'compact.pdf'), compact=3)
+    output = str(tmp_path / 'out.pdf')
+    add_watermark_pdf_incremental(compact, 'DRAFT', output)
+    tail = open(output, 'rb').read()[os.path.getsize(compact):]
+    assert b'/XRef' in tail and b'\nxref\n' not in tail
+    assert stamped(assert_same_targets(compact, output))
+    try:
+        import fitz
+    except ImportError:
+        return
+    with fitz.open(output) as doc:
+        assert not doc.is_repaired
+        assert 'DRAFT' in doc[0].get_text()
+
+def test_bytes_and_streams(sample_pdf):
+    original = open(sample_pdf, 'rb').read()
+    data = add_watermark_bytes(original, 'DRAFT', incremental=True)
+    assert data.startswith(original)
+    out = BytesIO()
+    with open(sample_pdf, 'rb') as f:
+        add_watermark_pdf_incremental(f, 'DRAFT', out)
+    assert out.getvalue() == data
+
+def test_rejects_passwords_and_encrypted_input(tmp_path):
+    encrypted = make_pdf(str(tmp_path / 'enc.pdf'), pages=2, password='secret')
+    with pytest.raises(ValueError):
+        add_watermark_pdf_incremental(encrypted, 'DRAFT', str(tmp_path / 'out.pdf'))
+    plain = make_pdf(str(tmp_path / 'plain.pdf'), pages=2)
+    with pytest.raises(ValueError):
+        add_watermark_pdf_incremental(plain, 'DRAFT', str(tmp_path / 'out.pdf'), password='secret')
+    with pytest.raises(ValueError):
+        add_watermark(plain, 'DRAFT', str(tmp_path / 'out.pdf'), incremental=True, streaming=True)
+    assert sorted(os.listdir(tmp_path)) == ['enc.pdf', 'plain.pdf']
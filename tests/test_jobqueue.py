@@ -0,0 +1,63 @@
+import os
+import time
+
+from PyPDF2 import PdfReader
+
+from jobqueue import JobQueue
+from conftest import make_pdf
+
+def drain(queue, until=None, timeout=60):
+    events = []
+    deadline = time.monotonic() + timeout
+    while queue.active() and time.monotonic() < deadline:
+        events.extend(queue.poll())
+        if until and until(events):
+            break
+        time.sleep(0.01)
+    return events
+
+def test_jobs_run_in_parallel_workers(tmp_path):
+    queue = JobQueue(workers=2)
+    try:
+        inputs = [make_pdf(str(tmp_path / f'in{i}.pdf'), pages=3) for i in range(3)]
+        ids = [queue.submit(path, path[:-4] + '_out.pdf', 'DRAFT') for path in inputs]
+        first = queue.poll()
+        assert [kind for _, kind, _ in first] == ['started', 'started']
+        events = first + drain(queue)
+        done = {job_id: payload for job_id, kind, payload in events if kind == 'done'}
+        assert sorted(done) == ids and all(pages == 3 for pages, _ in done.values())
+        assert all(len(PdfReader(path[:-4] + '_out.pdf').pages) == 3 for path in inputs)
+        assert (ids[0], 'progress', (3, 3)) in events
+    finally:
+        queue.shutdown()
+
+def test_cancel_queued_and_running_jobs(tmp_path):
+    queue = JobQueue(workers=1)
+    try:
+        big = make_pdf(str(tmp_path / 'big.pdf'), pages=3000)
+        small = make_pdf(str(tmp_path / 'small.pdf'), pages=2)
+        running = queue.submit(big, str(tmp_path / 'big_out.pdf'), 'DRAFT')
+        queued = queue.submit(small, str(tmp_path / 'small_out.pdf'), 'DRAFT')
+        last = queue.submit(small, str(tmp_path / 'last_out.pdf'), 'DRAFT')
+        assert queue.cancel(queued)
+        drain(queue, until=lambda events: any(kind == 'progress' for _, kind, _ in events))
+        assert queue.cancel(running) and not queue.cancel(running)
+        events = drain(queue)
+        assert (running, 'cancelled', None) in events
+        assert (last, 'started', None) in events
+        assert queue.jobs[last].status == 'done' and queue.jobs[queued].status == 'cancelled'
+        assert sorted(os.listdir(tmp_path)) == ['big.pdf', 'last_out.pdf', 'small.pdf']
+    finally:
+        queue.shutdown()
+
+def test_failures_are_reported(tmp_path):
+    queue = JobQueue(workers=1)
+    try:
+        broken = tmp_path / 'broken.pdf'
+        broken.write_bytes(b'%PDF-1.7\nbroken')
+        job_id = queue.submit(str(broken), str(tmp_path / 'out.pdf'), 'DRAFT')
+        events = drain(queue)
+        assert events[-1][:2] == (job_id, 'failed')
+        assert queue.jobs[job_id].status == 'failed'
+    finally:
+        queue.shutdown()
@@ -0,0 +1,70 @@
+import os
+
+import pytest
+from PyPDF2 import PdfReader
+
+from mailmerge import add_watermark_pdf_mailmerge, load_recipients
+from progress import Cancelled, CancelToken
+from conftest import assert_same_targets, make_pdf
+
+def stamp_text(reader, page=0):
+    forms = reader.pages[page]['/Resources']['/XObject']
+    return b''.join(form.get_object().get_data() for name, form in forms.items() if name.startswith('/WatermarkStamp'))
+
+def test_one_copy_per_recipient(sample_pdf, tmp_path):
+    pattern = str(tmp_path / '{index}-{name}.pdf')
+    outputs = add_watermark_pdf_mailmerge(sample_pdf, 'For {name}', ['Ada', 'Grace', {'name': 'Alan/T', 'password': 'enigma'}], pattern)
+    assert [os.path.basename(path) for path in outputs] == ['1-Ada.pdf', '2-Grace.pdf', '3-Alan_T.pdf']
+    for path, name in zip(outputs[:2], ('Ada', 'Grace')):
+        reader = assert_same_targets(sample_pdf, path)
+        assert f'For {name}'.encode() in stamp_text(reader)
+    reader = assert_same_targets(sample_pdf, outputs[2], password='enigma')
+    assert b'For Alan/T' in stamp_text(reader)
+    assert sorted(os.listdir(tmp_path)) == ['1-Ada.pdf', '2-Grace.pdf', '3-Alan_T.pdf', 'sample.pdf']
+
+def test_page_placeholders(tmp_path):
+    source = make_pdf(str(tmp_path / 'in.pdf'), pages=3)
+    output, = add_watermark_pdf_mailmerge(source, '{name} {page}/{pages}', [{'name': 'Ada', 'output': str(tmp_path / 'ada.pdf')}], None)
+    reader = PdfReader(output)
+    assert [b'Ada %d/3' % (i + 1) in stamp_text(reader, i) for i in range(3)] == [True] * 3
+
+def test_xref_stream_input(tmp_path):
+    source = make_pdf(str(tmp_path / 'compact.pdf'), compact=3)
+    outputs = add_watermark_pdf_mailmerge(source, 'For {name}', ['Ada', {'name': 'Grace', 'password': 'secret'}], str(tmp_path / '{name}.pdf'))
+    assert b'For Ada' in stamp_text(assert_same_targets(source, outputs[0]))
+    assert b'For Grace' in stamp_text(assert_same_targets(source, outputs[1], password='secret'))
+
+def test_parallel_matches_serial(sample_pdf, tmp_path):
+    recipients = [f'Reader {i}' for i in range(6)] + [{'name': 'Locked', 'password': 'secret'}]
+    serial = add_watermark_pdf_mailmerge(sample_pdf, 'For {name}', recipients, str(tmp_path / 'serial-{index}.pdf'))
+    parallel = add_watermark_pdf_mailmerge(sample_pdf, 'For {name}', recipients, str(tmp_path / 'parallel-{index}.pdf'), workers=3)
+    for a, b in zip(serial[:-1], parallel[:-1]):
+        with open(a, 'rb') as f, open(b, 'rb') as g:
+            assert f.read() == g.read()
+    assert_same_targets(sample_pdf, parallel[-1], password='secret')
+
+def test_bad_recipients_write_nothing(sample_pdf, tmp_path):
+    with pytest.raises(ValueError, match='Recipient 2 has no value for {team}'):
+        add_watermark_pdf_mailmerge(sample_pdf, '{name} ({team})', [{'name': 'Ada', 'team': 'A'}, 'Grace'], str(tmp_path / '{name}.pdf'))
+    with pytest.raises(ValueError, match='same output'):
+        add_watermark_pdf_mailmerge(sample_pdf, '{name}', ['Ada', 'Ada'], str(tmp_path / '{name}.pdf'))
+    assert os.listdir(tmp_path) == ['sample.pdf']
+
+def test_cancel_keeps_finished_copies(sample_pdf, tmp_path):
+    token = CancelToken()
+
+    def progress_callback(current, total):
+        if current == 2:
+            token.cancel()
+
+    with pytest.raises(Cancelled):
+        add_watermark_pdf_mailmerge(sample_pdf, '{name}', ['a', 'b', 'c', 'd'], str(tmp_path / '{name}.pdf'), progress_callback=progress_callback, cancel_token=token)
+    assert sorted(os.listdir(tmp_path)) == ['a.pdf', 'b.pdf', 'sample.pdf']
+
+def test_load_recipients(tmp_path):
+    csv_path = tmp_path / 'people.csv'
+    csv_path.write_text('name,team,password\nAda,A,\nGrace,B,hopper\n')
+    assert load_recipients(str(csv_path)) == [{'name': 'Ada', 'team': 'A'}, {'name': 'Grace', 'team': 'B', 'password': 'hopper'}]
+    txt_path = tmp_path / 'people.txt'
+    txt_path.write_text('Ada\n\nGrace\n')
+    assert load_recipients(str(txt_path)) == ['Ada', 'Grace']
@@ -0,0 +1,89 @@
+import os
+import json
+import errno
+
+import pytest
+
+import batch
+from batch import run_batch
+from manifest import Manifest, options_digest, start_record, append_record, sync_file
+from conftest import make_pdf
+
+def make_inputs(directory, count=3):
+    os.makedirs(directory)
+    return [make_pdf(os.path.join(directory, f'doc{i}.pdf'), pages=2) for i in range(count)]
+
+def test_finished_files_are_skipped(tmp_path):
+    inputs = make_inputs(str(tmp_path / 'in'))
+    manifest = Manifest(str(tmp_path / 'batch.jsonl'))
+    out = str(tmp_path / 'out')
+    first = run_batch(inputs, 'DRAFT', output_dir=out, workers=2, manifest=manifest)
+    assert (first['files'], first['failed'], first['skipped']) == (3, 0, [])
+    again = run_batch(inputs, 'DRAFT', output_dir=out, workers=2, manifest=manifest)
+    assert (again['files'], again['skipped']) == (0, inputs)
+    # New content, new settings or a missing output make a file due again
+    make_pdf(inputs[0], pages=3)
+    os.remove(os.path.join(out, 'doc1_watermarked.pdf'))
+    again = run_batch(inputs, 'DRAFT', output_dir=out, workers=2, manifest=manifest)
+    assert sorted(r[0] for r in again['results']) == inputs[:2] and again['skipped'] == inputs[2:]
+    again = run_batch(inputs, 'FINAL', output_dir=out, workers=2, manifest=manifest)
+    assert again['files'] == 3
+    assert sorted(os.listdir(out)) == ['doc0_watermarked.pdf', 'doc1_watermarked.pdf', 'doc2_watermarked.pdf']
+
+def test_failures_are_retried_then_quarantined(tmp_path):
+    inputs = make_inputs(str(tmp_path / 'in'), count=2)
+    with open(inputs[1], 'wb') as f:
+        f.write(b'%PDF-1.4 not really')
+    manifest = Manifest(str(tmp_path / 'batch.jsonl'), max_attempts=2)
+    for _ in range(2):
+        summary = run_batch(inputs, 'DRAFT', workers=2, manifest=manifest)
+        assert [r[0] for r in summary['results'] if not r[2]] == [inputs[1]]
+    summary = run_batch(inputs, 'DRAFT', workers=2, manifest=manifest)
+    assert summary['files'] == 0 and summary['quarantined'] == [inputs[1]] and summary['skipped'] == [inputs[0]]
+    assert Manifest(manifest.path).quarantined() == [inputs[1]]
+
+def test_interrupted_attempts_count(tmp_path):
+    # A worker killed mid-document leaves only its 'started' entry, and a crash can tear the last line
+    inputs = make_inputs(str(tmp_path / 'in'), count=1)
+    output = os.path.join(str(tmp_path / 'in'), 'doc0_watermarked.pdf')
+    journal = str(tmp_path / 'batch.jsonl')
+    append_record(journal, start_record(inputs[0], output, options_digest('DRAFT', output, dict(color=(80, 80, 80), opacity=80, position='Center Diagonal', font_size=48, incremental=False))))
+    with open(journal, 'a') as f:
+        f.write('{"status": "do')
+    manifest = Manifest(journal, max_attempts=2)
+    assert manifest.states[inputs[0]]['attempts'] == 1
+    summary = run_batch(inputs, 'DRAFT', workers=1, manifest=manifest)
+    assert summary['files'] == 1 and summary['failed'] == 0
+    with open(journal) as f:
+        records = [json.loads(line) for line in f.read().splitlines()[1:]]
+    assert [r['status'] for r in records] == ['started', 'done']
+    assert 'password' not in json.dumps(records)
+
+def test_killed_worker_only_fails_its_own_file(tmp_path, monkeypatch):
+    inputs = make_inputs(str(tmp_path / 'in'), count=6)
+    real = batch.add_watermark
+
+    def add_watermark(input_path, *args, **kwargs):
+        if input_path == inputs[2]:
+            os._exit(9)
+        return real(input_path, *args, **kwargs)
+
+    # Workers are forked, so they see the patched module
+    monkeypatch.setattr(batch, 'add_watermark', add_watermark)
+    summary = run_batch(inputs, 'DRAFT', workers=2, manifest=Manifest(str(tmp_path / 'batch.jsonl')))
+    assert summary['files'] == 6
+    assert [r[0] for r in summary['results'] if not r[2]] == [inputs[2]]
+
+def test_sync_file_uses_a_writable_handle(tmp_path, monkeypatch):
+    # Windows flushes with FlushFileBuffers, which rejects read-only handles
+    fcntl = pytest.importorskip('fcntl')
+    fsync = os.fsync
+
+    def windows_fsync(fd):
+        if fcntl.fcntl(fd, fcntl.F_GETFL) & os.O_ACCMODE == os.O_RDONLY:
+            raise OSError(errno.EBADF, 'Bad file descriptor')
+        fsync(fd)
+    monkeypatch.setattr(os, 'fsync', windows_fsync)
+    path = tmp_path / 'out.pdf'
+    path.write_bytes(b'%PDF')
+    sync_file(str(path))
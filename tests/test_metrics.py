@@ -0,0 +1,50 @@
+import io
+import json
+
+import pytest
+
+from metrics import NULL_METRICS, JsonLinesSink, Metrics
+from watermark import add_watermark, add_watermark_bytes, encrypt_pdf
+
+def test_null_metrics_do_nothing():
+    with NULL_METRICS.stage('parse', pages=3) as stage:
+        stage.bytes = 10
+    assert stage.bytes is None
+    assert NULL_METRICS.stage('write') is stage
+
+def test_pdf_stages(sample_pdf, tmp_path):
+    events = []
+    output = str(tmp_path / 'out.pdf')
+    add_watermark(sample_pdf, 'DRAFT', output, password='secret', metrics=Metrics(events.append, document='sample'))
+    ends = {e['stage']: e for e in events if e['event'] == 'end'}
+    assert [e['stage'] for e in events if e['event'] == 'start'][:2] == ['parse', 'stamp']
+    assert {'parse', 'render', 'stamp', 'encrypt', 'write'} <= set(ends)
+    assert ends['parse']['pages'] == ends['stamp']['pages'] == 12
+    assert ends['write']['bytes'] == (tmp_path / 'out.pdf').stat().st_size
+    assert all(e['document'] == 'sample' and e['seconds'] >= 0 for e in ends.values())
+
+def test_streaming_and_encrypt_stages(sample_pdf, tmp_path):
+    events = []
+    add_watermark(sample_pdf, 'DRAFT', str(tmp_path / 'out.pdf'), streaming=True, metrics=Metrics(events.append))
+    encrypt_pdf(sample_pdf, str(tmp_path / 'enc.pdf'), 'secret', metrics=Metrics(events.append))
+    stages = [e['stage'] for e in events if e['event'] == 'end']
+    assert stages.count('parse') == 2 and stages.count('write') == 2
+    assert 'copy' in stages and 'encrypt' in stages
+
+def test_failed_stage_reports_the_error():
+    events = []
+    with pytest.raises(Exception):
+        add_watermark_bytes(b'%PDF-1.7\nbroken', 'DRAFT', metrics=Metrics(events.append))
+    assert events[-1]['event'] == 'end' and events[-1]['stage'] == 'parse'
+    assert 'error' in events[-1]
+
+def test_json_lines_sink(sample_pdf, tmp_path):
+    path = tmp_path / 'metrics.jsonl'
+    sink = JsonLinesSink(str(path))
+    add_watermark(sample_pdf, 'DRAFT', str(tmp_path / 'out.pdf'), metrics=Metrics(sink, job=1))
+    sink.close()
+    events = [json.loads(line) for line in path.read_text().splitlines()]
+    assert events and all(e['job'] == 1 for e in events)
+    stream = io.StringIO()
+    JsonLinesSink(stream)({'event': 'start', 'stage': 'parse'})
+    assert json.loads(stream.getvalue()) == {'event': 'start', 'stage': 'parse'}
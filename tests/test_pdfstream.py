@@ -0,0 +1,93 @@
+import os
+import warnings
+from io import BytesIO
+
+import pytest
+from PyPDF2 import PdfReader
+
+import pdfstream
+from pdfstream import add_watermark_pdf_streaming, peak_rss
+from conftest import assert_same_targets, make_pdf
+
+def test_page_count_and_targets(sample_pdf, tmp_path):
+    output = str(tmp_path / 'out.pdf')
+    assert add_watermark_pdf_streaming(sample_pdf, 'CONFIDENTIAL', output, window=3) == 12
+    reader = assert_same_targets(sample_pdf, output)
+    # Every page carries the stamp
+    for page in reader.pages:
+        assert any(name.startswith('/WatermarkStamp') for name in page['/Resources']['/XObject'])
+
+def test_password_protected_output(sample_pdf, tmp_path):
+    output = str(tmp_path / 'out.pdf')
+    add_watermark_pdf_streaming(sample_pdf, 'SECRET', output, password='hunter2', window=5)
+    assert_same_targets(sample_pdf, output, password='hunter2')
+    assert not PdfReader(output).decrypt('wrong')
+
+def test_stream_destination(sample_pdf):
+    out = BytesIO()
+    add_watermark_pdf_streaming(sample_pdf, 'DRAFT', out)
+    assert len(PdfReader(BytesIO(out.getvalue())).pages) == 12
+
+def test_failure_leaves_no_output(tmp_path):
+    broken = tmp_path / 'broken.pdf'
+    broken.write_bytes(b'%PDF-1.7\nnot really a pdf\n')
+    output = tmp_path / 'out.pdf'
+    with pytest.raises(Exception):
+        add_watermark_pdf_streaming(str(broken), 'DRAFT', str(output))
+    assert os.listdir(tmp_path) == ['broken.pdf']
+
+def test_failure_keeps_existing_output(sample_pdf, tmp_path):
+    output = tmp_path / 'out.pdf'
+    output.write_bytes(b'previous result')
+    with pytest.raises(Exception):
+        add_watermark_pdf_streaming(str(tmp_path / 'missing.pdf'), 'DRAFT', str(output))
+    assert output.read_bytes() == b'previous result'
+    assert not os.path.exists(str(output) + '.tmp')
+
+def _record_collections(monkeypatch):
+    windows = []
+    release = pdfstream._release
+
+    def recording_release(reader, collect=True):
+        windows.append(collect)
+        release(reader, collect)
+    monkeypatch.setattr(pdfstream, '_release', recording_release)
+    return windows
+
+def test_window_shrinks_and_grows_back(tmp_path, monkeypatch):
+    source = make_pdf(str(tmp_path / 'long.pdf'), pages=40)
+    sizes = []
+    done = [0]
+    release = pdfstream._release
+
+    def recording_release(reader, collect=True):
+        sizes.append(done[0] - sum(sizes))
+        release(reader, collect)
+    monkeypatch.setattr(pdfstream, '_release', recording_release)
+    # Over budget for the first four windows, then back under it
+    monkeypatch.setattr(pdfstream, 'current_rss', lambda: 900 if len(sizes) <= 4 else 100)
+
+    def progress(current, total):
+        done[0] = current
+    add_watermark_pdf_streaming(source, 'DRAFT', str(tmp_path / 'out.pdf'), window=8, memory_budget=500, progress_callback=progress)
+    assert sizes[:8] == [8, 4, 2, 1, 1, 2, 4, 8]
+
+def test_unreachable_budget_warns_once(sample_pdf, tmp_path):
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        add_watermark_pdf_streaming(sample_pdf, 'DRAFT', str(tmp_path / 'out.pdf'), window=4, memory_budget=1)
+    assert len([w for w in caught if issubclass(w.category, RuntimeWarning)]) == 1
+
+def test_small_windows_collect_periodically(tmp_path, monkeypatch):
+    source = make_pdf(str(tmp_path / 'long.pdf'), pages=3 * pdfstream.DEFAULT_WINDOW)
+    collects = _record_collections(monkeypatch)
+    add_watermark_pdf_streaming(source, 'DRAFT', str(tmp_path / 'out.pdf'), window=1)
+    assert len(collects) == 3 * pdfstream.DEFAULT_WINDOW
+    assert sum(collects) == 3
+
+def test_memory_callback_reports_process_peak(sample_pdf, tmp_path):
+    reported = []
+    add_watermark_pdf_streaming(sample_pdf, 'DRAFT', str(tmp_path / 'out.pdf'), window=4, memory_callback=reported.append)
+    assert len(reported) == 3
+    assert reported[-1] <= peak_rss()
+    assert reported[-1] >= max(reported[:-1])
@@ -0,0 +1,59 @@
+from io import BytesIO
+
+import pytest
+from pptx import Presentation
+
+from watermark import PPTX_SHAPE_NAME, add_watermark, add_watermark_bytes
+
+def make_pptx(path, slides=40):
+    # Slide 3 hides master graphics itself; layout 6 (Blank) hides them for its slides
+    prs = Presentation()
+    prs.slide_layouts[6]._element.set('showMasterSp', '0')
+    for i in range(slides):
+        slide = prs.slides.add_slide(prs.slide_layouts[i % 7])
+        if slide.shapes.title is not None:
+            slide.shapes.title.text = f'Slide {i + 1}'
+    prs.slides[2]._element.set('showMasterSp', '0')
+    prs.save(path)
+    return path
+
+def watermarks(shapes):
+    return [shape for shape in shapes if shape.name == PPTX_SHAPE_NAME]
+
+def test_master_layout_and_slide_fallbacks(tmp_path):
+    source = make_pptx(str(tmp_path / 'deck.pptx'))
+    output = str(tmp_path / 'out.pptx')
+    reported = []
+    assert add_watermark(source, 'CONFIDENTIAL', output, opacity=40, progress_callback=lambda current, total: reported.append((current, total))) == 40
+    prs = Presentation(output)
+    assert [len(watermarks(master.shapes)) for master in prs.slide_masters] == [1]
+    assert [len(watermarks(layout.shapes)) for layout in prs.slide_layouts] == [0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0]
+    assert [i for i, slide in enumerate(prs.slides) if watermarks(slide.shapes)] == [2]
+    assert reported[-1] == (40, 40)
+    shape = watermarks(prs.slide_masters[0].shapes)[0]
+    assert shape.text_frame.text == 'CONFIDENTIAL'
+    assert shape.rotation == 315
+    # Behind every other shape on the master
+    assert prs.slide_masters[0].shapes[0].name == PPTX_SHAPE_NAME
+
+def test_cost_does_not_grow_with_slides(tmp_path):
+    small = make_pptx(str(tmp_path / 'small.pptx'), slides=8)
+    large = make_pptx(str(tmp_path / 'large.pptx'), slides=200)
+    grown = []
+    for source in (small, large):
+        before = open(source, 'rb').read()
+        grown.append(len(add_watermark_bytes(before, 'DRAFT', file_format='pptx')) - len(before))
+    assert abs(grown[1] - grown[0]) < 512
+
+def test_rewatermarking_replaces_the_shape(tmp_path):
+    source = make_pptx(str(tmp_path / 'deck.pptx'), slides=8)
+    first = add_watermark_bytes(open(source, 'rb').read(), 'DRAFT', file_format='pptx')
+    second = add_watermark_bytes(first, 'FINAL', file_format='pptx')
+    prs = Presentation(BytesIO(second))
+    shapes = watermarks(prs.slide_masters[0].shapes) + watermarks(prs.slides[2].shapes)
+    assert [shape.text_frame.text for shape in shapes] == ['FINAL', 'FINAL']
+
+def test_password_needs_pdf_output(tmp_path):
+    source = make_pptx(str(tmp_path / 'deck.pptx'), slides=4)
+    with pytest.raises(ValueError):
+        add_watermark(source, 'DRAFT', str(tmp_path / 'out.pptx'), password='secret')
@@ -0,0 +1,43 @@
+import pytest
+
+pytest.importorskip('PyQt6.QtPdf')
+
+from preview import PreviewRenderer
+from watermark import add_watermark
+from conftest import make_pdf
+from test_docx import make_docx
+
+def pixels(image):
+    return [image.pixel(x, y) for y in range(image.height()) for x in range(image.width())]
+
+@pytest.mark.parametrize('position', ['Center Diagonal', 'Top-left', 'Bottom-right'])
+def test_preview_matches_output(tmp_path, position):
+    source = make_pdf(str(tmp_path / 'in.pdf'), pages=2)
+    output = str(tmp_path / 'out.pdf')
+    style = dict(color=(220, 38, 38), opacity=60, position=position, font_size=40)
+    add_watermark(source, 'PREVIEW', output, **style)
+    renderer = PreviewRenderer()
+    renderer.open(source)
+    preview = renderer.render(1, 300, 300, 'PREVIEW', **style)
+    expected = PreviewRenderer()
+    expected.open(output)
+    assert pixels(preview) == pixels(expected.render(1, 300, 300, ''))
+
+def test_backgrounds_are_cached(tmp_path):
+    renderer = PreviewRenderer()
+    renderer.open(make_pdf(str(tmp_path / 'in.pdf'), pages=3))
+    assert renderer.page_count() == 3
+    renderer.render(0, 200, 200, 'A')
+    background = renderer.background(0, renderer.pixel_size(0, 200, 200))
+    renderer.render(0, 200, 200, 'B', opacity=20)
+    # The cached page is drawn on a copy, so it never picks up a stamp
+    assert renderer.background(0, renderer.pixel_size(0, 200, 200)) is background
+    assert pixels(background) == pixels(renderer.render(0, 200, 200, ''))
+
+def test_office_documents_preview_at_page_size(tmp_path):
+    renderer = PreviewRenderer()
+    renderer.open(make_docx(str(tmp_path / 'in.docx')))
+    assert renderer.page_count() == 1
+    assert not renderer.render(0, 200, 200, 'DRAFT').isNull()
+    with pytest.raises(ValueError):
+        renderer.open(str(tmp_path / 'notes.txt'))
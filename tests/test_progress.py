@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from cache import ResultCache
+from progress import Cancelled, CancelToken, ThrottledProgress
+from watermark import add_watermark, encrypt_pdf
+from conftest import make_pdf
+from test_docx import make_docx
+from test_pptx import make_pptx
+
+def cancel_after(token, pages):
+    def progress_callback(current, total):
+        if current >= pages:
+            token.cancel()
+    return progress_callback
+
+# Shards report progress in batches and run in other processes, so they get a longer document
+@pytest.mark.parametrize('options, pages', [({}, 200), ({'password': 'secret'}, 200), ({'streaming': True}, 200), ({'incremental': True}, 200), ({'shards': 2}, 1500)])
+def test_pdf_modes_stop_and_clean_up(tmp_path, options, pages):
+    source = make_pdf(str(tmp_path / 'in.pdf'), pages=pages)
+    token = CancelToken()
+    with pytest.raises(Cancelled):
+        add_watermark(source, 'DRAFT', str(tmp_path / 'out.pdf'), progress_callback=cancel_after(token, 3), cancel_token=token, **options)
+    assert os.listdir(tmp_path) == ['in.pdf']
+
+def test_office_formats_and_encryption(tmp_path):
+    docx = make_docx(str(tmp_path / 'in.docx'))
+    pptx = make_pptx(str(tmp_path / 'in.pptx'), slides=4)
+    pdf = make_pdf(str(tmp_path / 'in.pdf'), pages=2)
+    token = CancelToken()
+    token.cancel()
+    with pytest.raises(Cancelled):
+        add_watermark(docx, 'DRAFT', str(tmp_path / 'out.docx'), cancel_token=token)
+    with pytest.raises(Cancelled):
+        add_watermark(pptx, 'DRAFT', str(tmp_path / 'out.pptx'), cancel_token=token)
+    with pytest.raises(Cancelled):
+        encrypt_pdf(pdf, str(tmp_path / 'out.pdf'), 'secret', cancel_token=token)
+    assert sorted(os.listdir(tmp_path)) == ['in.docx', 'in.pdf', 'in.pptx']
+
+def test_cancelled_jobs_are_not_cached(tmp_path):
+    source = make_pdf(str(tmp_path / 'in.pdf'), pages=20)
+    cache = ResultCache(str(tmp_path / 'cache'))
+    token = CancelToken()
+    with pytest.raises(Cancelled):
+        add_watermark(source, 'DRAFT', str(tmp_path / 'out.pdf'), progress_callback=cancel_after(token, 3), cancel_token=token, cache=cache)
+    assert os.listdir(tmp_path / 'cache') == []
+    assert add_watermark(source, 'DRAFT', str(tmp_path / 'out.pdf'), cancel_token=CancelToken(), cache=cache) == 20
+
+def test_throttled_progress_is_bounded():
+    calls = []
+    progress = ThrottledProgress(lambda current, total: calls.append(current), interval=0)
+    for i in range(50000):
+        progress(i + 1, 50000)
+    assert len(calls) == 101 and calls[0] == 1 and calls[-1] == 50000
+    calls.clear()
+    progress = ThrottledProgress(lambda current, total: calls.append(current), interval=60)
+    for i in range(10):
+        progress(i + 1, 10)
+    assert calls == [1, 10]
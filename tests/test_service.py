@@ -0,0 +1,129 @@
+import json
+import time
+import asyncio
+from io import BytesIO
+
+import pytest
+from PyPDF2 import PdfReader
+
+from service import HttpError, Job, WatermarkService
+
+def offline_service(queue_size=2, **options):
+    # Parses and queues requests without a worker pool, so nothing is ever dequeued
+    svc = WatermarkService(workers=1, queue_size=queue_size, **options)
+    svc.queue = asyncio.Queue(maxsize=queue_size)
+    svc.progress = {}
+    return svc
+
+async def http(svc, method, target, body=b'', headers=()):
+    # One request through serve_client over a real socket
+    server = await asyncio.start_server(svc.serve_client, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        head = f'{method} {target} HTTP/1.1\r\nContent-Length: {len(body)}\r\n' + ''.join(f'{k}: {v}\r\n' for k, v in headers) + '\r\n'
+        writer.write(head.encode() + body)
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+    head, _, payload = response.partition(b'\r\n\r\n')
+    lines = head.decode().split('\r\n')
+    response_headers = dict(line.split(': ', 1) for line in lines[1:])
+    return int(lines[0].split()[1]), response_headers, payload
+
+@pytest.mark.parametrize('query', [
+    '',
+    'text=DRAFT&format=txt',
+    'text=DRAFT&format=pptx&output=pdf',
+    'text=DRAFT&position=Middle',
+    'text=DRAFT&opacity=high',
+    'text=DRAFT&color=mauve',
+    'text=DRAFT&format=pptx&password=secret',
+])
+def test_bad_parameters_are_rejected(query):
+    async def run():
+        svc = offline_service()
+        status, _, payload = await http(svc, 'POST', '/jobs?' + query, b'%PDF')
+        assert status == 400 and json.loads(payload)['error']
+        assert not svc.jobs
+    asyncio.run(run())
+
+def test_full_queue_answers_429():
+    async def run():
+        svc = offline_service(queue_size=1)
+        status, _, payload = await http(svc, 'POST', '/jobs?text=DRAFT', b'%PDF')
+        assert status == 202 and json.loads(payload)['status'] == 'queued'
+        status, headers, _ = await http(svc, 'POST', '/jobs?text=DRAFT', b'%PDF')
+        assert status == 429 and headers['Retry-After'] == '1'
+        assert len(svc.jobs) == 1
+    asyncio.run(run())
+
+def test_routing_errors():
+    async def run():
+        svc = offline_service()
+        with pytest.raises(HttpError) as e:
+            await svc.handle('GET', '/jobs', {}, {}, b'')
+        assert e.value.status == 405
+        with pytest.raises(HttpError) as e:
+            await svc.handle('GET', '/jobs/missing', {}, {}, b'')
+        assert e.value.status == 404
+        job = svc.submit(b'%PDF', {'text': 'DRAFT'}, {})
+        with pytest.raises(HttpError) as e:
+            await svc.handle('GET', f'/jobs/{job.id}/result', {}, {}, b'')
+        assert e.value.status == 409
+        # Deleting a queued job cancels it; the dispatcher skips it
+        assert await svc.handle('DELETE', f'/jobs/{job.id}', {}, {}, b'') == (204, None)
+        assert job.status == 'cancelled' and job.id not in svc.jobs
+    asyncio.run(run())
+
+def test_oldest_results_expire_past_the_memory_bound():
+    async def run():
+        svc = offline_service(max_result_bytes=250)
+        jobs = []
+        for i in range(3):
+            job = Job(f'job{i}', None, 'pdf', 'DRAFT', {'output_format': 'pdf'})
+            job.status, job.result = 'done', b'x' * 100
+            svc.jobs[job.id] = job
+            jobs.append(job)
+        svc._evict(keep=jobs[-1])
+        assert [job.status for job in jobs] == ['expired', 'done', 'done']
+        assert jobs[0].result is None
+        with pytest.raises(HttpError) as e:
+            await svc.handle('GET', '/jobs/job0/result', {}, {}, b'')
+        assert e.value.status == 410
+        # The job that just finished is kept even when it alone is over the bound
+        svc.max_result_bytes = 50
+        svc._evict(keep=jobs[-1])
+        assert [job.status for job in jobs] == ['expired', 'expired', 'done']
+    asyncio.run(run())
+
+def test_submit_poll_and_download(sample_pdf):
+    async def run():
+        svc = WatermarkService(workers=1, queue_size=2)
+        await svc.start()
+        try:
+            status, _, payload = await http(svc, 'POST', '/jobs?text=DRAFT&opacity=40', open(sample_pdf, 'rb').read(), [('X-Watermark-Password', 'hunter2')])
+            assert status == 202
+            job_id = json.loads(payload)['id']
+            deadline = time.monotonic() + 60
+            while True:
+                status, _, payload = await http(svc, 'GET', f'/jobs/{job_id}')
+                info = json.loads(payload)
+                if info['status'] in ('done', 'failed') or time.monotonic() > deadline:
+                    break
+                await asyncio.sleep(0.05)
+            assert info['status'] == 'done', info
+            assert info['progress'] == {'current': 12, 'total': 12}
+            status, headers, payload = await http(svc, 'GET', f'/jobs/{job_id}/result')
+            assert status == 200 and headers['Content-Type'] == 'application/pdf'
+            reader = PdfReader(BytesIO(payload))
+            assert reader.decrypt('hunter2') and len(reader.pages) == 12
+            status, _, _ = await http(svc, 'DELETE', f'/jobs/{job_id}')
+            assert status == 204
+            status, _, _ = await http(svc, 'GET', f'/jobs/{job_id}')
+            assert status == 404
+            status, _, payload = await http(svc, 'GET', '/health')
+            assert status == 200 and json.loads(payload)['status'] == 'ok'
+        finally:
+            await svc.stop()
+    asyncio.run(run())
@@ -0,0 +1,73 @@
+import os
+
+import pytest
+from PyPDF2 import PdfReader
+
+import shard
+from shard import add_watermark_pdf_sharded
+from conftest import assert_same_targets, make_pdf
+
+def raw_objects(path):
+    # Object number -> the bytes between 'N 0 obj' and 'endobj'
+    with open(path, 'rb') as f:
+        data = f.read()
+    objects = {}
+    for idnum, offset in PdfReader(path).xref[0].items():
+        objects[idnum] = data[offset:data.index(b'endobj', offset)]
+    return objects
+
+def test_page_count_and_targets(sample_pdf, tmp_path):
+    output = str(tmp_path / 'out.pdf')
+    assert add_watermark_pdf_sharded(sample_pdf, 'CONFIDENTIAL', output, shards=3, workers=2) == 12
+    assert_same_targets(sample_pdf, output)
+
+def test_password_protected_output(sample_pdf, tmp_path):
+    output = str(tmp_path / 'out.pdf')
+    add_watermark_pdf_sharded(sample_pdf, 'SECRET', output, password='hunter2', shards=4, workers=2)
+    assert_same_targets(sample_pdf, output, password='hunter2')
+
+def test_xref_stream_input(tmp_path):
+    source = make_pdf(str(tmp_path / 'compact.pdf'), compact=3)
+    output = str(tmp_path / 'out.pdf')
+    assert add_watermark_pdf_sharded(source, 'DRAFT', output, shards=2, workers=2) == 12
+    assert_same_targets(source, output)
+
+def test_shared_objects_are_identical_across_shards(sample_pdf, tmp_path):
+    single = str(tmp_path / 'single.pdf')
+    split = str(tmp_path / 'split.pdf')
+    add_watermark_pdf_sharded(sample_pdf, 'DRAFT', single, shards=1, workers=1)
+    add_watermark_pdf_sharded(sample_pdf, 'DRAFT', split, shards=4, workers=4)
+    assert raw_objects(split) == raw_objects(single)
+    # Fonts and stamps shared by pages of different shards are written once
+    reader = PdfReader(split)
+    fonts = {page['/Resources'].raw_get('/Font').idnum for page in reader.pages}
+    assert len(fonts) == 1
+    stamps = {ref.idnum for page in reader.pages for name, ref in page['/Resources']['/XObject'].items() if name.startswith('/WatermarkStamp')}
+    assert len(stamps) == len({tuple(page.mediabox) for page in reader.pages})
+
+def test_progress_reaches_total(tmp_path):
+    source = make_pdf(str(tmp_path / 'long.pdf'), pages=3 * shard.REPORT_EVERY + 5)
+    reported = []
+    add_watermark_pdf_sharded(source, 'DRAFT', str(tmp_path / 'out.pdf'), shards=3, workers=3, progress_callback=lambda current, total: reported.append((current, total)))
+    assert reported[-1] == (3 * shard.REPORT_EVERY + 5,) * 2
+    assert [current for current, _ in reported] == sorted(current for current, _ in reported)
+
+def _failing_stamped_page(page, stamp, pages_ref):
+    raise ValueError('shard failed')
+
+def test_failure_leaves_no_output(sample_pdf, tmp_path, monkeypatch):
+    # Workers are forked, so they see the patched module
+    monkeypatch.setattr(shard, 'stamped_page', _failing_stamped_page)
+    output = tmp_path / 'out.pdf'
+    with pytest.raises(ValueError, match='shard failed'):
+        add_watermark_pdf_sharded(sample_pdf, 'DRAFT', str(output), shards=2, workers=2)
+    assert os.listdir(tmp_path) == ['sample.pdf']
+
+def test_failure_keeps_existing_output(sample_pdf, tmp_path, monkeypatch):
+    monkeypatch.setattr(shard, 'stamped_page', _failing_stamped_page)
+    output = tmp_path / 'out.pdf'
+    output.write_bytes(b'previous result')
+    with pytest.raises(ValueError):
+        add_watermark_pdf_sharded(sample_pdf, 'DRAFT', str(output), shards=2, workers=2)
+    assert output.read_bytes() == b'previous result'
+    assert sorted(os.listdir(tmp_path)) == ['out.pdf', 'sample.pdf']
@@ -0,0 +1,39 @@
+import re
+
+import pytest
+from PyPDF2 import PdfReader
+
+from watermark import add_watermark
+from mailmerge import add_watermark_pdf_mailmerge
+
+MODES = {
+    'default': {},
+    'streaming': dict(streaming=True),
+    'shards': dict(shards=2),
+    'incremental': dict(incremental=True),
+}
+
+def stamps(page):
+    # Text of every stamp the page's content actually draws, in drawing order
+    xobjects = page['/Resources']['/XObject']
+    contents = page['/Contents']
+    data = b'\n'.join(part.get_object().get_data() for part in contents) if isinstance(contents, list) else contents.get_data()
+    drawn = re.findall(rb'/(WatermarkStamp\d+) Do', data)
+    return [xobjects['/' + name.decode()].get_object().get_data() for name in drawn]
+
+@pytest.mark.parametrize('mode', MODES)
+def test_watermarking_twice_keeps_both_stamps(sample_pdf, tmp_path, mode):
+    first, second = str(tmp_path / 'first.pdf'), str(tmp_path / 'second.pdf')
+    add_watermark(sample_pdf, 'FIRST', first, **MODES[mode])
+    add_watermark(first, 'SECOND', second, **MODES[mode])
+    for page in PdfReader(second).pages:
+        drawn = stamps(page)
+        assert len(drawn) == 2
+        assert b'FIRST' in drawn[0] and b'SECOND' in drawn[1]
+
+def test_mailmerge_over_a_watermarked_file(sample_pdf, tmp_path):
+    first = str(tmp_path / 'first.pdf')
+    add_watermark(sample_pdf, 'FIRST', first)
+    output, = add_watermark_pdf_mailmerge(first, 'For {name}', ['Ada'], str(tmp_path / '{name}.pdf'))
+    drawn = stamps(PdfReader(output).pages[0])
+    assert b'FIRST' in drawn[0] and b'For Ada' in drawn[1]
@@ -1,25 +1,64 @@
 import os
-from PyPDF2 import PdfReader, PdfWriter
-from docx import Document
-from docx.shared import RGBColor as DocxRGBColor, Inches as DocxInches
-from pptx import Presentation
-from pptx.util import Inches, Pt
-from pptx.enum.shapes import MSO_SHAPE
-from pptx.dml.color import RGBColor as PptxRGBColor
 from tempfile import NamedTemporaryFile
-from PIL import Image, ImageDraw, ImageFont
-from docx2pdf import convert as docx2pdf_convert
 import shutil
+import sys
+import functools
+import importlib
+import contextlib
+from io import BytesIO
+
+from metrics import NULL_METRICS, position_of, size_of, timed
+
+# PyPDF2, python-docx, python-pptx, Pillow, reportlab and docx2pdf are imported
+# inside the functions that use them, so importing this module (and starting the
+# GUI or a worker process) does not pay for formats that are never used.
 
 DPI = 96  # Standard screen DPI for conversion
 
-def generate_watermark_image(text, width=600, height=200, color=(80, 80, 80), opacity=80, font_size=48, position='Center Diagonal'):
+COLOR_MAP = {
+    'Black': (0, 0, 0),
+    'White': (255, 255, 255),
+    'Gray': (128, 128, 128),
+    'Light Gray': (200, 200, 200),
+    'Red': (220, 38, 38),
+    'Blue': (37, 99, 235),
+    'Green': (16, 185, 129),
+}
+
+POSITION_MAP = [
+    'Center Diagonal',
+    'Center',
+    'Top-left',
+    'Top-right',
+    'Bottom-left',
+    'Bottom-right',
+]
+
+# Output compaction levels (see compact.py); each includes the ones before it
+COMPACT_LEVELS = {
+    0: 'off',
+    1: 'compress streams',
+    2: 'deduplicate objects',
+    3: 'object streams',
+}
+
+FONT_CACHE_SIZE = 16
+IMAGE_CACHE_SIZE = 16
+
+@functools.lru_cache(maxsize=FONT_CACHE_SIZE)
+def load_font(font_size):
+    # Opening and parsing the TrueType file costs more than drawing the text with it
+    from PIL import ImageFont
+    try:
+        return ImageFont.truetype('arial.ttf', font_size)
+    except OSError:
+        return ImageFont.load_default()
+
+def render_watermark_image(text, width=600, height=200, color=(80, 80, 80), opacity=80, font_size=48, position='Center Diagonal'):
+    from PIL import Image, ImageDraw
     image = Image.new('RGBA', (width, height), (255, 255, 255, 0))
     draw = ImageDraw.Draw(image)
-    try:
-        font = ImageFont.truetype('arial.ttf', font_size)
-    except:
-        font = ImageFont.load_default()
+    font = load_font(font_size)
     if hasattr(draw, 'textbbox'):
         bbox = draw.textbbox((0, 0), text, font=font)
         text_width = bbox[2] - bbox[0]
@@ -48,103 +87,638 @@ def generate_watermark_image(text, width=600, height=200, color=(80, 80, 80), op
         image.alpha_composite(rotated, (0, 0))
     else:
         image.alpha_composite(txt_img, (0, 0))
+    return image
+
+@functools.lru_cache(maxsize=IMAGE_CACHE_SIZE)
+def _watermark_png(text, width, height, color, opacity, font_size, position):
+    buffer = BytesIO()
+    render_watermark_image(text, width=width, height=height, color=color, opacity=opacity, font_size=font_size, position=position).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+def watermark_image_png(text, width=600, height=200, color=(80, 80, 80), opacity=80, font_size=48, position='Center Diagonal'):
+    # Cached per text, style and pixel size: sections and documents with the same page size reuse one PNG
+    return _watermark_png(text, width, height, tuple(color), opacity, font_size, position)
+
+def generate_watermark_image(text, width=600, height=200, color=(80, 80, 80), opacity=80, font_size=48, position='Center Diagonal'):
     temp = NamedTemporaryFile(delete=False, suffix='.png')
-    image.save(temp.name, 'PNG')
+    with temp:
+        temp.write(watermark_image_png(text, width=width, height=height, color=color, opacity=opacity, font_size=font_size, position=position))
     return temp.name
 
-def add_watermark_pdf(input_path, watermark_text, output_path, color=(80,80,80), opacity=80, position='Center Diagonal', font_size=48, progress_callback=None):
-    reader = PdfReader(input_path)
-    writer = PdfWriter()
-    from io import BytesIO
+def is_path(obj):
+    return isinstance(obj, (str, os.PathLike))
+
+def pdf_source(source):
+    # Paths and binary file objects go to PdfReader as they are; bytes-like
+    # input is wrapped without copying when it is (a view of) a bytes object
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source)
+        if isinstance(view.obj, bytes) and view.contiguous and view.nbytes == len(view.obj):
+            return BytesIO(view.obj)
+        return BytesIO(view)
+    return source
+
+@contextlib.contextmanager
+def open_source(source):
+    source = pdf_source(source)
+    if is_path(source):
+        with open(source, 'rb') as f:
+            yield f
+    else:
+        yield source
+
+@contextlib.contextmanager
+def open_destination(destination):
+    # Paths are written to a temporary sibling and renamed into place on
+    # success, so a failure never leaves a truncated output (or input) behind
+    if is_path(destination):
+        tmp_path = os.fspath(destination) + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                yield f
+            os.replace(tmp_path, destination)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    else:
+        yield destination
+
+STAMP_CACHE_SIZE = 64
+STAMP_MARGIN = 36
+
+def stamp_anchor(page_width, page_height, position):
+    # Corner positions are aligned towards their corner so long text stays on the page
+    if position == 'Top-left':
+        return STAMP_MARGIN, page_height - STAMP_MARGIN, 'left'
+    if position == 'Top-right':
+        return page_width - STAMP_MARGIN, page_height - STAMP_MARGIN, 'right'
+    if position == 'Bottom-left':
+        return STAMP_MARGIN, STAMP_MARGIN, 'left'
+    if position == 'Bottom-right':
+        return page_width - STAMP_MARGIN, STAMP_MARGIN, 'right'
+    return page_width / 2, page_height / 2, 'center'
+
+@functools.lru_cache(maxsize=STAMP_CACHE_SIZE)
+def _render_stamp(watermark_text, color, opacity, position, font_size, page_width, page_height):
     from reportlab.pdfgen import canvas
-    from reportlab.lib.pagesizes import letter
     from reportlab.lib.colors import Color
     packet = BytesIO()
-    can = canvas.Canvas(packet, pagesize=letter)
+    can = canvas.Canvas(packet, pagesize=(page_width, page_height))
     can.setFont("Helvetica", font_size)
     r, g, b = [c/255 for c in color]
     can.setFillColor(Color(r, g, b, alpha=opacity/100))
     can.saveState()
-    tx, ty = 300, 400
-    if position == 'Top-left':
-        tx, ty = 100, 700
-    elif position == 'Top-right':
-        tx, ty = 500, 700
-    elif position == 'Bottom-left':
-        tx, ty = 100, 100
-    elif position == 'Bottom-right':
-        tx, ty = 500, 100
-    elif position == 'Center':
-        tx, ty = 300, 400
+    tx, ty, align = stamp_anchor(page_width, page_height, position)
+    if position.startswith('Top'):
+        ty -= font_size * 0.75  # keep the cap height below the margin
     can.translate(tx, ty)
     if position == 'Center Diagonal':
         can.rotate(45)
-    can.drawCentredString(0, 0, watermark_text)
+    if align == 'left':
+        can.drawString(0, 0, watermark_text)
+    elif align == 'right':
+        can.drawRightString(0, 0, watermark_text)
+    else:
+        can.drawCentredString(0, 0, watermark_text)
     can.restoreState()
     can.save()
-    packet.seek(0)
-    from PyPDF2 import PdfReader as RLReader
-    watermark_pdf = RLReader(packet)
-    watermark_page = watermark_pdf.pages[0]
-    total_pages = len(reader.pages)
-    for i, page in enumerate(reader.pages):
-        page.merge_page(watermark_page)
-        writer.add_page(page)
-        if progress_callback:
-            progress_callback(i + 1, total_pages)
-    with open(output_path, 'wb') as f:
+    return packet.getvalue()
+
+def render_watermark_pdf(watermark_text, color=(80,80,80), opacity=80, position='Center Diagonal', font_size=48, page_size=(612, 792)):
+    # Stamps are cached per process, so batch and service workers reuse them across documents
+    return _render_stamp(watermark_text, tuple(color), opacity, position, font_size, round(float(page_size[0]), 2), round(float(page_size[1]), 2))
+
+def page_geometry(page):
+    box = page.cropbox
+    rotation = page.rotation % 360
+    if rotation % 90:
+        rotation = 0
+    return (round(float(box.left), 2), round(float(box.bottom), 2), round(float(box.width), 2), round(float(box.height), 2), rotation)
+
+def _stamp_placement(geometry):
+    # Returns the upright (as displayed) size of the page and the matrix that maps
+    # that upright space back into the page's own, possibly rotated, user space.
+    x0, y0, width, height, rotation = geometry
+    if rotation == 90:
+        return (height, width), (0, 1, -1, 0, x0 + width, y0)
+    if rotation == 180:
+        return (width, height), (-1, 0, 0, -1, x0 + width, y0 + height)
+    if rotation == 270:
+        return (height, width), (0, -1, 1, 0, x0, y0 + height)
+    return (width, height), (1, 0, 0, 1, x0, y0)
+
+def _inline(obj):
+    # Resolves indirect references so the object can be written into any PDF
+    from PyPDF2.generic import ArrayObject, DictionaryObject, NameObject
+    obj = obj.get_object()
+    if isinstance(obj, DictionaryObject):
+        copy = DictionaryObject()
+        for key, value in obj.items():
+            copy[NameObject(key)] = _inline(value)
+        return copy
+    if isinstance(obj, ArrayObject):
+        return ArrayObject(_inline(value) for value in obj)
+    return obj
+
+def build_stamp_xobject(stamp_pdf, matrix=None):
+    from PyPDF2 import PdfReader
+    from PyPDF2.generic import ArrayObject, DecodedStreamObject, FloatObject, NameObject
+    stamp_page = PdfReader(BytesIO(stamp_pdf)).pages[0]
+    contents = stamp_page.get('/Contents')
+    contents = contents.get_object() if contents is not None else ArrayObject()
+    if isinstance(contents, ArrayObject):
+        data = b'\n'.join(part.get_object().get_data() for part in contents)
+    else:
+        data = contents.get_data()
+    form = DecodedStreamObject()
+    form.set_data(data)
+    form = form.flate_encode()
+    form[NameObject('/Type')] = NameObject('/XObject')
+    form[NameObject('/Subtype')] = NameObject('/Form')
+    form[NameObject('/BBox')] = ArrayObject(FloatObject(v) for v in stamp_page.mediabox)
+    resources = stamp_page.get('/Resources')
+    if resources is not None:
+        form[NameObject('/Resources')] = _inline(resources)
+    if matrix is not None:
+        form[NameObject('/Matrix')] = ArrayObject(FloatObject(v) for v in matrix)
+    return form
+
+def content_stream(data):
+    from PyPDF2.generic import DecodedStreamObject
+    stream = DecodedStreamObject()
+    stream.set_data(data)
+    return stream
+
+def apply_stamp(page, name, form_ref, opening_ref, closing_ref):
+    from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject
+    resources = page.get('/Resources')
+    if resources is None:
+        resources = DictionaryObject()
+        page[NameObject('/Resources')] = resources
+    else:
+        resources = resources.get_object()
+    xobjects = resources.get('/XObject')
+    if xobjects is None:
+        xobjects = DictionaryObject()
+        resources[NameObject('/XObject')] = xobjects
+    else:
+        xobjects = xobjects.get_object()
+    xobjects[NameObject(name)] = form_ref
+    contents = page.get('/Contents')
+    parts = ArrayObject([opening_ref])
+    if isinstance(contents, IndirectObject) and isinstance(contents.get_object(), ArrayObject):
+        contents = contents.get_object()
+    if isinstance(contents, ArrayObject):
+        parts.extend(contents)
+    elif contents is not None:
+        parts.append(contents)
+    parts.append(closing_ref)
+    page[NameObject('/Contents')] = parts
+
+STAMP_PREFIX = '/WatermarkStamp'
+
+def first_stamp_number(pages):
+    # Stamps left by an earlier run keep their resource names (their pages still
+    # draw them), so new stamps are numbered after the highest one in use
+    used = -1
+    for page in pages:
+        resources = page.get('/Resources')
+        xobjects = resources.get_object().get('/XObject') if resources is not None else None
+        for name in xobjects.get_object() if xobjects is not None else ():
+            number = name[len(STAMP_PREFIX):]
+            if name.startswith(STAMP_PREFIX) and number.isdigit():
+                used = max(used, int(number))
+    return used + 1
+
+class XObjectStamper:
+    # Each distinct page geometry gets one Form XObject per output; pages only
+    # gain shared q / Q-Do content streams and a resource entry, so the cost
+    # per page stays constant.
+
+    def __init__(self, add_object, render_stamp, first_number=0):
+        self.add_object = add_object
+        self.render_stamp = render_stamp
+        self.first_number = first_number
+        self._opening = None
+        self._stamps = {}
+
+    def stamp_for(self, geometry):
+        if geometry not in self._stamps:
+            upright_size, matrix = _stamp_placement(geometry)
+            form = build_stamp_xobject(self.render_stamp(page_size=upright_size), matrix=matrix)
+            name = f'{STAMP_PREFIX}{self.first_number + len(self._stamps)}'
+            if self._opening is None:
+                self._opening = self.add_object(content_stream(b'q\n'))
+            closing = self.add_object(content_stream(f'\nQ\nq {name} Do Q\n'.encode()))
+            self._stamps[geometry] = (name, self.add_object(form), self._opening, closing)
+        return self._stamps[geometry]
+
+    def stamp(self, page):
+        apply_stamp(page, *self.stamp_for(page_geometry(page)))
+
+def write_pdf(writer, f, compact=0, metrics=None):
+    # compact: a compact.COMPACT_* level; 0 writes what PyPDF2 writes
+    if compact:
+        from compact import write_compact
+        write_compact(writer, f, compact, metrics)
+    else:
         writer.write(f)
 
-def add_watermark_docx(input_path, watermark_text, output_path, color=(80,80,80), opacity=80, position='Center Diagonal', font_size=48):
-    doc = Document(input_path)
-    for section in doc.sections:
+def add_watermark_pdf(input_path, watermark_text, output_path, color=(80,80,80), opacity=80, position='Center Diagonal', font_size=48, password=None, progress_callback=None, metrics=None, cancel_token=None, compact=0):
+    from PyPDF2 import PdfReader, PdfWriter
+    metrics = metrics or NULL_METRICS
+    with metrics.stage('parse', bytes=size_of(input_path)) as stage:
+        reader = PdfReader(pdf_source(input_path))
+        total_pages = stage.pages = len(reader.pages)
+    writer = PdfWriter()
+    render = functools.partial(render_watermark_pdf, watermark_text, color=color, opacity=opacity, position=position, font_size=font_size)
+    stamper = XObjectStamper(writer._add_object, timed(metrics, 'render', render), first_stamp_number(reader.pages))
+    with metrics.stage('stamp', pages=total_pages):
+        for i, page in enumerate(reader.pages):
+            if cancel_token:
+                cancel_token.check()
+            stamper.stamp(writer.add_page(page))
+            if progress_callback:
+                progress_callback(i + 1, total_pages)
+    # Encrypting here saves the second parse/write pass encrypt_pdf would need
+    if password:
+        with metrics.stage('encrypt'):
+            writer.encrypt(password)
+    with metrics.stage('write', pages=total_pages) as stage, open_destination(output_path) as f:
+        write_pdf(writer, f, compact, metrics)
+        stage.bytes = position_of(f)
+    return total_pages
+
+def add_watermark_docx(input_path, watermark_text, output_path, color=(80,80,80), opacity=80, position='Center Diagonal', font_size=48, metrics=None, cancel_token=None):
+    from docx import Document
+    from docx.shared import Inches as DocxInches
+    metrics = metrics or NULL_METRICS
+    with metrics.stage('parse', bytes=size_of(input_path)):
+        doc = Document(pdf_source(input_path))
+    render = timed(metrics, 'render', watermark_image_png)
+    for i, section in enumerate(doc.sections):
+        if cancel_token:
+            cancel_token.check()
+        # Linked headers show the previous section's header, which already has the picture
+        if i and section.header.is_linked_to_previous:
+            continue
         page_width_in = section.page_width / 914400  # EMU to inches
         page_height_in = section.page_height / 914400
         img_width_px = int(page_width_in * DPI)
         img_height_px = int(page_height_in * 0.15 * DPI)  # 15% of page height
-        watermark_img = generate_watermark_image(watermark_text, width=img_width_px, height=img_height_px, color=color, opacity=opacity, font_size=font_size, position=position)
+        watermark_img = render(watermark_text, width=img_width_px, height=img_height_px, color=color, opacity=opacity, font_size=font_size, position=position)
         section.header_distance = DocxInches(1.5)
         header = section.header
         for shape in header._element.xpath('.//w:drawing'):
             shape.getparent().remove(shape)
         paragraph = header.paragraphs[0] if header.paragraphs else header.add_paragraph()
         run = paragraph.add_run()
-        run.add_picture(watermark_img, width=DocxInches(page_width_in))
+        run.add_picture(BytesIO(watermark_img), width=DocxInches(page_width_in))
         paragraph.alignment = 1  # Center
-        os.unlink(watermark_img)
-    doc.save(output_path)
+    with metrics.stage('save') as stage, open_destination(output_path) as f:
+        doc.save(f)
+        stage.bytes = position_of(f)
+
+VML_NAMESPACES = ('xmlns:v="urn:schemas-microsoft-com:vml" xmlns:o="urn:schemas-microsoft-com:office:office" '
+                  'xmlns:w10="urn:schemas-microsoft-com:office:word"')
+# Word's plain-text WordArt shape type, the same one its own Design > Watermark inserts
+VML_TEXT_SHAPETYPE = (
+    '<v:shapetype id="_x0000_t136" coordsize="21600,21600" o:spt="136" adj="10800" path="m@7,l@8,m@5,21600l@6,21600e">'
+    '<v:formulas><v:f eqn="sum #0 0 10800"/><v:f eqn="prod #0 2 1"/><v:f eqn="sum 21600 0 @1"/><v:f eqn="sum 0 0 @2"/>'
+    '<v:f eqn="sum 21600 0 @3"/><v:f eqn="if @0 @3 0"/><v:f eqn="if @0 21600 @1"/><v:f eqn="if @0 0 @2"/>'
+    '<v:f eqn="if @0 @4 21600"/><v:f eqn="mid @5 @6"/><v:f eqn="mid @8 @5"/><v:f eqn="mid @7 @8"/>'
+    '<v:f eqn="mid @6 @7"/><v:f eqn="sum @6 0 @5"/></v:formulas>'
+    '<v:path textpathok="t" o:connecttype="custom" o:connectlocs="@9,0;@10,10800;@11,21600;@12,10800" o:connectangles="270,180,90,0"/>'
+    '<v:textpath on="t" fitshape="t"/><v:handles><v:h position="#0,bottomRight" xrange="6629,14971"/></v:handles>'
+    '<o:lock v:ext="edit" text="t" shapetype="t"/></v:shapetype>'
+)
+# Word recognises shapes with this id prefix as watermarks (Design > Watermark > Remove finds them)
+VML_SHAPE_PREFIX = 'PowerPlusWaterMarkObject'
+VML_SHAPE_TAG = '{urn:schemas-microsoft-com:vml}shape'
+
+def stamp_box(watermark_text, position, font_size, page_width, page_height):
+    # Text box (left, top, width, height, rotation) in points from the top-left
+    # corner, placed like the PDF stamp; used by the Word and PowerPoint paths
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+    width = stringWidth(watermark_text, 'Helvetica', font_size)
+    height = font_size
+    tx, ty, align = stamp_anchor(page_width, page_height, position)
+    if position.startswith('Top'):
+        ty -= font_size * 0.75
+    if align == 'left':
+        left = tx
+    elif align == 'right':
+        left = tx - width
+    else:
+        left = tx - width / 2
+    if position == 'Center Diagonal':
+        return left, page_height - ty - height / 2, width, height, 315
+    return left, page_height - ty - height * 0.75, width, height, 0
 
-def encrypt_pdf(input_pdf, output_pdf, password):
-    reader = PdfReader(input_pdf)
+def vml_watermark_style(watermark_text, position, font_size, page_width, page_height):
+    left, top, width, height, rotation = stamp_box(watermark_text, position, font_size, page_width, page_height)
+    style = (f'position:absolute;margin-left:{left:.1f}pt;margin-top:{top:.1f}pt;width:{width:.1f}pt;height:{height:.1f}pt;'
+             'z-index:-251657216;mso-position-horizontal-relative:page;mso-position-vertical-relative:page')
+    if rotation:
+        style += f';rotation:{rotation}'
+    return style
+
+def vml_watermark_run(shape_number, watermark_text, color, opacity, style):
+    from docx.oxml import parse_xml
+    from docx.oxml.ns import nsdecls
+    from xml.sax.saxutils import quoteattr
+    return parse_xml(
+        f'<w:r {nsdecls("w")} {VML_NAMESPACES}><w:rPr><w:noProof/></w:rPr><w:pict>{VML_TEXT_SHAPETYPE}'
+        f'<v:shape id="{VML_SHAPE_PREFIX}{shape_number}" o:spid="_x0000_s{2048 + shape_number}" type="#_x0000_t136" '
+        f'style="{style}" o:allowincell="f" fillcolor="#{color[0]:02x}{color[1]:02x}{color[2]:02x}" stroked="f">'
+        f'<v:fill opacity="{opacity / 100:.2f}"/>'
+        f'<v:textpath style="font-family:&quot;Arial&quot;;font-size:1pt" string={quoteattr(watermark_text)}/>'
+        f'<w10:wrap anchorx="page" anchory="page"/></v:shape></w:pict></w:r>'
+    )
+
+def remove_vml_watermarks(element):
+    for shape in list(element.iter(VML_SHAPE_TAG)):
+        if shape.get('id', '').startswith(VML_SHAPE_PREFIX):
+            run = shape.getparent().getparent()
+            run.getparent().remove(run)
+
+def section_headers(doc, section):
+    headers = [section.header]
+    if section.different_first_page_header_footer:
+        headers.append(section.first_page_header)
+    if doc.settings.odd_and_even_pages_header_footer:
+        headers.append(section.even_page_header)
+    return headers
+
+def add_watermark_docx_vector(input_path, watermark_text, output_path, color=(80,80,80), opacity=80, position='Center Diagonal', font_size=48, progress_callback=None, metrics=None, cancel_token=None):
+    # Writes a text watermark shape into the headers: .docx in, .docx out, no rendering
+    from docx import Document
+    metrics = metrics or NULL_METRICS
+    with metrics.stage('parse', bytes=size_of(input_path)):
+        doc = Document(pdf_source(input_path))
+    sections = doc.sections
+    stamped = set()
+    with metrics.stage('stamp', pages=len(sections)):
+        for i, section in enumerate(sections):
+            if cancel_token:
+                cancel_token.check()
+            for header in section_headers(doc, section):
+                # Linked headers show the previous section's header, which already has the shape
+                if i and header.is_linked_to_previous:
+                    continue
+                if header.part.partname in stamped:
+                    continue
+                stamped.add(header.part.partname)
+                remove_vml_watermarks(header._element)
+                style = vml_watermark_style(watermark_text, position, font_size, section.page_width.pt, section.page_height.pt)
+                paragraph = header.paragraphs[0] if header.paragraphs else header.add_paragraph()
+                paragraph._p.append(vml_watermark_run(len(stamped), watermark_text, color, opacity, style))
+            if progress_callback:
+                progress_callback(i + 1, len(sections))
+    with metrics.stage('save') as stage, open_destination(output_path) as f:
+        doc.save(f)
+        stage.bytes = position_of(f)
+
+PPTX_SHAPE_NAME = 'Watermark'
+
+def remove_pptx_watermarks(shapes):
+    for shape in list(shapes):
+        if shape.name == PPTX_SHAPE_NAME:
+            shape._element.getparent().remove(shape._element)
+
+def add_pptx_watermark_shape(shapes, watermark_text, color, opacity, position, font_size, slide_width, slide_height):
+    # Master and layout shape collections are read-only in python-pptx, so the
+    # text box element is built directly and wrapped for its text frame API
+    from pptx.dml.color import RGBColor as PptxRGBColor
+    from pptx.enum.text import MSO_AUTO_SIZE, PP_ALIGN
+    from pptx.oxml.ns import qn
+    from pptx.oxml.shapes.autoshape import CT_Shape
+    from pptx.shapes.autoshape import Shape
+    from pptx.util import Pt
+    remove_pptx_watermarks(shapes)
+    left, top, width, height, rotation = stamp_box(watermark_text, position, font_size, slide_width, slide_height)
+    # Pad the box a little so PowerPoint's own text metrics never wrap the line
+    sp = CT_Shape.new_textbox_sp(shapes._next_shape_id, PPTX_SHAPE_NAME, Pt(left - font_size * 0.1), Pt(top - font_size * 0.2), Pt(width + font_size * 0.2), Pt(height * 1.4))
+    # First in the tree, so the watermark stays behind everything else
+    shapes._spTree.insert(2, sp)
+    box = Shape(sp, shapes)
+    box.rotation = rotation
+    frame = box.text_frame
+    frame.word_wrap = False
+    frame.auto_size = MSO_AUTO_SIZE.NONE
+    frame.margin_left = frame.margin_right = frame.margin_top = frame.margin_bottom = 0
+    paragraph = frame.paragraphs[0]
+    paragraph.alignment = PP_ALIGN.CENTER
+    run = paragraph.add_run()
+    run.text = watermark_text
+    run.font.name = 'Arial'
+    run.font.size = Pt(font_size)
+    run.font.color.rgb = PptxRGBColor(*color)
+    # python-pptx has no transparency API; add the alpha to the fill colour directly
+    srgb = sp.find('.//' + qn('a:srgbClr'))
+    srgb.append(srgb.makeelement(qn('a:alpha'), {'val': str(int(opacity * 1000))}))
+    return box
+
+def shows_master_shapes(part):
+    return part._element.get('showMasterSp') not in ('0', 'false')
+
+def add_watermark_pptx(input_path, watermark_text, output_path, color=(80,80,80), opacity=80, position='Center Diagonal', font_size=48, progress_callback=None, metrics=None, cancel_token=None):
+    # The text box goes on each slide master once. Layouts and slides that hide
+    # master shapes get their own copy, so file size stays flat in the slide count.
+    from pptx import Presentation
+    metrics = metrics or NULL_METRICS
+    with metrics.stage('parse', bytes=size_of(input_path)):
+        prs = Presentation(pdf_source(input_path))
+    size = (prs.slide_width.pt, prs.slide_height.pt)
+    options = dict(color=color, opacity=opacity, position=position, font_size=font_size)
+    for master in prs.slide_masters:
+        # Master and layout work is small and fixed; it is not a separate stage
+        add_pptx_watermark_shape(master.shapes, watermark_text, slide_width=size[0], slide_height=size[1], **options)
+        for layout in master.slide_layouts:
+            if shows_master_shapes(layout):
+                remove_pptx_watermarks(layout.shapes)
+            else:
+                add_pptx_watermark_shape(layout.shapes, watermark_text, slide_width=size[0], slide_height=size[1], **options)
+    slides = prs.slides
+    total_slides = len(slides)
+    with metrics.stage('stamp', pages=total_slides):
+        for i, slide in enumerate(slides):
+            if cancel_token:
+                cancel_token.check()
+            if shows_master_shapes(slide):
+                remove_pptx_watermarks(slide.shapes)
+            else:
+                add_pptx_watermark_shape(slide.shapes, watermark_text, slide_width=size[0], slide_height=size[1], **options)
+            if progress_callback:
+                progress_callback(i + 1, total_slides)
+    with metrics.stage('save', pages=total_slides) as stage, open_destination(output_path) as f:
+        prs.save(f)
+        stage.bytes = position_of(f)
+    return total_slides
+
+def encrypt_pdf(input_pdf, output_pdf, password, metrics=None, cancel_token=None, compact=0):
+    from PyPDF2 import PdfReader, PdfWriter
+    metrics = metrics or NULL_METRICS
+    with metrics.stage('parse', bytes=size_of(input_pdf)) as stage:
+        reader = PdfReader(pdf_source(input_pdf))
+        stage.pages = len(reader.pages)
     writer = PdfWriter()
-    for page in reader.pages:
-        writer.add_page(page)
-    writer.encrypt(password)
-    with open(output_pdf, 'wb') as f:
-        writer.write(f)
+    with metrics.stage('copy', pages=len(reader.pages)):
+        for page in reader.pages:
+            if cancel_token:
+                cancel_token.check()
+            writer.add_page(page)
+    with metrics.stage('encrypt'):
+        writer.encrypt(password)
+    with metrics.stage('write', pages=len(reader.pages)) as stage, open_destination(output_pdf) as f:
+        write_pdf(writer, f, compact, metrics)
+        stage.bytes = position_of(f)
 
-def add_watermark(input_path, watermark_text, output_path, color=(80,80,80), opacity=80, position='Center Diagonal', font_size=48, password=None, progress_callback=None):
-    ext = os.path.splitext(input_path)[1].lower()
-    if ext == '.pdf':
-        temp_out = output_path if not password else output_path + '.tmp.pdf'
-        add_watermark_pdf(input_path, watermark_text, temp_out, color=color, opacity=opacity, position=position, font_size=font_size, progress_callback=progress_callback)
-        if password:
-            encrypt_pdf(temp_out, output_path, password)
-            if os.path.exists(temp_out):
-                os.remove(temp_out)
-    elif ext == '.docx':
+def _watermark_pdf(source, watermark_text, destination, output_format=None, streaming=False, memory_budget=None, memory_callback=None, shards=None, incremental=False, compact=0, **options):
+    if compact and (incremental or streaming or shards):
+        raise ValueError('Compaction needs the whole document in memory; it cannot be combined with incremental, streaming or sharded mode.')
+    if incremental:
+        if streaming or shards:
+            raise ValueError('Incremental mode cannot be combined with streaming or sharded mode.')
+        from incremental import add_watermark_pdf_incremental
+        return add_watermark_pdf_incremental(source, watermark_text, destination, **options)
+    if shards:
+        if not (is_path(source) and is_path(destination)):
+            raise ValueError('Sharded mode needs file paths for input and output.')
+        from shard import add_watermark_pdf_sharded
+        return add_watermark_pdf_sharded(source, watermark_text, destination, shards=shards, **options)
+    if streaming:
+        from pdfstream import add_watermark_pdf_streaming
+        return add_watermark_pdf_streaming(source, watermark_text, destination, memory_budget=memory_budget, memory_callback=memory_callback, **options)
+    return add_watermark_pdf(source, watermark_text, destination, compact=compact, **options)
+
+def _watermark_docx(source, watermark_text, destination, output_format=None, **options):
+    if output_format == 'docx':
+        if options.get('password'):
+            raise ValueError('Password protection is only available for PDF output.')
+        return add_watermark_docx_vector(source, watermark_text, destination, **_office_options(options))
+    from docx2pdf import convert as docx2pdf_convert
+    metrics = options['metrics']
+    cancel_token = options.get('cancel_token')
+    # docx2pdf drives Word through files, so this path still needs temporary files
+    temp_paths = []
+    try:
+        if not is_path(source):
+            with NamedTemporaryFile(delete=False, suffix='.docx') as temp_docx, open_source(source) as f:
+                shutil.copyfileobj(f, temp_docx)
+            temp_paths.append(temp_docx.name)
+            source = temp_docx.name
         with NamedTemporaryFile(delete=False, suffix='.pdf') as temp_pdf:
             temp_pdf_path = temp_pdf.name
-        try:
-            docx2pdf_convert(input_path, temp_pdf_path)
-            temp_out = output_path if not password else output_path + '.tmp.pdf'
-            add_watermark_pdf(temp_pdf_path, watermark_text, temp_out, color=color, opacity=opacity, position=position, font_size=font_size, progress_callback=progress_callback)
-            if password:
-                encrypt_pdf(temp_out, output_path, password)
-                if os.path.exists(temp_out):
-                    os.remove(temp_out)
-        finally:
-            if os.path.exists(temp_pdf_path):
-                os.remove(temp_pdf_path)
-    else:
-        raise ValueError('Only PDF and Word (.docx) files are supported.') 
\ No newline at end of file
+        temp_paths.append(temp_pdf_path)
+        # Word cannot be interrupted mid-conversion, so the token is checked around it
+        if cancel_token:
+            cancel_token.check()
+        with metrics.stage('convert', bytes=size_of(source)):
+            docx2pdf_convert(source, temp_pdf_path)
+        return _watermark_pdf(temp_pdf_path, watermark_text, destination, **options)
+    finally:
+        for path in temp_paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+def _watermark_pptx(source, watermark_text, destination, output_format=None, **options):
+    if options.get('password'):
+        raise ValueError('Password protection is only available for PDF output.')
+    return add_watermark_pptx(source, watermark_text, destination, **_office_options(options))
+
+def _office_options(options):
+    # Streaming, sharding, incremental updates, compaction and passwords only apply to PDF output
+    return {name: options[name] for name in ('color', 'opacity', 'position', 'font_size', 'progress_callback', 'metrics', 'cancel_token')}
+
+class Backend:
+    """A document format: the modules it needs and the function that watermarks it.
+
+    Nothing is imported until the backend is first used or preloaded.
+    """
+
+    def __init__(self, name, modules, watermark):
+        self.name = name
+        self.modules = modules
+        self.watermark = watermark
+
+    def preload(self):
+        for module in self.modules:
+            importlib.import_module(module)
+
+# Input extension -> Backend
+BACKENDS = {}
+UNSUPPORTED_FORMAT = 'Only PDF, Word (.docx) and PowerPoint (.pptx) files are supported.'
+
+def register_backend(extension, name, modules, watermark):
+    BACKENDS[extension.lower()] = Backend(name, modules, watermark)
+
+def backend_for(file_format):
+    backend = BACKENDS.get('.' + file_format.lower().lstrip('.'))
+    if backend is None:
+        raise ValueError(UNSUPPORTED_FORMAT)
+    return backend
+
+def preload(*file_formats):
+    # Imports what the given formats (all of them by default) need. Pass it as a
+    # process pool initializer so workers warm up before their first job arrives.
+    for file_format in file_formats or tuple(BACKENDS):
+        backend_for(file_format).preload()
+
+register_backend('.pdf', 'PDF', ('PyPDF2', 'reportlab.pdfgen.canvas'), _watermark_pdf)
+register_backend('.docx', 'Word', ('docx', 'docx2pdf', 'PyPDF2', 'reportlab.pdfgen.canvas'), _watermark_docx)
+register_backend('.pptx', 'PowerPoint', ('pptx', 'reportlab.pdfbase.pdfmetrics'), _watermark_pptx)
+
+def add_watermark_stream(source, watermark_text, destination, file_format='pdf', color=(80,80,80), opacity=80, position='Center Diagonal', font_size=48, password=None, progress_callback=None, streaming=False, memory_budget=None, memory_callback=None, shards=None, output_format=None, metrics=None, incremental=False, cache=None, cancel_token=None, compact=0):
+    # source: path, bytes, memoryview or binary file object; destination: path or writable binary stream.
+    # incremental=True appends the watermark to an unchanged copy of a PDF instead of rewriting it.
+    # output_format='docx' keeps Word documents as Word documents instead of converting them to PDF.
+    # metrics: a metrics.Metrics that receives per-stage timing events.
+    # cache: a cache.ResultCache; repeated jobs are served from it instead of being stamped again.
+    # cancel_token: a progress.CancelToken; cancelling it raises Cancelled at the next page and
+    # removes partial output files (partial writes to a stream destination stay in the stream).
+    # compact: a compact.COMPACT_* level (0-3) for smaller PDFs at the cost of write time.
+    if cache is not None:
+        from cache import watermark_cached
+        return watermark_cached(cache, source, watermark_text, destination, file_format=file_format, color=color, opacity=opacity, position=position, font_size=font_size, password=password, progress_callback=progress_callback, streaming=streaming, memory_budget=memory_budget, memory_callback=memory_callback, shards=shards, output_format=output_format, metrics=metrics, incremental=incremental, cancel_token=cancel_token, compact=compact)
+    backend = backend_for(file_format)
+    output_format = (output_format or 'pdf').lower().lstrip('.')
+    metrics = metrics or NULL_METRICS
+    return backend.watermark(source, watermark_text, destination, output_format=output_format, color=color, opacity=opacity, position=position, font_size=font_size, password=password, progress_callback=progress_callback, streaming=streaming, memory_budget=memory_budget, memory_callback=memory_callback, shards=shards, metrics=metrics, incremental=incremental, cancel_token=cancel_token, compact=compact)
+
+def add_watermark_bytes(data, watermark_text, file_format='pdf', **options):
+    output = BytesIO()
+    add_watermark_stream(data, watermark_text, output, file_format=file_format, **options)
+    return output.getvalue()
+
+def add_watermark(input_path, watermark_text, output_path, color=(80,80,80), opacity=80, position='Center Diagonal', font_size=48, password=None, progress_callback=None, streaming=False, memory_budget=None, memory_callback=None, shards=None, metrics=None, incremental=False, cache=None, cancel_token=None, compact=0):
+    ext = os.path.splitext(input_path)[1].lower()
+    backend_for(ext)
+    # Word documents saved as .docx get the vector watermark, anything else is converted to PDF
+    output_format = os.path.splitext(output_path)[1].lower()
+    return add_watermark_stream(input_path, watermark_text, output_path, file_format=ext, color=color, opacity=opacity, position=position, font_size=font_size, password=password, progress_callback=progress_callback, streaming=streaming, memory_budget=memory_budget, memory_callback=memory_callback, shards=shards, output_format='docx' if output_format == '.docx' else None, metrics=metrics, incremental=incremental, cache=cache, cancel_token=cancel_token, compact=compact)
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m watermark', description='Add text watermarks to PDF, Word and PowerPoint documents.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    import batch
+    batch_parser = subparsers.add_parser('batch', help='Watermark many documents in parallel')
+    batch.add_arguments(batch_parser)
+    batch_parser.set_defaults(func=batch.main)
+    import mailmerge
+    merge_parser = subparsers.add_parser('mailmerge', help='Write one copy of a PDF per recipient, each with its own watermark')
+    mailmerge.add_arguments(merge_parser)
+    merge_parser.set_defaults(func=mailmerge.main)
+    import service
+    serve_parser = subparsers.add_parser('serve', help='Run a local HTTP watermarking service')
+    service.add_arguments(serve_parser)
+    serve_parser.set_defaults(func=service.main)
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == '__main__':
+    # batch and service import watermark; reuse this module instead of loading a second copy
+    sys.modules.setdefault('watermark', sys.modules[__name__])
+    sys.exit(main())